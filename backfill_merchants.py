@@ -0,0 +1,105 @@
+"""Merge the spellings of each merchant in receipts saved before canonicalization.
+
+    python backfill_merchants.py --email me@example.com [--dry-run]
+
+Credentials are read as in ingest.py (TICKETSCAN_PASSWORD for the account).
+Every receipt's extracted name (``merchant_raw``, else ``merchant``) is
+resolved against a fresh merchant dictionary, most frequent spelling
+first, so "OXXO TIENDA 123" and "Oxxo S.A. de C.V." land on the name most
+receipts already use. Receipts whose canonical name differs are renamed
+(the database trigger re-points ``merchant_id``) and merchants left
+without receipts are deleted. Re-running is a no-op.
+"""
+from collections import Counter
+import argparse
+import logging
+import time
+
+from ingest import supabase_session
+from modules.line_items import normalize_item
+from modules.merchants import MerchantIndex, factura_rfc
+from modules.supabase_client import (
+    get_user_receipts,
+    get_merchants,
+    rename_merchant,
+    delete_merchants,
+)
+
+
+COLUMNS = "id, created_at, merchant, merchant_raw, rfc, file_type"
+
+
+def all_receipts(user_id: str, client, page_size: int) -> list:
+    rows = []
+    cursor = None
+    while True:
+        page = get_user_receipts(
+            user_id, columns=COLUMNS, limit=page_size, cursor=cursor, client=client
+        )
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        cursor = (page[-1]["created_at"], page[-1]["id"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill canonical merchant names.")
+    parser.add_argument("--email", help="account whose merchants are merged")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--chunk", type=int, default=200, help="receipts per update")
+    parser.add_argument("--dry-run", action="store_true", help="print the merges only")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    user, client = supabase_session(args.email)
+
+    started = time.perf_counter()
+    rows = all_receipts(user["id"], client, args.page_size)
+
+    # One resolution per distinct (spelling, RFC); the commonest spelling
+    # of a merchant becomes its canonical name.
+    groups = {}
+    for row in rows:
+        raw = row.get("merchant_raw") or row.get("merchant")
+        rfc = factura_rfc({"document_type": row.get("file_type"), "rfc": row.get("rfc")})
+        if raw:
+            groups.setdefault((raw, rfc), []).append(row)
+    counts = Counter({group: len(members) for group, members in groups.items()})
+
+    index = MerchantIndex()
+    canonical = set()
+    renames = {}
+    for (raw, rfc), _ in counts.most_common():
+        merchant = index.resolve(raw, rfc)
+        canonical.add(normalize_item(merchant))
+        for row in groups[(raw, rfc)]:
+            if row["merchant"] != merchant or row.get("merchant_raw") != raw:
+                renames.setdefault((merchant, raw), []).append(row["id"])
+
+    merged = sorted({(merchant, raw) for merchant, raw in renames if merchant != raw})
+    for merchant, raw in merged:
+        print(f"{raw!r} -> {merchant!r}")
+
+    updated = 0
+    if not args.dry_run:
+        for (merchant, raw), ids in renames.items():
+            for start in range(0, len(ids), args.chunk):
+                chunk = ids[start:start + args.chunk]
+                rename_merchant(chunk, user["id"], merchant, raw, client=client)
+                updated += len(chunk)
+        orphans = [
+            merchant["id"] for merchant in get_merchants(user["id"], client=client)
+            if normalize_item(merchant["name"]) not in canonical
+        ]
+        if orphans:
+            delete_merchants(orphans, user["id"], client=client)
+        print(f"{len(orphans)} unused merchants deleted")
+
+    elapsed = time.perf_counter() - started
+    print(f"\n{len(rows)} receipts, {len(groups)} spellings -> {len(canonical)} merchants, "
+          f"{updated} receipts updated in {elapsed:.1f}s"
+          + (" (dry run)" if args.dry_run else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Generate previews for receipts saved before thumbnails existed.
+
+    python backfill_thumbnails.py --email me@example.com [--workers 8]
+
+Credentials are read as in ingest.py (TICKETSCAN_PASSWORD for the account).
+Each stored file is downloaded once, shrunk to a small JPEG, uploaded next
+to the original and its URL written to ``thumbnail_url``. Rows that fail
+keep ``thumbnail_url`` empty, so re-running picks them up again.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import mimetypes
+import argparse
+import logging
+import time
+
+from ingest import supabase_session
+from modules.image_processing import make_thumbnail, THUMBNAIL_SIZE
+from modules.supabase_client import (
+    download_file,
+    upload_thumbnail,
+    get_receipts_without_thumbnail,
+    set_thumbnail_url,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_one(row: dict, user_id: str, client, size: int):
+    file_url = row["file_url"]
+    mime_type = mimetypes.guess_type(file_url)[0] or "application/octet-stream"
+    thumbnail = make_thumbnail(download_file(file_url, client=client), mime_type, size=size)
+    if thumbnail is None:
+        return None
+    thumbnail_url = upload_thumbnail(thumbnail, file_url, user_id, client=client)
+    set_thumbnail_url(row["id"], user_id, thumbnail_url, client=client)
+    return len(thumbnail)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill receipt thumbnails.")
+    parser.add_argument("--email", help="account whose receipts get thumbnails")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--size", type=int, default=THUMBNAIL_SIZE,
+                        help="longest side of the preview in pixels")
+    parser.add_argument("--limit", type=int, help="stop after this many receipts")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    user, client = supabase_session(args.email)
+
+    started = time.perf_counter()
+    done = skipped = failed = 0
+    total_bytes = 0
+    after = None
+
+    def work(row):
+        try:
+            return row, backfill_one(row, user["id"], client, args.size), None
+        except Exception as e:
+            return row, None, e
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        while args.limit is None or done + skipped + failed < args.limit:
+            page_size = args.page_size
+            if args.limit is not None:
+                page_size = min(page_size, args.limit - done - skipped - failed)
+            rows = get_receipts_without_thumbnail(
+                user["id"], after=after, limit=page_size, client=client
+            )
+            if not rows:
+                break
+            after = rows[-1]["id"]
+
+            for row, size, error in pool.map(work, rows):
+                if error is not None:
+                    failed += 1
+                    logger.warning(f"FAIL {row['id']}: {error}")
+                elif size is None:
+                    skipped += 1
+                else:
+                    done += 1
+                    total_bytes += size
+            print(f"{done} thumbnails, {skipped} skipped, {failed} failed")
+
+    elapsed = time.perf_counter() - started
+    average = total_bytes / done / 1024 if done else 0
+    print(f"\n{done} thumbnails in {elapsed:.1f}s "
+          f"({done / elapsed if elapsed else 0:.1f}/s, {average:.1f} KB each), "
+          f"{skipped} without a preview, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
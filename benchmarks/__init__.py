@@ -0,0 +1 @@
+# Init module
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""HISTORY render time against row count: one card widget tree per row versus one HTML block.
+
+    python -m benchmarks.history_render [--rows 20 100 500 1000] [--repeat 3]
+
+Each mode runs headless through Streamlit's AppTest, which executes the
+script and serializes every element it produces, as a real rerun would:
+
+- ``per-row``: ``render_receipt_card`` for every row (container, columns,
+  two markdown blocks and a button each)
+- ``batched``: ``render_receipt_list`` with the whole list in one window
+- ``windowed``: ``render_receipt_list`` with the default window
+"""
+from streamlit.testing.v1 import AppTest
+import argparse
+import logging
+import random
+import time
+
+
+SCRIPT = """
+import streamlit as st
+from modules.utils import render_receipt_card, render_receipt_list
+
+rows = st.session_state.rows
+mode = st.session_state.mode
+if mode == "per-row":
+    for row in rows:
+        render_receipt_card(
+            merchant=row.get("merchant") or "Unknown",
+            date=str(row.get("created_at") or "--")[:10],
+            total=float(row.get("total") or 0),
+            currency=row.get("currency") or "USD",
+            category=row.get("category") or "OTHER",
+            summary=row.get("summary") or "",
+            file_url=row.get("file_url"),
+            thumbnail_url=row.get("thumbnail_url"),
+            key=f"card_{row['id']}",
+        )
+elif mode == "batched":
+    render_receipt_list(rows, key="history", window=len(rows))
+else:
+    render_receipt_list(rows, key="history")
+"""
+
+MERCHANTS = ["OXXO", "Farmacia Guadalajara", "Soriana", "Walmart", "Starbucks", "Pemex"]
+CATEGORIES = ["Food", "Health", "Shopping", "Transport", "Services"]
+
+
+def synthetic_rows(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    rows = []
+    for n in range(count):
+        merchant = rng.choice(MERCHANTS)
+        rows.append({
+            "id": f"00000000-0000-0000-0000-{n:012d}",
+            "created_at": f"2026-{rng.randint(1, 9):02d}-{rng.randint(1, 28):02d}T12:00:00+00:00",
+            "merchant": merchant,
+            "total": round(rng.uniform(20, 2500), 2),
+            "currency": "MXN",
+            "category": rng.choice(CATEGORIES),
+            "summary": f"Compra en {merchant} de varios productos.",
+            "file_url": f"https://example.supabase.co/storage/v1/object/public/tickets/{n}.jpg",
+            "thumbnail_url": f"https://example.supabase.co/storage/v1/object/public/tickets/{n}.thumb.jpg",
+            "file_type": "Ticket",
+        })
+    return rows
+
+
+def render(mode: str, rows: list):
+    at = AppTest.from_string(SCRIPT, default_timeout=120)
+    at.session_state["rows"] = rows
+    at.session_state["mode"] = mode
+    started = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    elements = len(at.markdown) + len(at.button) + len(at.multiselect) + len(at.radio)
+    html = sum(len(m.value) for m in at.markdown)
+    return elapsed, elements, html
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[20, 100, 500, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    # Session state set outside a script run warns on every access.
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+
+    print(f"{'rows':>5s} {'mode':9s} {'render':>9s} {'elements':>9s} {'markdown':>10s}")
+    for count in args.rows:
+        rows = synthetic_rows(count)
+        for mode in ("per-row", "batched", "windowed"):
+            runs = [render(mode, rows) for _ in range(args.repeat)]
+            elapsed = min(run[0] for run in runs)
+            _, elements, html = runs[0]
+            print(f"{count:5d} {mode:9s} {1000 * elapsed:7.0f}ms {elements:9d} "
+                  f"{html / 1024:8.0f}KB")
+
+
+if __name__ == "__main__":
+    main()
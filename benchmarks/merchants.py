@@ -0,0 +1,87 @@
+"""Merchant canonicalization cost: trigram index versus comparing every merchant.
+
+    python -m benchmarks.merchants [--merchants 5000] [--names 20000]
+
+Builds a dictionary of synthetic merchant names, then resolves noisy
+spellings of them (case, legal form, branch and store code, a dropped
+letter) the way ``canonicalize`` does at save time:
+
+- ``scan``: Dice similarity against every merchant in the dictionary
+- ``index``: ``MerchantIndex.resolve`` (exact key, then the trigram postings)
+
+Reports the time per name and how many spellings each approach sent back
+to the merchant they came from.
+"""
+import argparse
+import random
+import time
+
+from modules.merchants import MerchantIndex, merchant_key, _trigrams, MATCH_THRESHOLD
+
+
+WORDS = [
+    "farmacia", "tienda", "abarrotes", "super", "comercial", "cafe", "restaurante", "taqueria",
+    "ferreteria", "papeleria", "panaderia", "gasolinera", "estetica", "lavanderia", "optica",
+    "carniceria", "fruteria", "dulceria", "libreria", "zapateria", "el", "la", "don", "santa",
+    "norte", "sur", "centro", "real", "nueva", "del", "valle", "sol", "luna", "hermanos",
+]
+SUFFIXES = ["", " S.A. de C.V.", " SA DE CV", " Sucursal Centro", " Tienda 123", " 4521", " SUC 7"]
+
+
+def synthetic_merchants(count: int, rng: random.Random) -> list:
+    names = set()
+    while len(names) < count:
+        names.add(" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title())
+    return sorted(names)
+
+
+def misspell(name: str, rng: random.Random) -> str:
+    if len(name) > 12 and rng.random() < 0.3:
+        position = rng.randrange(1, len(name) - 1)
+        name = name[:position] + name[position + 1:]
+    name = rng.choice([name, name.upper(), name.lower()])
+    return name + rng.choice(SUFFIXES)
+
+
+def scan_resolve(merchants: list, name: str):
+    trigrams = _trigrams(merchant_key(name))
+    best, score = None, 0.0
+    for merchant, merchant_trigrams in merchants:
+        dice = 2 * len(trigrams & merchant_trigrams) / (len(trigrams) + len(merchant_trigrams))
+        if dice > score:
+            best, score = merchant, dice
+    return best if score >= MATCH_THRESHOLD else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--merchants", type=int, default=5000)
+    parser.add_argument("--names", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    merchants = synthetic_merchants(args.merchants, rng)
+    names = [(merchant, misspell(merchant, rng))
+             for merchant in (rng.choice(merchants) for _ in range(args.names))]
+
+    start = time.perf_counter()
+    index = MerchantIndex({"name": merchant, "rfc": None} for merchant in merchants)
+    print(f"{len(merchants)} merchants indexed in {(time.perf_counter() - start) * 1000:.0f} ms\n")
+
+    scan = [(merchant, _trigrams(merchant_key(merchant))) for merchant in merchants]
+    sample = names[:max(1, len(names) // 20)]
+    start = time.perf_counter()
+    scan_hits = sum(scan_resolve(scan, name) == merchant for merchant, name in sample)
+    scan_us = (time.perf_counter() - start) / len(sample) * 1e6
+
+    start = time.perf_counter()
+    index_hits = sum(index.resolve(name) == merchant for merchant, name in names)
+    index_us = (time.perf_counter() - start) / len(names) * 1e6
+
+    print(f"{'':<8} {'per name':>10} {'matched':>9}")
+    print(f"{'scan':<8} {scan_us:>8.0f}us {scan_hits / len(sample):>8.1%}")
+    print(f"{'index':<8} {index_us:>8.0f}us {index_hits / len(names):>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
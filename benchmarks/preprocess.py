@@ -0,0 +1,80 @@
+"""Bytes saved and time per stage of the image preprocessing step.
+
+    python -m benchmarks.preprocess [DIR] [--max-dimension 1600] [--format JPEG]
+
+Without DIR a set of synthetic phone-sized receipt photos is generated.
+"""
+from PIL import Image, ImageDraw, ImageFilter
+import argparse
+import random
+import time
+import io
+import os
+
+from modules.image_processing import preprocess_image, MAX_DIMENSION
+
+
+def synthetic_receipts(count: int = 8, size=(3024, 4032)):
+    rng = random.Random(0)
+    for n in range(count):
+        image = Image.new("RGB", size, (rng.randint(200, 240),) * 3)
+        draw = ImageDraw.Draw(image)
+        paper = (size[0] // 6, size[1] // 10, size[0] * 5 // 6, size[1] * 9 // 10)
+        draw.rectangle(paper, fill=(250, 248, 240))
+        for y in range(paper[1] + 80, paper[3] - 80, 90):
+            width = rng.randint(size[0] // 4, size[0] * 3 // 5)
+            draw.rectangle((paper[0] + 60, y, paper[0] + 60 + width, y + 40), fill=(40, 40, 40))
+        image = image.filter(ImageFilter.GaussianBlur(1.5))
+        noise = Image.effect_noise(size, 12).convert("RGB")
+        image = Image.blend(image, noise, 0.08)
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=95)
+        yield f"synthetic_{n}.jpg", out.getvalue(), "image/jpeg"
+
+
+def load_fixtures(directory: str):
+    for name in sorted(os.listdir(directory)):
+        ext = name.rsplit(".", 1)[-1].lower()
+        if ext in ("jpg", "jpeg", "png", "webp"):
+            with open(os.path.join(directory, name), "rb") as f:
+                mime = "image/jpeg" if ext in ("jpg", "jpeg") else f"image/{ext}"
+                yield name, f.read(), mime
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?")
+    parser.add_argument("--max-dimension", type=int, default=MAX_DIMENSION)
+    parser.add_argument("--format", choices=["JPEG", "WEBP"], default="JPEG")
+    args = parser.parse_args(argv)
+
+    fixtures = load_fixtures(args.directory) if args.directory else synthetic_receipts()
+
+    timings = {}
+    before = after = count = 0
+    elapsed = 0.0
+    for name, data, mime in fixtures:
+        started = time.perf_counter()
+        processed, _ = preprocess_image(
+            data, mime, max_dimension=args.max_dimension, fmt=args.format, timings=timings
+        )
+        elapsed += time.perf_counter() - started
+        before += len(data)
+        after += len(processed)
+        count += 1
+        print(f"{name:30s} {len(data) / 1024:9.0f} KB -> {len(processed) / 1024:7.0f} KB")
+
+    if not count:
+        print("No images found.")
+        return
+
+    print(
+        f"\n{count} images: {before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.2f} MB "
+        f"({100 * (1 - after / before):.1f}% saved), {1000 * elapsed / count:.0f} ms/image"
+    )
+    for stage, seconds in timings.items():
+        print(f"  {stage:10s} {1000 * seconds / count:7.1f} ms/image")
+
+
+if __name__ == "__main__":
+    main()
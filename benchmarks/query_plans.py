@@ -0,0 +1,152 @@
+"""Query plans of the local HISTORY, search, filter and STATS reads: every one must be index-served.
+
+    python -m benchmarks.query_plans [--rows 5000] [--users 5] [--verbose]
+
+Builds a throwaway receipts.db through ``local_db.connect`` (so it has
+every migration), fills it with synthetic receipts for several users,
+then runs the real ``local_db`` read functions with a trace callback and
+asks SQLite for the ``EXPLAIN QUERY PLAN`` of each statement they ran.
+
+A plan fails when it reads receipts without an index (``SCAN receipts``),
+or when a HISTORY read sorts in a temporary b-tree, which means no index
+returns rows in page order. Exits non-zero when any plan fails. The same
+checks run as part of the test suite (tests/test_query_plans.py).
+"""
+import tempfile
+import argparse
+import random
+import sys
+import os
+
+from modules import local_db
+
+
+MERCHANTS = [f"Merchant {n}" for n in range(200)]
+CATEGORIES = ["Food", "Health", "Shopping", "Transport", "Services", "Other"]
+
+# name -> (function, args) run against the first user; the cursor of the
+# second HISTORY page is filled in from the first one.
+PAGE = {"columns": "id, created_at, merchant, total", "limit": 21}
+CHECKS = {
+    "history page": (local_db.get_user_receipts, PAGE),
+    "history next page": (local_db.get_user_receipts, PAGE),
+    "history merchant filter": (
+        local_db.get_user_receipts, {**PAGE, "merchants": MERCHANTS[:3]},
+    ),
+    "history date filter": (
+        local_db.get_user_receipts, {**PAGE, "start": "2026-03-01", "end": "2026-05-01"},
+    ),
+    "search": (local_db.search_receipts, {**PAGE, "query": "producto"}),
+    "search merchant filter": (
+        local_db.search_receipts, {**PAGE, "query": "producto 3", "merchants": MERCHANTS[:3]},
+    ),
+    "filter options": (local_db.get_filter_options, {}),
+    "duplicate hashes": (local_db.find_saved_hashes, {"hashes": ["hash-1", "hash-2"]}),
+    "stats": (local_db.get_receipt_stats, {}),
+    "stats in MXN": (local_db.get_receipt_stats, {"currency": "MXN"}),
+    "item stats": (local_db.get_item_stats, {}),
+    "item price history": (local_db.get_item_price_history, {"query": "producto 3"}),
+}
+
+
+def synthetic_receipts(count: int, rng: random.Random) -> list:
+    receipts = []
+    for n in range(count):
+        receipts.append({
+            "merchant": rng.choice(MERCHANTS),
+            "total": round(rng.uniform(20, 2500), 2),
+            "currency": rng.choice(["MXN", "MXN", "USD"]),
+            "category": rng.choice(CATEGORIES),
+            "narrative_summary": "Compra.",
+            "items": [
+                {"item": f"Producto {i}", "price": 10.0 + i} for i in range(rng.randint(1, 5))
+            ],
+            "content_hash": f"hash-{n}",
+        })
+    return receipts
+
+
+def populate(conn, rows: int, users: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    user_ids = [f"00000000-0000-0000-0000-{n:012d}" for n in range(users)]
+    for user_id in user_ids:
+        local_db.save_receipts(conn, synthetic_receipts(rows, rng), user_id)
+    # Spread created_at over the year; save_receipts stamps them all "now".
+    with conn:
+        conn.execute("""
+            UPDATE receipts SET created_at = strftime(
+                '%Y-%m-%dT%H:%M:%f+00:00', '2026-01-01', '+' || (abs(random()) % 300) || ' days'
+            )
+        """)
+    local_db.save_fx_rates(conn, [
+        ("MXN", f"2026-{month:02d}-{day:02d}", 17.0 + rng.random() * 2)
+        for month in range(1, 13) for day in range(1, 29)
+    ], user_ids[0])
+    return user_ids
+
+
+def explain(conn, statement: str) -> list:
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}")]
+
+
+def run_checks(conn, user_id: str) -> list:
+    """``(name, plan, bad)`` for each read the CHECKS ran; ``bad`` holds the failing plan lines."""
+    results = []
+    cursor = None
+    for name, (fn, kwargs) in CHECKS.items():
+        kwargs = dict(kwargs)
+        if name == "history next page":
+            kwargs["cursor"] = cursor
+        statements = []
+        conn.set_trace_callback(statements.append)
+        try:
+            result = fn(conn, user_id=user_id, **kwargs)
+        finally:
+            conn.set_trace_callback(None)
+        if name == "history page":
+            cursor = (result[-1]["created_at"], result[-1]["id"])
+
+        for statement in statements:
+            if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+                continue
+            plan = explain(conn, statement)
+            bad = [
+                detail for detail in plan
+                if detail.startswith("SCAN") and "INDEX" not in detail
+                and detail.split()[1] in ("receipts", "r")
+            ]
+            if name.startswith("history"):
+                bad += [detail for detail in plan if "TEMP B-TREE FOR ORDER BY" in detail]
+            results.append((name, plan, bad))
+    return results
+
+
+def check(conn, user_id: str, verbose: bool = False) -> int:
+    failures = 0
+    for name, plan, bad in run_checks(conn, user_id):
+        failures += bool(bad)
+        print(f"{'FAIL' if bad else 'ok  '} {name}")
+        if bad or verbose:
+            for detail in plan:
+                print(f"       {detail}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000, help="receipts per user")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = local_db.connect(os.path.join(tmp, "receipts.db"))
+        user_ids = populate(conn, args.rows, args.users)
+        failures = check(conn, user_ids[0], verbose=args.verbose)
+        conn.close()
+    print(f"{failures} plan(s) not index-served" if failures else "all plans index-served")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Receipt frame memory and time: ad-hoc per-consumer frames versus one shared typed frame.
+
+    python -m benchmarks.receipt_frame [--rows 10000 100000]
+
+``before`` mirrors the original pattern: every consumer (history filter,
+stats, export) builds a frame from all columns including ``items``, copies
+it and coerces ``created_at``/``total`` on its own. ``after`` builds one
+frame with ``build_receipt_frame`` (categoricals, float totals, datetime
+index, no ``items``) and runs the same three consumers against it.
+"""
+import pandas as pd
+import tracemalloc
+import argparse
+import random
+import time
+
+from modules.receipt_frame import build_receipt_frame, filter_frame, export_csv, frame_size
+
+
+MERCHANTS = [f"Merchant {n}" for n in range(300)]
+CATEGORIES = ["Food", "Health", "Shopping", "Transport", "Services", "Entertainment", "Other"]
+FILTER = {"merchants": MERCHANTS[:20], "start": "2026-03-01", "end": "2026-07-01"}
+
+
+def synthetic_rows(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    rows = []
+    for n in range(count):
+        merchant = rng.choice(MERCHANTS)
+        rows.append({
+            "id": f"00000000-0000-0000-0000-{n:012d}",
+            "created_at": (f"2026-{rng.randint(1, 9):02d}-{rng.randint(1, 28):02d}"
+                           f"T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00+00:00"),
+            "merchant": merchant,
+            "total": round(rng.uniform(20, 2500), 2),
+            "currency": rng.choice(["MXN", "MXN", "MXN", "USD"]),
+            "category": rng.choice(CATEGORIES),
+            "summary": f"Compra en {merchant}.",
+            "file_url": f"https://example.supabase.co/storage/v1/object/public/tickets/{n}.jpg",
+            "file_type": rng.choice(["Ticket", "Factura"]),
+            "items": [{"item": f"Producto {i}", "price": 10.0 + i} for i in range(rng.randint(1, 8))],
+        })
+    return rows
+
+
+def before(rows: list):
+    frames = []
+
+    # History filtering
+    df = pd.DataFrame(rows).copy()
+    df["created_at"] = pd.to_datetime(df["created_at"], format="ISO8601")
+    mask = (
+        df["merchant"].isin(FILTER["merchants"])
+        & (df["created_at"].dt.date >= pd.Timestamp(FILTER["start"]).date())
+        & (df["created_at"].dt.date < pd.Timestamp(FILTER["end"]).date())
+    )
+    filtered = df[mask]
+    frames.append(df)
+
+    # Stats
+    stats = pd.DataFrame(rows).copy()
+    stats["total"] = pd.to_numeric(stats["total"], errors="coerce").fillna(0)
+    stats["created_at"] = pd.to_datetime(stats["created_at"], format="ISO8601")
+    stats.groupby(["category", "currency"])["total"].sum()
+    stats.groupby(stats["created_at"].dt.strftime("%Y-%m"))["total"].sum()
+    frames.append(stats)
+
+    # Export
+    export = filtered.copy()
+    export["total"] = pd.to_numeric(export["total"], errors="coerce").fillna(0)
+    export.drop(columns=["items"]).to_csv()
+    frames.append(export)
+    return frames
+
+
+def after(rows: list):
+    frame = build_receipt_frame(rows)
+    filtered = filter_frame(frame, **FILTER)
+    frame.groupby(["category", "currency"], observed=True)["total"].sum()
+    frame.groupby(pd.Grouper(freq="MS"))["total"].sum()
+    export_csv(filtered)
+    return [frame, filtered]
+
+
+def measure(fn, rows: list, repeat: int = 3):
+    # Timed without tracing; tracemalloc slows allocation-heavy code a lot.
+    elapsed = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(rows)
+        elapsed = min(elapsed, time.perf_counter() - started)
+
+    tracemalloc.start()
+    frames = fn(rows)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    held = sum(frame_size(frame) for frame in frames)
+    return elapsed, peak, held
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args(argv)
+
+    print(f"{'rows':>7s} {'mode':7s} {'time':>8s} {'peak alloc':>11s} {'frames held':>12s}")
+    for count in args.rows:
+        rows = synthetic_rows(count)
+        # The shared frame never selects items, so they are not in its rows.
+        lean = [{k: v for k, v in row.items() if k != "items"} for row in rows]
+        for label, fn, data in (("before", before, rows), ("after", after, lean)):
+            elapsed, peak, held = measure(fn, data)
+            print(f"{count:7d} {label:7s} {elapsed:7.2f}s {peak / 2**20:8.1f} MB "
+                  f"{held / 2**20:9.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
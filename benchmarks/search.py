@@ -0,0 +1,145 @@
+"""HISTORY search latency at scale: a LIKE scan versus the local FTS5 index.
+
+    python -m benchmarks.search [--rows 100000] [--repeat 20]
+
+Fills a throwaway receipts.db (through ``local_db.connect``, so it has
+every migration) with synthetic Spanish receipts for one user, then times
+the first result page of each query:
+
+- ``like``: case-insensitive substring match of every word against
+  merchant, summary and the items JSON, newest first (what search costs
+  without an index)
+- ``fts``: ``local_db.search_receipts``, ranked with bm25
+
+Reports the median and worst time per query against the 50 ms budget.
+"""
+import statistics
+import tempfile
+import argparse
+import random
+import time
+import os
+
+from modules import local_db
+from modules.supabase_client import HISTORY_PAGE_SIZE, HISTORY_COLUMNS
+
+
+BUDGET_MS = 50
+USER_ID = "00000000-0000-0000-0000-000000000001"
+MERCHANTS = [
+    "Farmacia Guadalajara", "Farmacias del Ahorro", "Farmacias Similares", "OXXO", "Soriana",
+    "Walmart", "Chedraui", "La Comer", "Costco", "Bodega Aurrerá", "Starbucks", "Pemex",
+    "Sanborns", "Liverpool", "Home Depot", "7-Eleven", "Telcel", "CFE", "Uber", "Cinépolis",
+] + [f"Tienda {n}" for n in range(200)]
+ITEMS = [
+    "Pañales Huggies etapa 3", "Toallitas húmedas", "Leche Lala entera", "Pan Bimbo grande",
+    "Huevo blanco 18 pzas", "Tortillas de maíz", "Café americano", "Agua Ciel 1L",
+    "Paracetamol 500 mg", "Ibuprofeno 400 mg", "Shampoo Sedal", "Jabón Zote", "Papel higiénico",
+    "Detergente Ariel", "Manzanas rojas", "Plátanos", "Aguacate Hass", "Jitomate saladet",
+    "Pollo entero", "Carne molida", "Queso Oaxaca", "Yogurt natural", "Cereal Zucaritas",
+    "Galletas Marías", "Refresco Coca-Cola 600 ml", "Cerveza Modelo", "Gasolina Magna",
+    "Croquetas para perro", "Pilas AA", "Focos LED",
+] + [f"Producto genérico {n}" for n in range(500)]
+QUERIES = [
+    "pañales",
+    "farmacia pañales",
+    "oxxo",
+    "leche lala",
+    "paracetamol",
+    "gasolina",
+    "compra",
+    "croquetas perro",
+    "tienda 17",
+    "xyzzy",
+]
+
+
+def synthetic_receipts(count: int, rng: random.Random) -> list:
+    receipts = []
+    for _ in range(count):
+        merchant = rng.choice(MERCHANTS)
+        items = [
+            {"item": rng.choice(ITEMS), "price": round(rng.uniform(10, 400), 2)}
+            for _ in range(rng.randint(1, 8))
+        ]
+        receipts.append({
+            "merchant": merchant,
+            "total": sum(item["price"] for item in items),
+            "currency": "MXN",
+            "category": "Food",
+            "narrative_summary": f"Compra en {merchant} de {items[0]['item'].lower()}.",
+            "items": items,
+        })
+    return receipts
+
+
+def populate(conn, rows: int, seed: int = 0):
+    rng = random.Random(seed)
+    for _ in range(0, rows, 5000):
+        local_db.save_receipts(conn, synthetic_receipts(min(5000, rows), rng), USER_ID)
+    with conn:
+        conn.execute("""
+            UPDATE receipts SET created_at = strftime(
+                '%Y-%m-%dT%H:%M:%f+00:00', '2026-01-01', '+' || (abs(random()) % 300) || ' days'
+            )
+        """)
+
+
+def like_search(conn, query: str) -> list:
+    where = []
+    params = []
+    for word in query.split():
+        where.append("(merchant LIKE ? OR summary LIKE ? OR items LIKE ?)")
+        params.extend([f"%{word}%"] * 3)
+    return local_db._rows(conn, f"""
+        SELECT {local_db._select(HISTORY_COLUMNS)} FROM receipts
+        WHERE user_id = ? AND deleted = 0 AND {' AND '.join(where)}
+        ORDER BY created_at DESC
+        LIMIT ?
+    """, (USER_ID, *params, HISTORY_PAGE_SIZE + 1))
+
+
+def fts_search(conn, query: str) -> list:
+    return local_db.search_receipts(
+        conn, USER_ID, query, columns=HISTORY_COLUMNS, limit=HISTORY_PAGE_SIZE + 1
+    )
+
+
+def measure(fn, conn, query: str, repeat: int) -> tuple:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = fn(conn, query)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), max(times), len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = local_db.connect(os.path.join(tmp, "receipts.db"))
+        start = time.perf_counter()
+        populate(conn, args.rows)
+        print(f"{args.rows} receipts indexed in {time.perf_counter() - start:.1f} s\n")
+
+        print(f"{'query':<20} {'like med':>9} {'like max':>9} {'fts med':>9} {'fts max':>9} {'hits':>5}")
+        over = 0
+        for query in QUERIES:
+            like_med, like_max, _ = measure(like_search, conn, query, max(1, args.repeat // 5))
+            fts_med, fts_max, hits = measure(fts_search, conn, query, args.repeat)
+            flag = "" if fts_max < BUDGET_MS else "  over budget"
+            over += bool(flag)
+            print(f"{query:<20} {like_med:>7.1f}ms {like_max:>7.1f}ms "
+                  f"{fts_med:>7.1f}ms {fts_max:>7.1f}ms {hits:>5}{flag}")
+        conn.close()
+
+    print(f"\n{over} quer{'y' if over == 1 else 'ies'} over {BUDGET_MS} ms" if over
+          else f"\nevery query under {BUDGET_MS} ms")
+
+
+if __name__ == "__main__":
+    main()
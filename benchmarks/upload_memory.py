@@ -0,0 +1,181 @@
+"""Peak memory per concurrent upload: full-copy upload versus streamed TUS chunks.
+
+    python -m benchmarks.upload_memory [--size-mb 24] [--concurrency 1 4 8] [--flaky]
+
+Each run happens in a fresh subprocess so ``ru_maxrss`` reflects only that
+run. The subprocess holds N in-memory uploads (as Streamlit does) and
+stores them concurrently in a local stub of the Storage API:
+
+- ``before``: ``getvalue()`` copies, one multipart request per file
+- ``after``: one ``getbuffer()`` view, resumable upload in 6 MB chunks
+
+``--flaky`` makes the stub fail the first chunk of every upload halfway
+so the resume path is exercised. Only the upload step is measured: in the
+app, files first pass through the job queue, which keeps its own copy
+(see ``JobQueue.submit``).
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import subprocess
+import threading
+import resource
+import argparse
+import json
+import uuid
+import sys
+import io
+import os
+
+
+USER_ID = "00000000-0000-0000-0000-000000000000"
+
+
+class StubStorage(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    flaky = False
+    uploads = {}
+
+    def _drain(self, limit: int = None) -> int:
+        remaining = int(self.headers.get("Content-Length", 0))
+        if limit is not None:
+            remaining = min(remaining, limit)
+        read = 0
+        while read < remaining:
+            read += len(self.rfile.read(min(1 << 20, remaining - read)))
+        return read
+
+    def _reply(self, status: int, body: bytes = b"", headers: dict = None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        upload = self.uploads.get(self.path.rsplit("/", 1)[-1])
+        if "/upload/resumable/" in self.path and upload:
+            self._reply(200, headers={"Upload-Offset": str(upload["offset"]),
+                                      "Tus-Resumable": "1.0.0"})
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        self._drain()
+        if self.path.endswith("/upload/resumable"):
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {"offset": 0, "failed": False}
+            host = self.headers["Host"]
+            self._reply(201, headers={
+                "Location": f"http://{host}/storage/v1/upload/resumable/{upload_id}",
+                "Tus-Resumable": "1.0.0",
+            })
+        else:
+            key = self.path.split("/object/", 1)[-1]
+            self._reply(200, json.dumps({"Key": key}).encode(),
+                        {"Content-Type": "application/json"})
+
+    def do_PATCH(self):
+        upload = self.uploads[self.path.rsplit("/", 1)[-1]]
+        if self.flaky and not upload["failed"]:
+            upload["failed"] = True
+            length = int(self.headers.get("Content-Length", 0))
+            upload["offset"] += self._drain(length // 2)
+            self._reply(500, headers={"Connection": "close"})
+            self.close_connection = True
+            return
+        upload["offset"] += self._drain()
+        self._reply(204, headers={"Upload-Offset": str(upload["offset"]),
+                                  "Tus-Resumable": "1.0.0"})
+
+    def log_message(self, *args):
+        pass
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(mode: str, size: int, concurrency: int):
+    from modules.supabase_client import get_client, upload_file
+    from modules.extraction_cache import content_hash
+
+    client = get_client()
+    uploads = []
+    for _ in range(concurrency):
+        upload = io.BytesIO()
+        # Filled in small pieces so building fixtures does not set the peak.
+        for _ in range(0, size, 1 << 20):
+            upload.write(os.urandom(1 << 20))
+        upload.truncate(size)
+        uploads.append(upload)
+    baseline = peak_rss_mb()
+
+    errors = []
+
+    def session(n: int):
+        try:
+            store(uploads[n], n)
+        except Exception as e:
+            errors.append(e)
+
+    def store(upload, n: int):
+        if mode == "before":
+            content_hash(upload.getvalue())
+            upload_file(upload.getvalue(), f"scan_{n}.pdf", "application/pdf", USER_ID,
+                        client=client, resumable_threshold=float("inf"))
+        else:
+            data = upload.getbuffer()
+            content_hash(data)
+            upload_file(data, f"scan_{n}.pdf", "application/pdf", USER_ID, client=client)
+
+    threads = [threading.Thread(target=session, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        sys.exit(f"{len(errors)} uploads failed: {errors[0]!r}")
+    print(json.dumps({"baseline": baseline, "peak": peak_rss_mb()}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=24)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--flaky", action="store_true")
+    parser.add_argument("--child", nargs=3, metavar=("MODE", "BYTES", "N"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        mode, size, concurrency = args.child
+        child(mode, int(size), int(concurrency))
+        return
+
+    StubStorage.flaky = args.flaky
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubStorage)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = {
+        **os.environ,
+        "SUPABASE_URL": f"http://127.0.0.1:{server.server_address[1]}",
+        "SUPABASE_KEY": "stub-anon-key",
+    }
+
+    size = args.size_mb * 1024 * 1024
+    print(f"{args.size_mb} MB uploads\n")
+    print(f"{'mode':8s} {'uploads':>7s} {'peak RSS':>10s} {'per upload':>11s}")
+    for concurrency in args.concurrency:
+        for mode in ("before", "after"):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.upload_memory",
+                 "--child", mode, str(size), str(concurrency)],
+                env=env, capture_output=True, text=True, check=True,
+            ).stdout
+            run = json.loads(output.strip().splitlines()[-1])
+            extra = run["peak"] - run["baseline"]
+            print(f"{mode:8s} {concurrency:7d} {run['peak']:8.0f} MB "
+                  f"{extra / concurrency:8.1f} MB")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Import daily FX rates for converting STATS to a reporting currency.
+
+    python import_fx_rates.py rates.csv --user-id <supabase user id> [--db receipts.db]
+    python import_fx_rates.py rates.csv --email me@example.com
+
+The file is a ``date,currency,rate`` CSV with one row per currency and day,
+``rate`` in units of the currency per one USD (e.g. Banxico's FIX series as
+``2026-10-16,MXN,18.35``). Rates belong to one user and go into the local
+receipts.db, so conversion works offline. With ``--user-id`` they are queued
+for the app to sync to Supabase; with ``--email`` they are uploaded right
+away (TICKETSCAN_PASSWORD, as in ingest.py). Re-importing a day replaces
+its rate.
+"""
+import argparse
+import sys
+
+from ingest import supabase_session
+from modules.fx import read_rates
+from modules import local_db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import daily FX rates.")
+    parser.add_argument("file", help="date,currency,rate CSV")
+    parser.add_argument("--db", default=local_db.DB_PATH, help="SQLite file to import into")
+    parser.add_argument("--email", help="account to import into, uploading the rates now")
+    parser.add_argument("--user-id", help="Supabase user id to import for, without signing in")
+    args = parser.parse_args(argv)
+
+    try:
+        rows = read_rates(args.file)
+    except (OSError, ValueError) as e:
+        sys.exit(str(e))
+
+    if args.email:
+        from modules.supabase_client import save_fx_rates
+
+        user, client = supabase_session(args.email)
+        save_fx_rates(rows, user["id"], client=client)
+        print(f"{len(rows)} rates uploaded for {args.email}")
+    elif args.user_id:
+        user = {"id": args.user_id}
+    else:
+        sys.exit("importing needs --user-id or --email (with TICKETSCAN_PASSWORD)")
+
+    conn = local_db.connect(args.db)
+    # Rates not uploaded yet are pushed by the app's next sync.
+    local_db.save_fx_rates(conn, rows, user["id"], pending=not args.email)
+    conn.close()
+
+    currencies = sorted({currency for currency, _, _ in rows})
+    days = sorted({day for _, day, _ in rows})
+    span = f"{days[0]} to {days[-1]}" if days else "no days"
+    print(f"{len(rows)} rates for {', '.join(currencies) or 'no currencies'} ({span}) "
+          f"imported into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
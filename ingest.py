@@ -0,0 +1,199 @@
+"""Headless receipt ingestion.
+
+    python ingest.py ~/tickets --target local --user-id <supabase user id>
+    python ingest.py "scans/**/*.jpg" --target supabase --email me@example.com
+
+Supabase credentials come from .streamlit/secrets.toml or the SUPABASE_URL /
+SUPABASE_KEY / GOOGLE_AI_API_KEY environment variables; the password for
+``--email`` is read from TICKETSCAN_PASSWORD. ``--target local`` saves into
+receipts.db for ``--user-id`` (or the ``--email`` account), queued for the
+app to sync to Supabase.
+"""
+import argparse
+import logging
+import glob
+import time
+import sys
+import os
+
+from modules.ai_service import get_usage_totals, get_model_stats, BATCH_SIZE
+from modules.local_extraction import get_tier_stats
+from modules.pipeline import scan_files, DEFAULT_CONCURRENCY
+from modules.image_processing import MAX_DIMENSION
+from modules.extraction_cache import content_hash
+from modules import local_db
+
+
+MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".pdf": "application/pdf",
+    ".xml": "application/xml",
+}
+
+
+def find_files(source: str) -> list:
+    if os.path.isdir(source):
+        paths = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(source)
+            for name in names
+        ]
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(
+        p for p in paths
+        if os.path.isfile(p) and os.path.splitext(p)[1].lower() in MIME_TYPES
+    )
+
+
+def load_checkpoint(path: str) -> set:
+    try:
+        with open(path) as f:
+            return {line.strip() for line in f if line.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def supabase_session(email: str):
+    from modules.supabase_client import get_client, sign_in
+
+    password = os.environ.get("TICKETSCAN_PASSWORD")
+    if not email or not password:
+        sys.exit("signing in needs --email and TICKETSCAN_PASSWORD")
+
+    response = sign_in(email, password)
+    user = {
+        "id": response.user.id,
+        "access_token": response.session.access_token,
+        "refresh_token": response.session.refresh_token,
+        "expires_at": response.session.expires_at,
+    }
+    return user, get_client(user)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan a folder of receipts.")
+    parser.add_argument("source", help="directory or glob of jpg/png/pdf/xml files")
+    parser.add_argument("--target", choices=["local", "supabase"], default="local")
+    parser.add_argument("--db", default=local_db.DB_PATH, help="SQLite file for --target local")
+    parser.add_argument("--email", help="account to ingest into")
+    parser.add_argument("--user-id", help="Supabase user id for --target local, without signing in")
+    parser.add_argument("--workers", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--checkpoint", default="ingest_checkpoint.txt")
+    parser.add_argument("--max-dimension", type=int, default=MAX_DIMENSION)
+    parser.add_argument("--keep-original", action="store_true",
+                        help="also upload the unprocessed file (--target supabase)")
+    parser.add_argument("--inference-batch", type=int, default=1,
+                        help=f"receipts per model request (try {BATCH_SIZE})")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    done_hashes = load_checkpoint(args.checkpoint)
+    paths = find_files(args.source)
+    print(f"{len(paths)} files found, {len(done_hashes)} already in checkpoint")
+
+    if args.target == "supabase":
+        from modules.supabase_client import save_receipts
+
+        user, client = supabase_session(args.email)
+    else:
+        # Rows need their owner to show up in the app and sync to Supabase.
+        if args.user_id:
+            user = {"id": args.user_id}
+        elif args.email:
+            user, _ = supabase_session(args.email)
+        else:
+            sys.exit("--target local needs --user-id or --email (with TICKETSCAN_PASSWORD)")
+        conn = local_db.connect(args.db)
+        client = None
+
+    saved = skipped = failed = 0
+    usage_before = get_usage_totals()
+    started = time.perf_counter()
+
+    with open(args.checkpoint, "a") as checkpoint:
+        for i in range(0, len(paths), args.batch_size):
+            batch = []
+            hashes = {}
+            for path in paths[i:i + args.batch_size]:
+                with open(path, "rb") as f:
+                    data = f.read()
+                digest = content_hash(data)
+                if digest in done_hashes:
+                    skipped += 1
+                    continue
+                hashes[path] = digest
+                batch.append((path, data, MIME_TYPES[os.path.splitext(path)[1].lower()]))
+
+            results = []
+            attached = []
+            for result in scan_files(batch, client, user["id"], max_workers=args.workers,
+                                     max_dimension=args.max_dimension,
+                                     keep_original=args.keep_original,
+                                     inference_batch=args.inference_batch):
+                if result.attached_to is not None:
+                    attached.append(result)
+                    continue
+                if result.error:
+                    failed += 1
+                    print(f"FAILED {result.name}: {result.error}")
+                    continue
+                result.data.setdefault("image_path", result.name)
+                results.append(result)
+
+            if not results:
+                continue
+
+            receipts = [r.data for r in results]
+            if args.target == "supabase":
+                save_receipts(receipts, user["id"], client=client)
+            else:
+                local_db.save_receipts(conn, receipts, user["id"], pending=True)
+
+            # A companion XML is done once the PDF it was read with is saved.
+            saved_indexes = {r.index for r in results}
+            done = results + [r for r in attached if r.attached_to in saved_indexes]
+            for r in done:
+                checkpoint.write(hashes[r.name] + "\n")
+                done_hashes.add(hashes[r.name])
+            checkpoint.flush()
+            saved += len(results)
+            print(f"{saved} saved, {failed} failed, {skipped} skipped")
+
+    elapsed = time.perf_counter() - started
+    usage_after = get_usage_totals()
+    tokens = (
+        usage_after["input_tokens"] + usage_after["output_tokens"]
+        - usage_before["input_tokens"] - usage_before["output_tokens"]
+    )
+    processed = saved + failed
+    print(
+        f"Done in {elapsed:.1f}s: {saved} saved, {failed} failed, {skipped} skipped | "
+        f"{processed / elapsed if elapsed else 0:.2f} files/s, "
+        f"{tokens / elapsed if elapsed else 0:.0f} tokens/s"
+    )
+    if processed:
+        cached = usage_after["cached_tokens"] - usage_before["cached_tokens"]
+        print(f"  {tokens / processed:.0f} tokens/ticket ({cached / processed:.0f} cached)")
+    tiers = get_tier_stats()["tiers"]
+    print("  " + ", ".join(
+        f"{tier} {100 * t['share']:.0f}%"
+        + (f" ({t['avg_latency']:.2f}s)" if t["avg_latency"] is not None else "")
+        for tier, t in tiers.items()
+    ))
+    for model, stats in get_model_stats().items():
+        if stats["calls"]:
+            print(
+                f"  {model}: {stats['calls']} calls, {100 * stats['success_rate']:.0f}% ok, "
+                f"{stats['throttled']} throttled, avg {stats['avg_latency']:.2f}s, "
+                f"circuit {stats['circuit']}"
+            )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
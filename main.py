@@ -1,26 +1,53 @@
 import streamlit as st
-import pandas as pd
-import time
-from datetime import datetime
+from datetime import date, timedelta
+import logging
 
 from modules.supabase_client import (
-    sign_in,
-    sign_up,
-    upload_file,
-    save_receipt,
-    get_user_receipts,
+    sign_in, sign_up, forget_session, get_client, get_pool_stats, get_cache_stats,
+)
+from modules.storage import (
+    find_saved_hashes,
+    get_receipts_page,
+    search_receipts,
+    get_filter_options,
+    get_receipt_stats,
+    get_item_stats,
+    get_item_price_history,
     delete_receipt,
+    start_sync,
+    stop_sync,
+    get_sync_status,
 )
-from modules.ai_service import analyze_receipt
+from modules.receipt_frame import build_export, FRAME_COLUMNS
+from modules.fx import REPORTING_CURRENCIES
+from modules.jobs import get_job_queue
+from modules.extraction_cache import content_hash
+from modules.cfdi import is_xml
+from modules.local_extraction import get_tier_stats
+from modules.ai_service import get_usage_totals
 from modules.utils import (
     load_css,
     render_app_header,
-    render_receipt_card,
+    render_receipt_list,
     render_metrics_dashboard,
+    render_spend_chart,
+    render_price_history,
+    render_tier_stats,
+    render_usage_stats,
+    render_backend_stats,
+    render_job_card,
     render_empty_state,
+    render_sync_status,
 )
 
 
+JOB_POLL_SECONDS = 2
+SYNC_POLL_SECONDS = 5
+
+# Streamlit only configures its own loggers; this surfaces the app's (model
+# calls with their token usage, sync and upload warnings) on the console.
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 st.set_page_config(
     page_title="TicketScan",
     layout="centered",
@@ -48,6 +75,7 @@ def auth_page():
                     "email": response.user.email,
                     "access_token": response.session.access_token,
                     "refresh_token": response.session.refresh_token,
+                    "expires_at": response.session.expires_at,
                 }
                 st.rerun()
             except Exception as e:
@@ -71,6 +99,7 @@ def auth_page():
                     "email": login.user.email,
                     "access_token": login.session.access_token,
                     "refresh_token": login.session.refresh_token,
+                    "expires_at": login.session.expires_at,
                 }
                 st.rerun()
             except Exception as e:
@@ -89,6 +118,10 @@ def main():
     user = st.session_state.user
     load_css()
 
+    if not st.session_state.get("sync_started"):
+        st.session_state.sync_waiting = start_sync(user)
+        st.session_state.sync_started = True
+
     render_app_header()
 
     if "page" not in st.session_state:
@@ -125,6 +158,9 @@ def main():
 
     st.markdown("<div style='height:12px'></div>", unsafe_allow_html=True)
 
+    if "flash" in st.session_state:
+        st.toast(st.session_state.pop("flash"))
+
     if st.session_state.page == "scan":
         page_scan(user)
     elif st.session_state.page == "history":
@@ -139,67 +175,166 @@ def main():
         unsafe_allow_html=True,
     )
     if st.button("Logout", key="btn_logout", use_container_width=True):
+        stop_sync(user["id"])
+        forget_session(user["access_token"])
         del st.session_state.user
+        reset_history()
+        st.session_state.pop("jobs_done", None)
+        st.session_state.pop("jobs_resumed", None)
+        st.session_state.pop("sync_started", None)
+        st.session_state.pop("sync_waiting", None)
         st.rerun()
 
 
 def page_scan(user):
     st.markdown('<div class="section-title">Upload Receipt</div>', unsafe_allow_html=True)
 
-    uploaded_file = st.file_uploader(
+    uploaded_files = st.file_uploader(
         "Upload receipt",
-        type=["jpg", "jpeg", "png", "pdf"],
+        type=["jpg", "jpeg", "png", "pdf", "xml"],
+        accept_multiple_files=True,
         label_visibility="collapsed",
         key="receipt_uploader",
     )
 
-    if uploaded_file:
-        if uploaded_file.type == "application/pdf":
-            st.info(f"PDF loaded: {uploaded_file.name}")
-        else:
-            st.image(uploaded_file, caption="Preview", use_container_width=True)
-
-        if st.button("Analyze Receipt", type="primary", use_container_width=True):
-            with st.status("Processing...", expanded=True) as status:
-                st.write("Reading file...")
-                file_bytes = uploaded_file.getvalue()
-
-                st.write("Uploading to storage...")
-                file_url = upload_file(file_bytes, uploaded_file.name, uploaded_file.type)
-
-                st.write("Analyzing with AI...")
-                result = analyze_receipt(file_bytes, mime_type=uploaded_file.type)
-
-                if result:
-                    st.write("Saving data...")
-                    result["file_url"] = file_url
-                    save_receipt(result, user["id"])
-                    status.update(label="Complete", state="complete", expanded=False)
-                    st.toast("Receipt saved successfully.")
-                    time.sleep(1)
-                    st.session_state.page = "history"
-                    st.rerun()
-                else:
-                    status.update(label="Failed", state="error")
+    if not uploaded_files:
+        render_empty_state("Upload an image, PDF or CFDI XML to start")
+    elif len(uploaded_files) == 1:
+        scan_single(user, uploaded_files[0])
+    else:
+        scan_bulk(user, uploaded_files)
+
+    render_tier_stats(get_tier_stats())
+    render_usage_stats(get_usage_totals())
+    render_backend_stats(get_pool_stats(), get_cache_stats())
+
+
+def scan_single(user, uploaded_file):
+    if uploaded_file.type == "application/pdf":
+        st.info(f"PDF loaded: {uploaded_file.name}")
+    elif is_xml(uploaded_file.type):
+        st.info(f"CFDI XML loaded: {uploaded_file.name}")
+    else:
+        st.image(uploaded_file, caption="Preview", use_container_width=True)
+
+    # One view of the upload is hashed without a copy; the job queue then stores
+    # one copy of it in jobs.db (see JobQueue.submit).
+    data = uploaded_file.getbuffer()
+    digest = content_hash(data)
+    existing = find_saved_hashes(user["id"], [digest]).get(digest)
+    if existing:
+        st.warning(
+            f"This receipt is already saved ({existing.get('merchant') or 'Unknown'}, "
+            f"{str(existing.get('created_at') or '--')[:10]})."
+        )
+
+    if st.button("Analyze Receipt", type="primary", use_container_width=True):
+        get_job_queue().submit(user, [(uploaded_file.name, data, uploaded_file.type)])
+        queued(1)
+
+
+def scan_bulk(user, uploaded_files):
+    total = len(uploaded_files)
+    st.info(f"{total} files loaded")
+
+    if st.button(f"Analyze {total} Receipts", type="primary", use_container_width=True):
+        files = [(f.name, f.getbuffer(), f.type) for f in uploaded_files]
+        hashes = [content_hash(data) for _, data, _ in files]
+        existing = find_saved_hashes(user["id"], set(hashes))
+        files = [f for f, digest in zip(files, hashes) if digest not in existing]
+
+        if not files:
+            st.warning("All of these receipts are already saved.")
+            return
+
+        get_job_queue().submit(user, files)
+        queued(len(files), skipped=total - len(files))
+
+
+def queued(count, skipped=0):
+    message = f"{count} receipt{'s' if count != 1 else ''} queued for analysis."
+    if skipped:
+        message += f" {skipped} already saved, skipped."
+    st.session_state.flash = message
+    st.session_state.page = "history"
+    st.rerun()
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_scan_jobs(user):
+    jobs = get_job_queue().list_jobs(user["id"])
+
+    done = {job["id"] for job in jobs if job["status"] == "done"}
+    seen = st.session_state.get("jobs_done")
+    st.session_state.jobs_done = done
+    if seen is not None and done - seen:
+        reset_history()
+        st.rerun()
+
+    for job in jobs:
+        if job["status"] == "done":
+            continue
+        if render_job_card(job["name"], job["status"], job["error"], key=f"job_{job['id']}"):
+            get_job_queue().dismiss(user["id"], job["id"])
+            st.rerun(scope="fragment")
+
+
+@st.fragment(run_every=SYNC_POLL_SECONDS)
+def render_sync(user):
+    status = get_sync_status(user["id"])
+    # The first pull runs in the background; reload HISTORY once it has landed.
+    if st.session_state.get("sync_waiting") and status and status["synced_at"]:
+        st.session_state.sync_waiting = False
+        reset_history()
+        st.rerun()
+    render_sync_status(status)
+
+
+def reset_history():
+    st.session_state.pop("history", None)
+
+
+def load_history_page(user):
+    history = st.session_state.history
+    filters = dict(history["filters"])
+    query = filters.pop("query")
+    if query:
+        # Ranked results page by offset instead of the (created_at, id) cursor.
+        rows, cursor = search_receipts(
+            user["id"], query, offset=history["cursor"] or 0, **filters
+        )
     else:
-        render_empty_state("Upload an image or PDF to start")
+        rows, cursor = get_receipts_page(user["id"], cursor=history["cursor"], **filters)
+    history["rows"].extend(rows)
+    history["cursor"] = cursor
 
 
 def page_history(user):
     st.markdown('<div class="section-title">Log</div>', unsafe_allow_html=True)
 
-    receipts = get_user_receipts(user["id"])
+    if not st.session_state.get("jobs_resumed"):
+        get_job_queue().resume(user)
+        st.session_state.jobs_resumed = True
 
-    if not receipts:
+    render_scan_jobs(user)
+    render_sync(user)
+
+    options = get_filter_options(user["id"])
+
+    if not options["years"]:
         render_empty_state("No history available")
         return
 
-    df = pd.DataFrame(receipts)
-    df["date_dt"] = pd.to_datetime(df["created_at"], errors="coerce")
+    query = st.text_input(
+        "Search",
+        placeholder="Search merchants, items or descriptions...",
+        label_visibility="collapsed",
+    )
 
     with st.expander("Filter Options", expanded=False):
-        merchants = sorted(list(df["merchant"].dropna().unique()))
-        sel_merchant = st.multiselect("Merchant", merchants, placeholder="Select merchants...")
+        sel_merchant = st.multiselect(
+            "Merchant", options["merchants"], placeholder="Select merchants..."
+        )
 
         st.markdown("---")
 
@@ -215,20 +350,12 @@ def page_history(user):
             label_visibility="collapsed",
         )
 
-        sel_year = None
-        sel_month_idx = None
-        start_date = None
-        end_date = None
+        start = None
+        end = None
 
         if date_mode == "By Month":
-            years = sorted(
-                df["date_dt"].dt.year.dropna().unique().astype(int), reverse=True
-            )
-            if not years:
-                years = [datetime.now().year]
-
             c1, c2 = st.columns(2)
-            sel_year = c1.selectbox("Year", years)
+            sel_year = c1.selectbox("Year", options["years"])
 
             months = [
                 "Jan", "Feb", "Mar", "Apr", "May", "Jun",
@@ -237,78 +364,120 @@ def page_history(user):
             sel_month = c2.selectbox("Month", months)
             sel_month_idx = months.index(sel_month) + 1
 
+            start = date(sel_year, sel_month_idx, 1)
+            end = date(sel_year + sel_month_idx // 12, sel_month_idx % 12 + 1, 1)
+
         elif date_mode == "Custom Range":
             c1, c2 = st.columns(2)
             start_date = c1.date_input("From", value=None)
             end_date = c2.date_input("To", value=None)
+            if start_date and end_date:
+                start = start_date
+                end = end_date + timedelta(days=1)
+
+    filters = {
+        "query": query.strip() or None,
+        "merchants": sel_merchant or None,
+        "start": start.isoformat() if start else None,
+        "end": end.isoformat() if end else None,
+    }
+
+    if st.session_state.get("history", {}).get("filters") != filters:
+        st.session_state.history = {"rows": [], "cursor": None, "filters": filters}
+        load_history_page(user)
+
+    history = st.session_state.history
+    if not history["rows"] and history["cursor"] is not None:
+        load_history_page(user)
+    receipts = history["rows"]
 
-    filtered = df.copy()
-
-    if sel_merchant:
-        filtered = filtered[filtered["merchant"].isin(sel_merchant)]
-
-    if date_mode == "By Month" and sel_year and sel_month_idx:
-        filtered = filtered[
-            (filtered["date_dt"].dt.year == sel_year)
-            & (filtered["date_dt"].dt.month == sel_month_idx)
-        ]
-    elif date_mode == "Custom Range" and start_date and end_date:
-        filtered = filtered[
-            (filtered["date_dt"].dt.date >= start_date)
-            & (filtered["date_dt"].dt.date <= end_date)
-        ]
-
-    for _, row in filtered.iterrows():
-        if render_receipt_card(
-            merchant=row.get("merchant", "Unknown"),
-            date=str(row.get("created_at", "--"))[:10],
-            total=float(row.get("total", 0)),
-            currency=row.get("currency", "USD"),
-            category=row.get("category", "OTHER"),
-            summary=row.get("summary", ""),
-            file_url=row.get("file_url", None),
-            key=f"card_{row['id']}",
-        ):
-            delete_receipt(row["id"], user["id"])
+    if not receipts:
+        render_empty_state("No receipts match these filters")
+        return
+
+    deleted = render_receipt_list(receipts, key="history")
+    if deleted:
+        for receipt_id in deleted:
+            delete_receipt(receipt_id, user["id"])
+        history["rows"] = [r for r in receipts if r["id"] not in deleted]
+        st.session_state.pop("history_delete", None)
+        st.rerun()
+
+    if history["cursor"] is not None:
+        if st.button("Load More", key="btn_load_more", use_container_width=True):
+            load_history_page(user)
             st.rerun()
 
+    render_export(user, filters)
+
+
+def render_export(user, filters):
+    with_items = st.checkbox("Include line items", key="export_items")
+    columns = f"{FRAME_COLUMNS}, items" if with_items else FRAME_COLUMNS
+    currency = reporting_currency()
+
+    if filters.get("query"):
+        st.caption("The export includes every receipt matching the filters; search is not applied.")
+
+    # Runs on click, outside the script thread: no session, so pass the client.
+    def build():
+        return build_export(
+            user["id"], filters, columns=columns, currency=currency, client=get_client(user)
+        )
+
+    st.download_button(
+        "Export CSV",
+        data=build,
+        file_name="receipts.csv",
+        mime="text/csv",
+        key="btn_export",
+        use_container_width=True,
+    )
+
+
+def reporting_currency():
+    return st.session_state.get("reporting_currency", REPORTING_CURRENCIES[0])
+
 
 def page_stats(user):
     st.markdown('<div class="section-title">Analytics</div>', unsafe_allow_html=True)
 
-    receipts = get_user_receipts(user["id"])
-    df = pd.DataFrame(receipts) if receipts else pd.DataFrame()
+    choices = [*REPORTING_CURRENCIES, None]
+    currency = st.selectbox(
+        "Reporting currency",
+        choices,
+        index=choices.index(reporting_currency()),
+        format_func=lambda c: c or "As recorded",
+    )
+    # A plain key, so HISTORY exports in the same currency.
+    st.session_state.reporting_currency = currency
 
-    render_metrics_dashboard(df)
+    stats = get_receipt_stats(user["id"], currency=currency)
 
-    if df.empty:
-        return
+    render_metrics_dashboard(stats)
+    if currency and any(t["currency"] != currency for t in (stats or {}).get("totals", [])):
+        st.caption(
+            f"Receipts dated before the first {currency} rate, or in a currency without "
+            "rates, are shown as recorded. Import rates with import_fx_rates.py."
+        )
 
-    df["total"] = pd.to_numeric(df["total"], errors="coerce").fillna(0)
+    if not stats or not stats.get("receipt_count"):
+        return
 
-    if "category" in df.columns:
-        cat_spend = df.groupby("category")["total"].sum().sort_values(ascending=False)
-        cat_spend = cat_spend[cat_spend > 0]
+    render_spend_chart(stats["by_category"], "category", "Category Breakdown", "#5C8BB5")
+    render_spend_chart(stats["by_merchant"], "merchant", "Merchant Breakdown", "#2C3E50")
+    render_spend_chart(stats["by_month"], "month", "Monthly Spend", "#7F8C8D")
 
-        if not cat_spend.empty:
-            st.markdown(
-                '<div class="section-title">Category Breakdown</div>',
-                unsafe_allow_html=True,
-            )
-            st.bar_chart(cat_spend, color="#5C8BB5")
+    item_stats = get_item_stats(user["id"])
+    if not item_stats or not item_stats.get("top_items"):
+        return
 
-    if "merchant" in df.columns:
-        merch_spend = (
-            df.groupby("merchant")["total"].sum().sort_values(ascending=False).head(10)
-        )
-        merch_spend = merch_spend[merch_spend > 0]
-
-        if not merch_spend.empty:
-            st.markdown(
-                '<div class="section-title">Merchant Breakdown</div>',
-                unsafe_allow_html=True,
-            )
-            st.bar_chart(merch_spend, color="#2C3E50")
+    render_spend_chart(item_stats["top_items"], "name", "Top Items", "#5C8BB5")
+    query = st.text_input(
+        "Item price history", placeholder="Search an item, e.g. panales", key="item_query"
+    ).strip()
+    if query:
+        render_price_history(get_item_price_history(user["id"], query), query)
 
 
 if __name__ == "__main__":
@@ -1,92 +1,419 @@
 from google import genai
 from google.genai import types
-import streamlit as st
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from PIL import Image
+import threading
+import logging
+import math
 import json
+import time
+import re
+import io
+
+from modules.config import get_secret
+from modules.extraction_cache import ExtractionCache, content_hash
+from modules.model_router import ModelRouter
+
+
+logger = logging.getLogger(__name__)
+
+PROMPT_VERSION = "4"
+DEFAULT_MODELS = ["gemini-flash-latest", "gemini-flash-lite-latest"]
+
+BATCH_SIZE = 8
+BATCH_TOKEN_BUDGET = 16000
+# Extra seconds of deadline per additional document in a batched request.
+BATCH_SECONDS_PER_DOCUMENT = 5
+
+# Gemini bills images as 258-token 768x768 tiles (one tile up to 384px) and
+# PDFs as 258 tokens per page.
+TOKENS_PER_TILE = 258
+TILE_SIZE = 768
+
+CATEGORIES = ("Food", "Transport", "Health", "Shopping", "Services", "Entertainment", "Other")
+DOCUMENT_TYPES = ("Ticket", "Factura")
+
+# Static instructions are sent once per request as the system instruction;
+# the user turn carries only the document.
+SYSTEM_INSTRUCTION = """
+Extract data from the receipt/invoice document the user sends.
+Classification rules for "document_type":
+- "Factura": Official tax invoice. Indicators: contains RFC, CFDI, Serie/Folio, Regimen Fiscal, Forma de Pago, UUID fiscal, or the word FACTURA. PDF documents are almost always Facturas.
+- "Ticket": Simple point-of-sale receipt, typically thermal paper from a store register. Image files (jpg/png) are usually Tickets unless they contain Factura indicators.
+Rules for "narrative_summary":
+- Descriptive one-sentence summary in Spanish.
+- Must start with the document type: "Factura de..." or "Ticket de...".
+- Include merchant name, a brief description of what was purchased, and the total amount.
+- Example: "Factura de Farmacia Guadalajara por $350.00 MXN por compra de pañales y productos de limpieza."
+- Example: "Ticket de OXXO por $85.50 MXN en bebidas y snacks."
+""".strip()
+
+BATCH_INSTRUCTION = SYSTEM_INSTRUCTION + """
+Several documents are sent, each preceded by a "Document N:" label.
+Return a JSON array with exactly one object per document and set "index" to its N.
+Never merge two documents into one entry or split one document across entries.
+"""
+
+_client = None
+_router = None
+_client_lock = threading.Lock()
+
+_extraction_cache = None
+_extraction_cache_lock = threading.Lock()
+
+_usage_lock = threading.Lock()
+_usage = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "by_model": {}}
+
+
+def _to_float(value):
+    if isinstance(value, str):
+        value = re.sub(r"[^\d.\-]", "", value.replace(",", "")) or 0
+    return float(value or 0)
+
+
+class ReceiptItem(BaseModel):
+    item: str = ""
+    price: float = Field(0.0, description="Line amount as printed")
+    quantity: float = Field(1.0, description="Units bought; 1 when not printed")
+
+    @field_validator("item", mode="before")
+    @classmethod
+    def _item(cls, value):
+        return str(value or "").strip()
+
+    @field_validator("price", mode="before")
+    @classmethod
+    def _price(cls, value):
+        return _to_float(value)
+
+    @field_validator("quantity", mode="before")
+    @classmethod
+    def _quantity(cls, value):
+        value = _to_float(value)
+        return value if value > 0 else 1.0
+
+
+class ReceiptExtraction(BaseModel):
+    """Response schema for extraction; mirrors what ``save_receipts`` reads."""
+
+    merchant: str = Field(description="Store or business name")
+    total: float = Field(description="Grand total paid")
+    currency: str = Field("MXN", description="ISO currency code, MXN or USD")
+    category: str = Field("Other", description="One of: " + ", ".join(CATEGORIES))
+    narrative_summary: str = Field("", description="One-sentence summary in Spanish")
+    document_type: str = Field("Ticket", description=" or ".join(DOCUMENT_TYPES))
+    rfc: str = Field("", description="Issuer (emisor) RFC on a Factura; empty on a Ticket")
+    items: list[ReceiptItem] = Field(default_factory=list)
+
+    @field_validator("merchant", "narrative_summary", mode="before")
+    @classmethod
+    def _text(cls, value):
+        return str(value or "").strip()
+
+    @field_validator("total", mode="before")
+    @classmethod
+    def _total(cls, value):
+        return _to_float(value)
+
+    @field_validator("currency", mode="before")
+    @classmethod
+    def _currency(cls, value):
+        return (str(value or "").strip().upper()[:3]) or "MXN"
+
+    @field_validator("category", mode="before")
+    @classmethod
+    def _category(cls, value):
+        value = str(value or "").strip().title()
+        return value if value in CATEGORIES else "Other"
+
+    @field_validator("document_type", mode="before")
+    @classmethod
+    def _document_type(cls, value):
+        return "Factura" if str(value or "").strip().lower().startswith("fact") else "Ticket"
+
+    @field_validator("rfc", mode="before")
+    @classmethod
+    def _rfc(cls, value):
+        return re.sub(r"[\s-]", "", str(value or "")).upper()
+
+    @field_validator("items", mode="before")
+    @classmethod
+    def _items(cls, value):
+        return value or []
+
+
+class IndexedReceiptExtraction(ReceiptExtraction):
+    index: int = Field(description="N of the \"Document N:\" label this entry describes")
+
+
+def _strip_fences(text: str) -> str:
+    return text.replace("```json", "").replace("```", "").strip()
+
+
+def parse_extraction(text: str) -> dict:
+    """Validate and coerce model output; raises ValueError on malformed JSON."""
+    return ReceiptExtraction.model_validate_json(_strip_fences(text)).model_dump()
+
+
+def parse_batch_extraction(text: str, count: int) -> dict:
+    """Map document index -> extraction for the valid entries of a batched reply.
+
+    Entries that fail validation, fall outside ``range(count)`` or repeat an
+    index are dropped so the caller can retry those documents one by one.
+    Raises ValueError when the reply is not a JSON array at all.
+    """
+    entries = json.loads(_strip_fences(text))
+    if not isinstance(entries, list):
+        raise ValueError("Batched reply is not a JSON array")
+
+    results = {}
+    seen = set()
+    for entry in entries:
+        try:
+            parsed = IndexedReceiptExtraction.model_validate(entry)
+        except ValidationError:
+            continue
+        if not 0 <= parsed.index < count or parsed.index in seen:
+            results.pop(parsed.index, None)
+            continue
+        seen.add(parsed.index)
+        results[parsed.index] = parsed.model_dump(exclude={"index"})
+    return results
 
 
 def get_client():
-    try:
-        api_key = st.secrets["google_ai"]["api_key"]
-        return genai.Client(api_key=api_key)
-    except KeyError:
-        st.error("Google AI API Key not found in secrets.toml")
-        st.stop()
+    global _client
+    with _client_lock:
+        if _client is None:
+            try:
+                api_key = get_secret("google_ai", "api_key")
+            except KeyError:
+                raise RuntimeError("Google AI API Key not found in secrets.toml") from None
+            # Retries are handled by the router, not inside the SDK.
+            http_options = types.HttpOptions(retry_options=types.HttpRetryOptions(attempts=1))
+            base_url = get_secret("google_ai", "base_url", default=None)
+            if base_url:
+                http_options.base_url = base_url
+            _client = genai.Client(api_key=api_key, http_options=http_options)
+        return _client
 
 
-def analyze_receipt(image_bytes: bytes, mime_type: str = "image/jpeg"):
-    client = get_client()
+def get_router() -> ModelRouter:
+    global _router
+    with _client_lock:
+        if _router is None:
+            models = get_secret("google_ai", "models", default=DEFAULT_MODELS)
+            if isinstance(models, str):
+                models = [m.strip() for m in models.split(",") if m.strip()]
+            _router = ModelRouter(models)
+        return _router
 
-    prompt_text = """
-    Extract data from this receipt/invoice document into JSON:
-    {
-      "merchant": "Store or Business Name",
-      "total": 0.00,
-      "currency": "MXN or USD",
-      "category": "Food/Transport/Health/Shopping/Services/Entertainment/Other",
-      "narrative_summary": "Descriptive one-sentence summary in Spanish",
-      "document_type": "Ticket or Factura",
-      "items": [{"item": "name", "price": 0.00}]
+
+def get_model_stats() -> dict:
+    """Per-model latency histogram, success rate and circuit state."""
+    return get_router().stats()
+
+
+def _record_usage(response, model: str, latency: float) -> dict:
+    usage = getattr(response, "usage_metadata", None)
+    call = {
+        "model": model,
+        "input_tokens": (usage and usage.prompt_token_count) or 0,
+        "output_tokens": (usage and usage.candidates_token_count) or 0,
+        "cached_tokens": (usage and usage.cached_content_token_count) or 0,
+        "latency": latency,
     }
-    Classification rules for "document_type":
-    - "Factura": Official tax invoice. Indicators: contains RFC, CFDI, Serie/Folio, Regimen Fiscal, Forma de Pago, UUID fiscal, or the word FACTURA. PDF documents are almost always Facturas.
-    - "Ticket": Simple point-of-sale receipt, typically thermal paper from a store register. Image files (jpg/png) are usually Tickets unless they contain Factura indicators.
-    Rules for "narrative_summary":
-    - Must start with the document type: "Factura de..." or "Ticket de...".
-    - Include merchant name, a brief description of what was purchased, and the total amount.
-    - Example: "Factura de Farmacia Guadalajara por $350.00 MXN por compra de pañales y productos de limpieza."
-    - Example: "Ticket de OXXO por $85.50 MXN en bebidas y snacks."
-    Return ONLY valid JSON.
-    """
+    with _usage_lock:
+        _usage["calls"] += 1
+        per_model = _usage["by_model"].setdefault(
+            model, {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0}
+        )
+        per_model["calls"] += 1
+        for key in ("input_tokens", "output_tokens", "cached_tokens"):
+            _usage[key] += call[key]
+            per_model[key] += call[key]
 
-    try:
+    logger.info(
+        f"{model}: {call['input_tokens']} in / {call['output_tokens']} out tokens "
+        f"({call['cached_tokens']} cached) in {latency:.2f}s"
+    )
+    return call
+
+
+def get_usage_totals() -> dict:
+    """Model calls and tokens used by this process so far, overall and per model."""
+    with _usage_lock:
+        return {
+            **{k: v for k, v in _usage.items() if k != "by_model"},
+            "by_model": {m: dict(u) for m, u in _usage["by_model"].items()},
+        }
+
+
+def get_extraction_cache() -> ExtractionCache:
+    global _extraction_cache
+    with _extraction_cache_lock:
+        if _extraction_cache is None:
+            _extraction_cache = ExtractionCache()
+        return _extraction_cache
+
+
+def _generation_config(timeout: float, system_instruction: str = SYSTEM_INSTRUCTION,
+                       response_schema=ReceiptExtraction) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        response_mime_type="application/json",
+        response_schema=response_schema,
+        temperature=0.1,
+        http_options=types.HttpOptions(timeout=int(timeout * 1000)),
+    )
+
+
+def _analyze(digest: str, parts: list, use_cache: bool, name: str = None):
+    router = get_router()
+    if use_cache:
+        cached = get_extraction_cache().get(digest, PROMPT_VERSION, router.models)
+        if cached is not None:
+            return cached
+
+    client = get_client()
+    contents = [types.Content(role="user", parts=parts)]
+    tried = []
+
+    def extract(model, timeout):
+        tried.append(model)
+        started = time.perf_counter()
         response = client.models.generate_content(
-            model="gemini-flash-latest",
-            contents=[
-                types.Content(
-                    parts=[
-                        types.Part.from_text(text=prompt_text),
-                        types.Part.from_bytes(data=image_bytes, mime_type=mime_type),
-                    ]
-                )
-            ],
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                temperature=0.1,
-            ),
+            model=model, contents=contents, config=_generation_config(timeout)
         )
+        _record_usage(response, model, time.perf_counter() - started)
+        if not response.text:
+            raise ValueError("Empty response")
+        return parse_extraction(response.text)
 
-        if response.text:
-            cleaned = response.text.replace("```json", "").replace("```", "").strip()
-            return json.loads(cleaned)
+    try:
+        model, result = router.call(extract)
+    except Exception:
+        logger.exception(
+            f"Extraction of {name or 'document ' + digest[:12]} failed "
+            f"(models tried: {', '.join(dict.fromkeys(tried)) or 'none, circuits open'})"
+        )
         return None
 
-    except Exception as e:
-        if "429" in str(e) or "404" in str(e):
-            st.warning("Retrying with fallback model...")
+    get_extraction_cache().put(digest, PROMPT_VERSION, model, result)
+    return result
+
+
+def analyze_receipt(image_bytes: bytes, mime_type: str = "image/jpeg", use_cache: bool = True,
+                    name: str = None):
+    """Extract one document; ``name`` (the file's) only labels failures in the log."""
+    parts = [types.Part.from_bytes(data=image_bytes, mime_type=mime_type)]
+    return _analyze(content_hash(image_bytes), parts, use_cache, name)
+
+
+def analyze_receipt_text(text: str, use_cache: bool = True, name: str = None):
+    """Extract from OCR text instead of the image, for a fraction of the prompt tokens."""
+    parts = [types.Part.from_text(text=f"OCR text of the document:\n{text}")]
+    return _analyze(content_hash(text.encode()), parts, use_cache, name)
+
+
+def estimate_tokens(data, mime_type: str) -> int:
+    """Rough prompt-token cost of one document (any bytes-like), read from headers only."""
+    if mime_type == "application/pdf":
+        if not isinstance(data, (bytes, bytearray)):
+            data = memoryview(data).tobytes()
+        pages = data.count(b"/Type /Page") - data.count(b"/Type /Pages")
+        return TOKENS_PER_TILE * max(pages, 1)
+    try:
+        width, height = Image.open(io.BytesIO(data)).size
+    except Exception:
+        return TOKENS_PER_TILE
+    if max(width, height) <= TILE_SIZE // 2:
+        return TOKENS_PER_TILE
+    return TOKENS_PER_TILE * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def _pack_batches(documents: list, max_batch: int, token_budget: int):
+    batch, tokens = [], 0
+    for document in documents:
+        cost = estimate_tokens(document[1], document[2])
+        if batch and (len(batch) >= max_batch or tokens + cost > token_budget):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(document)
+        tokens += cost
+    if batch:
+        yield batch
+
+
+def _extract_batch(batch: list):
+    """One request for ``(index, bytes, mime_type)`` documents; returns ``(model, results)``."""
+    router = get_router()
+    client = get_client()
+    parts = []
+    for n, (_, data, mime_type) in enumerate(batch):
+        parts.append(types.Part.from_text(text=f"Document {n}:"))
+        parts.append(types.Part.from_bytes(data=data, mime_type=mime_type))
+    contents = [types.Content(role="user", parts=parts)]
+
+    def extract(model, timeout):
+        started = time.perf_counter()
+        response = client.models.generate_content(
+            model=model,
+            contents=contents,
+            config=_generation_config(timeout, BATCH_INSTRUCTION, list[IndexedReceiptExtraction]),
+        )
+        _record_usage(response, model, time.perf_counter() - started)
+        if not response.text:
+            raise ValueError("Empty response")
+        return parse_batch_extraction(response.text, len(batch))
+
+    extra = BATCH_SECONDS_PER_DOCUMENT * (len(batch) - 1)
+    return router.call(
+        extract,
+        deadline=router.deadline + extra,
+        attempt_timeout=router.attempt_timeout + extra,
+    )
+
+
+def analyze_receipts(documents: list, use_cache: bool = True, max_batch: int = BATCH_SIZE,
+                     token_budget: int = BATCH_TOKEN_BUDGET, names: list = None) -> list:
+    """Extract several ``(bytes, mime_type)`` documents, packing them into shared requests.
+
+    Cache misses are grouped into requests of up to ``max_batch`` documents
+    and ``token_budget`` estimated prompt tokens, so the instructions are
+    sent once per group. Documents a batched reply leaves out or gets wrong
+    fall back to ``analyze_receipt``. Returns results (or None) in input order;
+    ``names``, aligned with ``documents``, label failures in the log.
+    """
+    router = get_router()
+    results = [None] * len(documents)
+    digests = [content_hash(data) for data, _ in documents]
+
+    misses = []
+    for i, (data, mime_type) in enumerate(documents):
+        cached = None
+        if use_cache:
+            cached = get_extraction_cache().get(digests[i], PROMPT_VERSION, router.models)
+        if cached is not None:
+            results[i] = cached
+        else:
+            misses.append((i, data, mime_type))
+
+    for batch in _pack_batches(misses, max_batch, token_budget):
+        extracted = {}
+        if len(batch) > 1:
             try:
-                response = client.models.generate_content(
-                    model="gemini-flash-lite-latest",
-                    contents=[
-                        types.Content(
-                            parts=[
-                                types.Part.from_text(text=prompt_text),
-                                types.Part.from_bytes(
-                                    data=image_bytes, mime_type=mime_type
-                                ),
-                            ]
-                        )
-                    ],
-                    config=types.GenerateContentConfig(
-                        response_mime_type="application/json"
-                    ),
-                )
-                cleaned = (
-                    response.text.replace("```json", "").replace("```", "").strip()
-                )
-                return json.loads(cleaned)
-            except Exception as e2:
-                st.error(f"Final error: {e2}")
-                return None
-
-        st.error(f"Error: {e}")
-        return None
\ No newline at end of file
+                model, extracted = _extract_batch(batch)
+            except Exception as e:
+                logger.warning(f"Batched extraction of {len(batch)} documents failed: {e}")
+
+        for n, (i, data, mime_type) in enumerate(batch):
+            if n in extracted:
+                results[i] = extracted[n]
+                get_extraction_cache().put(digests[i], PROMPT_VERSION, model, extracted[n])
+            else:
+                name = names[i] if names else None
+                results[i] = analyze_receipt(data, mime_type, use_cache=False, name=name)
+        if len(batch) > 1 and len(extracted) < len(batch):
+            logger.info(f"{len(batch) - len(extracted)} of {len(batch)} documents retried singly")
+    return results
@@ -0,0 +1,104 @@
+from collections import OrderedDict
+import threading
+import json
+import time
+
+
+MISS = object()
+
+
+class ResultCache:
+    """Process-wide LRU cache of query results, partitioned by user.
+
+    Entries expire after ``ttl`` seconds and the least recently used ones are
+    evicted once ``max_entries`` or ``max_bytes`` (approximate, JSON size) is
+    exceeded, so many concurrent sessions share one bounded cache.
+    """
+
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    @staticmethod
+    def key(name: str, **params) -> tuple:
+        return (name, json.dumps(params, sort_keys=True, default=str))
+
+    def get(self, user_id: str, key: tuple):
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is None:
+                self._stats["misses"] += 1
+                return MISS
+            if entry[0] <= time.time():
+                self._remove((user_id, key))
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return MISS
+            self._entries.move_to_end((user_id, key))
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def put(self, user_id: str, key: tuple, value, size: int = None):
+        """Store ``value``; pass ``size`` for values that are not plain JSON data."""
+        if size is None:
+            size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if (user_id, key) in self._entries:
+                self._remove((user_id, key))
+            self._entries[(user_id, key)] = (time.time() + self.ttl, value, size)
+            self._by_user.setdefault(user_id, set()).add(key)
+            self._bytes += size
+            self._evict()
+
+    def invalidate(self, user_id: str, name: str = None):
+        """Drop a user's entries, or only those of one query ``name``."""
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                if name is None or key[0] == name:
+                    self._remove((user_id, key))
+
+    def patch(self, user_id: str, name: str, fn):
+        """Replace each cached ``name`` value of a user with ``fn(value)``."""
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                if key[0] != name:
+                    continue
+                expires, value, size = self._entries[(user_id, key)]
+                value = fn(value)
+                new_size = len(json.dumps(value, default=str))
+                self._entries[(user_id, key)] = (expires, value, new_size)
+                self._bytes += new_size - size
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "users": len(self._by_user),
+            }
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def _remove(self, entry_key: tuple):
+        user_id, key = entry_key
+        _, _, size = self._entries.pop(entry_key)
+        self._bytes -= size
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
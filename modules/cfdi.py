@@ -0,0 +1,203 @@
+from xml.etree import ElementTree
+import logging
+import zlib
+import io
+import os
+import re
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+from modules.fx import CURRENCY_RE
+
+
+logger = logging.getLogger(__name__)
+
+XML_MIME_TYPES = ("application/xml", "text/xml")
+PDF_MIME_TYPE = "application/pdf"
+MAX_SUMMARY_ITEMS = 3
+# A stream is only inflated past its first PROBE_BYTES when they name a
+# Comprobante, and never past MAX_CFDI_BYTES.
+PROBE_BYTES = 4096
+MAX_CFDI_BYTES = 10 * 1024 * 1024
+
+STREAM_RE = re.compile(rb"stream\r?\n(.*?)\r?\nendstream", re.DOTALL)
+
+# SAT ClaveProdServ prefix -> app category; the longest matching prefix wins.
+CATEGORY_PREFIXES = {
+    "9010": "Food",
+    "9011": "Services",
+    "9013": "Entertainment",
+    "9014": "Entertainment",
+    "7810": "Transport",
+    "7811": "Transport",
+    "1510": "Transport",
+    "2510": "Transport",
+    "50": "Food",
+    "51": "Health",
+    "42": "Health",
+    "85": "Health",
+    "78": "Transport",
+    "52": "Shopping",
+    "53": "Shopping",
+    "56": "Shopping",
+    "43": "Shopping",
+    "60": "Shopping",
+    "80": "Services",
+    "81": "Services",
+    "83": "Services",
+    "84": "Services",
+    "86": "Services",
+}
+
+
+def is_xml(mime_type: str) -> bool:
+    return mime_type in XML_MIME_TYPES
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find(element, name: str):
+    for child in element.iter():
+        if _local(child.tag) == name:
+            return child
+    return None
+
+
+def _category(codes: list) -> str:
+    for code in codes:
+        for prefix in sorted(CATEGORY_PREFIXES, key=len, reverse=True):
+            if code.startswith(prefix):
+                return CATEGORY_PREFIXES[prefix]
+    return "Other"
+
+
+def _summary(merchant: str, total: float, currency: str, items: list) -> str:
+    summary = f"Factura de {merchant} por ${total:,.2f} {currency}"
+    names = [i["item"].strip().capitalize() for i in items[:MAX_SUMMARY_ITEMS] if i["item"]]
+    if len(items) > MAX_SUMMARY_ITEMS:
+        names.append("otros conceptos")
+    if names:
+        listed = ", ".join(names[:-1]) + " y " + names[-1] if len(names) > 1 else names[0]
+        summary += f" por {listed}"
+    return summary + "."
+
+
+def parse_cfdi(xml_bytes: bytes):
+    """Build the ``save_receipts`` dict from a CFDI 3.3/4.0 XML; None if it is not one."""
+    try:
+        root = ElementTree.fromstring(xml_bytes)
+    except ElementTree.ParseError:
+        return None
+    if _local(root.tag) != "Comprobante":
+        return None
+
+    try:
+        total = float(root.get("Total"))
+    except (TypeError, ValueError):
+        return None
+
+    emisor = _find(root, "Emisor")
+    timbre = _find(root, "TimbreFiscalDigital")
+    merchant = (emisor is not None and (emisor.get("Nombre") or emisor.get("Rfc"))) or "Unknown"
+    currency = (root.get("Moneda") or "MXN").strip().upper()
+    # XXX is SAT's "no currency"; anything that is not an ISO code is not trusted.
+    if currency == "XXX" or not CURRENCY_RE.match(currency):
+        currency = "MXN"
+
+    conceptos = [c for c in root.iter() if _local(c.tag) == "Concepto"]
+    try:
+        items = [
+            {
+                "item": c.get("Descripcion") or "",
+                "price": float(c.get("Importe") or 0),
+                "quantity": float(c.get("Cantidad") or 1),
+            }
+            for c in conceptos
+        ]
+    except ValueError:
+        # Leave a malformed Factura to the model rather than failing the scan.
+        return None
+
+    return {
+        "merchant": merchant.strip(),
+        "total": total,
+        "currency": currency,
+        "category": _category([c.get("ClaveProdServ") or "" for c in conceptos]),
+        "narrative_summary": _summary(merchant.strip(), total, currency, items),
+        "document_type": "Factura",
+        "items": items,
+        "date": (root.get("Fecha") or "")[:10] or None,
+        "rfc": emisor.get("Rfc") if emisor is not None else None,
+        "uuid": timbre.get("UUID").upper() if timbre is not None and timbre.get("UUID") else None,
+    }
+
+
+def embedded_cfdi(pdf_bytes: bytes):
+    """Return the first CFDI XML attached to a PDF, scanning its (Flate) streams."""
+    for match in STREAM_RE.finditer(pdf_bytes):
+        raw = match.group(1)
+        data = raw if b"Comprobante" in raw[:PROBE_BYTES] else _inflate_cfdi(raw)
+        if data:
+            start = data.find(b"<")
+            if start >= 0:
+                return data[start:]
+    return None
+
+
+def _inflate_cfdi(data: bytes):
+    """A Flate stream inflated, if its first PROBE_BYTES name a Comprobante."""
+    try:
+        if b"Comprobante" not in zlib.decompressobj().decompress(data, PROBE_BYTES):
+            return None
+        inflater = zlib.decompressobj()
+        inflated = inflater.decompress(data, MAX_CFDI_BYTES)
+    except zlib.error:
+        return None
+    # Larger than any real CFDI: not worth holding in memory.
+    return None if inflater.unconsumed_tail else inflated
+
+
+def pdf_text(pdf_bytes: bytes):
+    """Text layer of a PDF, or None for scanned PDFs or when pypdf is not installed."""
+    if PdfReader is None:
+        return None
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        text = "\n".join(page.extract_text() or "" for page in reader.pages)
+    except Exception as e:
+        logger.warning(f"Could not read PDF text: {e}")
+        return None
+    return text if text.strip() else None
+
+
+def extract_cfdi(data: bytes, mime_type: str, companion: bytes = None):
+    """Structured Factura data from an XML upload, a companion XML, or XML embedded in a PDF."""
+    if is_xml(mime_type):
+        return parse_cfdi(data)
+    if companion is not None:
+        result = parse_cfdi(companion)
+        if result is not None:
+            return result
+    if mime_type == PDF_MIME_TYPE:
+        xml = embedded_cfdi(data)
+        if xml is not None:
+            return parse_cfdi(xml)
+    return None
+
+
+def pair_companions(files: list) -> dict:
+    """Map the index of each PDF to the index of an XML uploaded with the same name."""
+    stems = {}
+    for index, (name, _, mime_type) in enumerate(files):
+        stem = os.path.splitext(os.path.basename(name))[0].lower()
+        stems.setdefault(stem, {})["xml" if is_xml(mime_type) else mime_type] = index
+    return {
+        group[PDF_MIME_TYPE]: group["xml"]
+        for group in stems.values()
+        if PDF_MIME_TYPE in group and "xml" in group
+    }
@@ -0,0 +1,46 @@
+import os
+import sys
+import tomllib
+
+
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+
+_file_secrets = None
+_MISSING = object()
+
+
+def _load_secrets_file() -> dict:
+    global _file_secrets
+    if _file_secrets is None:
+        try:
+            with open(SECRETS_PATH, "rb") as f:
+                _file_secrets = tomllib.load(f)
+        except FileNotFoundError:
+            _file_secrets = {}
+    return _file_secrets
+
+
+def get_secret(section: str, key: str, default=_MISSING):
+    """Look up a secret without requiring a running Streamlit app.
+
+    Order: ``SECTION_KEY`` environment variable, ``st.secrets`` when the app
+    has already imported Streamlit, then ``.streamlit/secrets.toml``.
+    Raises KeyError unless a ``default`` is given.
+    """
+    value = os.environ.get(f"{section}_{key}".upper())
+    if value:
+        return value
+
+    st = sys.modules.get("streamlit")
+    if st is not None:
+        try:
+            return st.secrets[section][key]
+        except Exception:
+            pass
+
+    try:
+        return _load_secrets_file()[section][key]
+    except KeyError:
+        if default is not _MISSING:
+            return default
+        raise KeyError(f"Secret {section}.{key} not found") from None
@@ -0,0 +1,110 @@
+from datetime import datetime, timezone
+import threading
+import hashlib
+import sqlite3
+import json
+
+
+CACHE_PATH = "extraction_cache.db"
+MAX_ENTRIES = 20000
+MAX_BYTES = 64 * 1024 * 1024
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ExtractionCache:
+    """Persistent map of (content hash, prompt version, model) -> parsed JSON.
+
+    Backed by SQLite so repeat scans survive restarts. When either limit is
+    exceeded the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = MAX_ENTRIES,
+                 max_bytes: int = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                content_hash TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                model TEXT NOT NULL,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used_at TEXT NOT NULL,
+                PRIMARY KEY (content_hash, prompt_version, model)
+            )
+        """)
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_used
+            ON extraction_cache (last_used_at)
+        """)
+        self._conn.commit()
+
+    def get(self, digest: str, prompt_version: str, models: list):
+        """Return the cached result from the first of ``models`` that has one."""
+        with self._lock:
+            for model in models:
+                row = self._conn.execute(
+                    "SELECT result FROM extraction_cache "
+                    "WHERE content_hash = ? AND prompt_version = ? AND model = ?",
+                    (digest, prompt_version, model),
+                ).fetchone()
+                if row:
+                    with self._conn:
+                        self._conn.execute(
+                            "UPDATE extraction_cache SET last_used_at = ? "
+                            "WHERE content_hash = ? AND prompt_version = ? AND model = ?",
+                            (_now(), digest, prompt_version, model),
+                        )
+                    return json.loads(row[0])
+        return None
+
+    def put(self, digest: str, prompt_version: str, model: str, result: dict):
+        payload = json.dumps(result, ensure_ascii=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extraction_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, prompt_version, model, payload, len(payload), _now()),
+            )
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extraction_cache"
+            ).fetchone()
+        return {"entries": count, "bytes": size}
+
+    def _evict(self):
+        count, size = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extraction_cache"
+        ).fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+
+        # Walk from least to most recently used until both limits hold.
+        stale = []
+        for digest, version, model, entry_size in self._conn.execute(
+            "SELECT content_hash, prompt_version, model, size "
+            "FROM extraction_cache ORDER BY last_used_at"
+        ):
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            stale.append((digest, version, model))
+            count -= 1
+            size -= entry_size
+
+        self._conn.executemany(
+            "DELETE FROM extraction_cache "
+            "WHERE content_hash = ? AND prompt_version = ? AND model = ?",
+            stale,
+        )
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
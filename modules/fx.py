@@ -0,0 +1,88 @@
+from datetime import date as Date
+from bisect import bisect_right
+import pandas as pd
+import numpy as np
+import csv
+import re
+
+
+# Rates are quoted as units of each currency per one FX_BASE; the base itself is always 1.
+FX_BASE = "USD"
+# What the extraction prompt returns; the STATS reporting currency is one of these.
+REPORTING_CURRENCIES = ("MXN", "USD")
+CURRENCY_RE = re.compile(r"^[A-Z]{3}$")
+
+
+def read_rates(path: str) -> list:
+    """``(currency, date, rate)`` rows of a ``date,currency,rate`` CSV file.
+
+    One row per currency and day, ``rate`` in units of the currency per one
+    FX_BASE (e.g. ``2026-10-16,MXN,18.35``). Raises ValueError naming the
+    first malformed line.
+    """
+    rows = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for line, record in enumerate(csv.DictReader(f), start=2):
+            try:
+                currency = record["currency"].strip().upper()
+                day = Date.fromisoformat(record["date"].strip()).isoformat()
+                rate = float(record["rate"])
+            except (KeyError, AttributeError, TypeError, ValueError) as e:
+                raise ValueError(f"{path}:{line}: expected date,currency,rate ({e})") from None
+            if not CURRENCY_RE.match(currency) or not rate > 0:
+                raise ValueError(f"{path}:{line}: bad currency or rate {record}")
+            rows.append((currency, day, rate))
+    return rows
+
+
+class RateTable:
+    """Daily FX rates, read as of a date.
+
+    A day without a published rate (weekend, holiday) uses the last rate
+    before it; a day before the first one has no rate. Lookups are memoized
+    per ``(currency, date)``, and ``convert`` only looks up each distinct
+    pair of its input once.
+    """
+
+    def __init__(self, rows=()):
+        self._dates = {}
+        self._rates = {}
+        for currency, day, rate in sorted(rows):
+            self._dates.setdefault(currency, []).append(day)
+            self._rates.setdefault(currency, []).append(float(rate))
+        self._cache = {}
+
+    def __bool__(self):
+        return bool(self._dates)
+
+    def rate(self, currency: str, day: str):
+        """Units of ``currency`` per one FX_BASE on ``day`` (ISO date), or None."""
+        key = (currency, day)
+        if key not in self._cache:
+            if currency == FX_BASE:
+                value = 1.0
+            else:
+                position = bisect_right(self._dates.get(currency, ()), day)
+                value = self._rates[currency][position - 1] if position else None
+            self._cache[key] = value
+        return self._cache[key]
+
+    def factor(self, currency: str, day: str, to: str):
+        """Multiplier from ``currency`` to ``to`` on ``day``, or None without both rates."""
+        if currency == to:
+            return 1.0
+        source, target = self.rate(currency, day), self.rate(to, day)
+        return target / source if source and target else None
+
+    def convert(self, amounts, currencies, days, to: str) -> np.ndarray:
+        """``amounts`` in ``to``; NaN where a rate is missing.
+
+        ``currencies`` and ``days`` (ISO dates) are aligned with ``amounts``.
+        """
+        codes, pairs = pd.MultiIndex.from_arrays([currencies, days]).factorize()
+        # A trailing NaN for the -1 code of a missing currency or day.
+        factors = np.array(
+            [self.factor(currency, day, to) for currency, day in pairs] + [None], dtype="float64"
+        )
+        return np.asarray(amounts, dtype="float64") * factors[codes]
+
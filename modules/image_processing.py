@@ -0,0 +1,121 @@
+from PIL import Image, ImageOps
+import time
+import io
+import re
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+
+MAX_DIMENSION = 1600
+JPEG_QUALITY = 80
+THUMBNAIL_SIZE = 320
+THUMBNAIL_QUALITY = 70
+
+# Scanned PDFs usually store each page as one JPEG (DCTDecode) stream.
+DCT_STREAM_RE = re.compile(rb"/DCTDecode.*?stream\r?\n", re.DOTALL)
+
+FORMATS = {
+    "JPEG": ("image/jpeg", "jpg"),
+    "WEBP": ("image/webp", "webp"),
+}
+
+
+def extension_for(mime_type: str) -> str:
+    for fmt_mime, ext in FORMATS.values():
+        if fmt_mime == mime_type:
+            return ext
+    return mime_type.rsplit("/", 1)[-1]
+
+
+def preprocess_image(data: bytes, mime_type: str, max_dimension: int = MAX_DIMENSION,
+                     grayscale: bool = True, fmt: str = "JPEG", quality: int = JPEG_QUALITY,
+                     timings: dict = None):
+    """Shrink a receipt photo before upload and inference.
+
+    Fixes EXIF orientation, downscales to ``max_dimension``, optionally
+    converts to grayscale with auto-contrast (thermal paper), and re-encodes
+    as JPEG or WebP. Returns ``(bytes, mime_type)``; non-images and images
+    that would not get smaller are returned unchanged. Stage durations in
+    seconds are added to ``timings`` when given.
+    """
+    if not mime_type.startswith("image/"):
+        return data, mime_type
+
+    timings = timings if timings is not None else {}
+
+    start = time.perf_counter()
+    image = Image.open(io.BytesIO(data))
+    # JPEG can decode straight to a reduced scale, skipping most of the work.
+    image.draft("RGB", (max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image)
+    timings["decode"] = timings.get("decode", 0) + time.perf_counter() - start
+
+    start = time.perf_counter()
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    timings["resize"] = timings.get("resize", 0) + time.perf_counter() - start
+
+    start = time.perf_counter()
+    if grayscale:
+        image = ImageOps.autocontrast(image.convert("L"), cutoff=1)
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    timings["normalize"] = timings.get("normalize", 0) + time.perf_counter() - start
+
+    start = time.perf_counter()
+    out = io.BytesIO()
+    image.save(out, format=fmt, quality=quality, optimize=True)
+    timings["encode"] = timings.get("encode", 0) + time.perf_counter() - start
+
+    processed = out.getvalue()
+    if len(processed) >= len(data):
+        return data, mime_type
+    return processed, FORMATS[fmt][0]
+
+
+def _pdf_first_page(data: bytes, size: int):
+    if pdfium is not None:
+        try:
+            page = pdfium.PdfDocument(data)[0]
+            return page.render(scale=2 * size / max(page.get_size())).to_pil()
+        except Exception:
+            pass
+    match = DCT_STREAM_RE.search(data)
+    if match is None:
+        return None
+    end = data.find(b"endstream", match.end())
+    image = Image.open(io.BytesIO(data[match.end():end]))
+    image.draft("RGB", (size, size))
+    image.load()
+    return image
+
+
+def make_thumbnail(data: bytes, mime_type: str, size: int = THUMBNAIL_SIZE,
+                   quality: int = THUMBNAIL_QUALITY):
+    """Small JPEG preview of an image or a PDF's first page.
+
+    PDFs are rendered with pypdfium2 when installed, otherwise the first
+    embedded JPEG is used. Returns None when there is nothing to draw.
+    """
+    try:
+        if mime_type == "application/pdf":
+            image = _pdf_first_page(data, size)
+        elif mime_type.startswith("image/"):
+            image = Image.open(io.BytesIO(data))
+            image.draft("RGB", (size, size))
+            image = ImageOps.exif_transpose(image)
+        else:
+            return None
+        if image is None:
+            return None
+
+        image.thumbnail((size, size), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=quality, optimize=True)
+        return out.getvalue()
+    except Exception:
+        return None
@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import threading
+import sqlite3
+import uuid
+
+from modules.pipeline import scan_files
+from modules.supabase_client import get_client, INSERT_BATCH_SIZE
+from modules.storage import save_receipts
+
+
+JOBS_PATH = "jobs.db"
+MAX_RUNNING_BATCHES = 2
+KEEP_FINISHED_DAYS = 7
+
+ACTIVE_STATUSES = ("pending", "processing")
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+class JobQueue:
+    """Background scan jobs backed by a SQLite table.
+
+    ``submit`` stores the files and returns job ids immediately; a small
+    thread pool runs each submission through the scan pipeline and records
+    per-file status. Jobs interrupted by a restart stay pending until
+    ``resume`` is called with the owner's session.
+    """
+
+    def __init__(self, path: str = JOBS_PATH, max_batches: int = MAX_RUNNING_BATCHES):
+        self._lock = threading.Lock()
+        self._running = set()
+        self._pool = ThreadPoolExecutor(max_batches, thread_name_prefix="scan-job")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS scan_jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    mime_type TEXT NOT NULL,
+                    payload BLOB,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_scan_jobs_user_created
+                ON scan_jobs (user_id, created_at DESC)
+            """)
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=KEEP_FINISHED_DAYS)).isoformat()
+            self._conn.execute(
+                "DELETE FROM scan_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (cutoff,),
+            )
+
+    def submit(self, user: dict, files: list) -> list:
+        """Queue ``(name, bytes-like, mime_type)`` files for ``user``; returns job ids.
+
+        The bytes are copied into jobs.db, so a job survives a restart, and
+        the worker reads them back as a fresh ``bytes`` object: each queued
+        file is held once more in memory while it is scanned.
+        """
+        now = _now()
+        rows = [
+            (str(uuid.uuid4()), user["id"], name, mime_type, data, "pending", now, now)
+            for name, data, mime_type in files
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO scan_jobs (id, user_id, name, mime_type, payload, status, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        job_ids = [row[0] for row in rows]
+        self._schedule(user, job_ids)
+        return job_ids
+
+    def resume(self, user: dict) -> int:
+        """Re-schedule the user's unfinished jobs left over from a previous process."""
+        with self._lock:
+            job_ids = [
+                row["id"]
+                for row in self._conn.execute(
+                    "SELECT id FROM scan_jobs WHERE user_id = ? AND status IN (?, ?)",
+                    (user["id"], *ACTIVE_STATUSES),
+                )
+                if row["id"] not in self._running
+            ]
+        if job_ids:
+            self._schedule(user, job_ids)
+        return len(job_ids)
+
+    def list_jobs(self, user_id: str, limit: int = 50) -> list:
+        with self._lock:
+            return [
+                dict(row)
+                for row in self._conn.execute(
+                    "SELECT id, name, status, error, created_at, updated_at FROM scan_jobs "
+                    "WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
+                    (user_id, limit),
+                )
+            ]
+
+    def dismiss(self, user_id: str, job_id: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM scan_jobs WHERE id = ? AND user_id = ? AND status IN ('done', 'failed')",
+                (job_id, user_id),
+            )
+
+    def _schedule(self, user: dict, job_ids: list):
+        with self._lock:
+            self._running.update(job_ids)
+        self._pool.submit(self._run, user, job_ids)
+
+    def _set_status(self, job_ids: list, status: str, error: str = None):
+        # Finished jobs no longer need their file bytes.
+        clear = status in ("done", "failed")
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE scan_jobs SET status = ?, error = ?, updated_at = ?, "
+                "payload = CASE WHEN ? THEN NULL ELSE payload END WHERE id = ?",
+                [(status, error, _now(), clear, job_id) for job_id in job_ids],
+            )
+
+    def _run(self, user: dict, job_ids: list):
+        try:
+            with self._lock:
+                placeholders = ",".join("?" * len(job_ids))
+                jobs = self._conn.execute(
+                    f"SELECT id, name, mime_type, payload FROM scan_jobs "
+                    f"WHERE id IN ({placeholders}) AND payload IS NOT NULL ORDER BY rowid",
+                    job_ids,
+                ).fetchall()
+            self._set_status([job["id"] for job in jobs], "processing")
+
+            client = get_client(user)
+            files = [(job["name"], job["payload"], job["mime_type"]) for job in jobs]
+            # A companion XML finishes with the PDF it was read with.
+            attached = {}
+            scanned = []
+            for result in scan_files(files, client, user["id"]):
+                result_ids = [jobs[result.index]["id"], *attached.pop(result.index, [])]
+                if result.attached_to is not None:
+                    attached.setdefault(result.attached_to, []).append(result_ids[0])
+                    continue
+                if result.error:
+                    self._set_status(result_ids, "failed", result.error)
+                    continue
+                scanned.append((result_ids, result.data))
+                if len(scanned) >= INSERT_BATCH_SIZE:
+                    self._save(user, client, scanned)
+            if scanned:
+                self._save(user, client, scanned)
+        except Exception as e:
+            with self._lock:
+                placeholders = ",".join("?" * len(job_ids))
+                unfinished = [
+                    row["id"]
+                    for row in self._conn.execute(
+                        f"SELECT id FROM scan_jobs WHERE id IN ({placeholders}) "
+                        f"AND status IN (?, ?)",
+                        (*job_ids, *ACTIVE_STATUSES),
+                    )
+                ]
+            self._set_status(unfinished, "failed", str(e))
+        finally:
+            with self._lock:
+                self._running.difference_update(job_ids)
+
+    def _save(self, user: dict, client, scanned: list):
+        job_ids = [job_id for ids, _ in scanned for job_id in ids]
+        try:
+            save_receipts([data for _, data in scanned], user["id"], client=client)
+            self._set_status(job_ids, "done")
+        except Exception as e:
+            self._set_status(job_ids, "failed", f"Save failed: {e}")
+        scanned.clear()
+
+
+def get_job_queue() -> JobQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
@@ -0,0 +1,41 @@
+import re
+
+
+# Same table as public.normalize_item_name, so local and Supabase rows agree.
+ACCENTS = str.maketrans("áàäâãéèëêíìïîóòöôõúùüûñç", "aaaaaeeeeiiiiooooouuuunc")
+NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_item(name: str) -> str:
+    """Lowercase ASCII words of an item name: "PAÑALES Huggies-3" -> "panales huggies 3"."""
+    return NON_WORD_RE.sub(" ", (name or "").lower().translate(ACCENTS)).strip()
+
+
+def _number(value, default: float) -> float:
+    if isinstance(value, str):
+        value = re.sub(r"[^\d.\-]", "", value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def item_rows(items) -> list:
+    """``(position, name, name_normalized, price, quantity)`` for each usable item."""
+    rows = []
+    for position, item in enumerate(items or [], start=1):
+        if not isinstance(item, dict):
+            continue
+        name = str(item.get("item") or "").strip()
+        normalized = normalize_item(name)
+        if not normalized:
+            continue
+        quantity = _number(item.get("quantity"), 1.0)
+        rows.append((
+            position,
+            name,
+            normalized,
+            _number(item.get("price"), 0.0),
+            quantity if quantity > 0 else 1.0,
+        ))
+    return rows
@@ -0,0 +1,935 @@
+from datetime import datetime, timezone
+import sqlite3
+import uuid
+import json
+
+from modules.line_items import normalize_item, item_rows
+from modules.search import search_text, match_query
+from modules.merchants import canonicalize
+from modules.fx import FX_BASE
+
+
+DB_PATH = "receipts.db"
+
+# Columns added to receipts.db files created before the app kept a local
+# replica. ``remote`` marks rows Supabase has; ``dirty`` rows (inserts, or
+# deletes when ``deleted`` is set) still have to be pushed.
+SYNC_COLUMNS = {
+    "uuid": "TEXT",
+    "user_id": "TEXT",
+    "original_url": "TEXT",
+    "thumbnail_url": "TEXT",
+    "file_type": "TEXT",
+    "content_hash": "TEXT",
+    "updated_at": "TEXT",
+    "remote": "INTEGER NOT NULL DEFAULT 0",
+    "dirty": "INTEGER NOT NULL DEFAULT 0",
+    "deleted": "INTEGER NOT NULL DEFAULT 0",
+}
+
+# Supabase column name -> local column; rows keep an integer key for receipt_items.
+COLUMN_MAP = {
+    "id": "uuid",
+}
+REMOTE_COLUMNS = (
+    "id", "user_id", "created_at", "updated_at", "date", "merchant", "total", "currency",
+    "category", "summary", "items", "file_url", "original_url", "thumbnail_url", "file_type",
+    "content_hash", "merchant_raw", "rfc",
+)
+
+# Matches ranked per search, taken most recently saved first.
+SEARCH_CANDIDATES = 2000
+
+
+def connect(path: str = DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    migrate(conn)
+    return conn
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Bring the file up to the newest schema; returns its version.
+
+    ``PRAGMA user_version`` counts the ``MIGRATIONS`` already applied. Each
+    step runs in its own write transaction together with the version bump,
+    so a failing step leaves the file at the previous version and processes
+    opening the same file concurrently apply every step once.
+    """
+    while conn.execute("PRAGMA user_version").fetchone()[0] < len(MIGRATIONS):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < len(MIGRATIONS):
+                MIGRATIONS[version](conn)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return len(MIGRATIONS)
+
+
+def _create_receipts(conn: sqlite3.Connection):
+    """The original receipts table plus the sync columns of the local replica.
+
+    Files created before the runner existed may already have some of this,
+    so every statement here tolerates it.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS receipts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            merchant TEXT,
+            date TEXT,
+            total REAL,
+            currency TEXT,
+            category TEXT,
+            narrative_summary TEXT,
+            items TEXT,
+            image_path TEXT,
+            created_at TIMESTAMP
+        )
+    """)
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(receipts)")}
+    for column, kind in SYNC_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE receipts ADD COLUMN {column} {kind}")
+
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS receipts_uuid_idx ON receipts (uuid)")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS receipts_user_hash_idx
+        ON receipts (user_id, content_hash) WHERE content_hash IS NOT NULL
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS receipts_user_dirty_idx
+        ON receipts (user_id) WHERE dirty = 1
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            user_id TEXT PRIMARY KEY,
+            pulled_until TEXT,
+            synced_at TEXT
+        )
+    """)
+
+
+def _create_items(conn: sqlite3.Connection):
+    """Create receipt_items and fill it for receipts saved before it existed."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS receipt_items (
+            receipt_id INTEGER NOT NULL REFERENCES receipts (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            name_normalized TEXT NOT NULL,
+            price REAL NOT NULL DEFAULT 0,
+            quantity REAL NOT NULL DEFAULT 1,
+            PRIMARY KEY (receipt_id, position)
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS receipt_items_name_idx ON receipt_items (name_normalized)"
+    )
+    missing = conn.execute("""
+        SELECT id, items FROM receipts r
+        WHERE items IS NOT NULL AND items NOT IN ('', '[]') AND deleted = 0
+          AND NOT EXISTS (SELECT 1 FROM receipt_items i WHERE i.receipt_id = r.id)
+    """).fetchall()
+    for receipt_id, items in missing:
+        try:
+            items = json.loads(items)
+        except ValueError:
+            continue
+        _insert_items(conn, receipt_id, items)
+
+
+def _match_supabase(conn: sqlite3.Connection):
+    """Use the Supabase column names and index the HISTORY and STATS queries.
+
+    The history index carries the columns STATS aggregates, so both read
+    only the index; both indexes skip tombstones like every read does.
+    """
+    conn.execute("ALTER TABLE receipts RENAME COLUMN narrative_summary TO summary")
+    conn.execute("ALTER TABLE receipts RENAME COLUMN image_path TO file_url")
+    conn.execute("DROP INDEX IF EXISTS receipts_user_created_idx")
+    conn.execute("""
+        CREATE INDEX receipts_user_created_idx
+        ON receipts (user_id, created_at DESC, uuid DESC, merchant, category, currency, total)
+        WHERE deleted = 0
+    """)
+    conn.execute("""
+        CREATE INDEX receipts_user_merchant_idx
+        ON receipts (user_id, merchant, created_at DESC, uuid DESC)
+        WHERE deleted = 0
+    """)
+
+
+def _create_search(conn: sqlite3.Connection):
+    """Full-text index of merchant, summary and item names, keyed by receipts.id."""
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS receipt_search USING fts5(merchant, summary, items)"
+    )
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS receipts_search_delete AFTER DELETE ON receipts
+        BEGIN
+            DELETE FROM receipt_search WHERE rowid = old.id;
+        END
+    """)
+    rows = _decode_items(_rows(
+        conn, "SELECT id, merchant, summary, items FROM receipts WHERE deleted = 0"
+    ))
+    for row in rows:
+        _index_search(conn, row["id"], row["merchant"], row["summary"], row["items"])
+
+
+def _create_merchants(conn: sqlite3.Connection):
+    """Canonical merchants per user; receipts point at theirs by merchant_id.
+
+    Existing rows get the merchant of their exact name; fuzzy merging of
+    old spellings is left to backfill_merchants.py on Supabase, which the
+    replica then pulls.
+    """
+    conn.execute("""
+        CREATE TABLE merchants (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT,
+            key TEXT NOT NULL,
+            name TEXT NOT NULL,
+            rfc TEXT
+        )
+    """)
+    conn.execute("CREATE UNIQUE INDEX merchants_user_key_idx ON merchants (user_id, key)")
+    conn.execute("ALTER TABLE receipts ADD COLUMN merchant_id INTEGER REFERENCES merchants (id)")
+    conn.execute("ALTER TABLE receipts ADD COLUMN merchant_raw TEXT")
+    conn.execute("ALTER TABLE receipts ADD COLUMN rfc TEXT")
+    conn.execute(
+        "CREATE INDEX receipts_merchant_id_idx ON receipts (merchant_id) WHERE deleted = 0"
+    )
+    conn.execute("DROP INDEX receipts_user_created_idx")
+    conn.execute("""
+        CREATE INDEX receipts_user_created_idx
+        ON receipts (user_id, created_at DESC, uuid DESC, merchant_id, merchant, category,
+                     currency, total)
+        WHERE deleted = 0
+    """)
+    rows = conn.execute("""
+        SELECT DISTINCT user_id, merchant FROM receipts WHERE merchant IS NOT NULL
+    """).fetchall()
+    for user_id, merchant in rows:
+        conn.execute(
+            "UPDATE receipts SET merchant_id = ? WHERE user_id IS ? AND merchant = ?",
+            (_merchant_id(conn, user_id, merchant), user_id, merchant),
+        )
+
+
+def _create_fx_rates(conn: sqlite3.Connection):
+    """Daily FX rates, imported from a file by import_fx_rates.py and shared by every user."""
+    conn.execute("""
+        CREATE TABLE fx_rates (
+            currency TEXT NOT NULL,
+            date TEXT NOT NULL,
+            rate REAL NOT NULL,
+            PRIMARY KEY (currency, date)
+        ) WITHOUT ROWID
+    """)
+
+
+def _scope_fx_rates(conn: sqlite3.Connection):
+    """FX rates per user, synced with Supabase's fx_rates like receipts.
+
+    Rates imported before were shared by every user of the file; each user
+    with receipts here gets a copy, queued for their next push.
+    """
+    conn.execute("ALTER TABLE fx_rates RENAME TO fx_rates_shared")
+    conn.execute("""
+        CREATE TABLE fx_rates (
+            user_id TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            date TEXT NOT NULL,
+            rate REAL NOT NULL,
+            dirty INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, currency, date)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT INTO fx_rates (user_id, currency, date, rate, dirty)
+        SELECT u.user_id, s.currency, s.date, s.rate, 1
+        FROM fx_rates_shared s,
+             (SELECT DISTINCT user_id FROM receipts WHERE user_id IS NOT NULL) u
+    """)
+    conn.execute("DROP TABLE fx_rates_shared")
+    conn.execute("ALTER TABLE sync_state ADD COLUMN fx_pulled_until TEXT")
+
+
+# Append only: a file at version n has run the first n steps.
+MIGRATIONS = [
+    _create_receipts,
+    _create_items,
+    _match_supabase,
+    _create_search,
+    _create_merchants,
+    _create_fx_rates,
+    _scope_fx_rates,
+]
+
+
+def _insert_items(conn: sqlite3.Connection, receipt_id: int, items):
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO receipt_items
+            (receipt_id, position, name, name_normalized, price, quantity)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [(receipt_id, *row) for row in item_rows(items)],
+    )
+
+
+def _index_search(conn: sqlite3.Connection, receipt_id: int, merchant: str, summary: str,
+                  items):
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO receipt_search (rowid, merchant, summary, items)
+        VALUES (?, ?, ?, ?)
+        """,
+        (
+            receipt_id,
+            search_text(merchant),
+            search_text(summary),
+            search_text(" ".join(row[1] for row in item_rows(items))),
+        ),
+    )
+
+
+def _merchant_id(conn: sqlite3.Connection, user_id: str, merchant: str, rfc: str = None):
+    """Id of the user's merchant named ``merchant``, created on first use.
+
+    Same rule as the Supabase receipts_assign_merchant trigger: one row per
+    normalized name. Choosing the canonical name is up to ``canonicalize``.
+    """
+    key = normalize_item(merchant)
+    if not key:
+        return None
+    row = conn.execute(
+        "SELECT id, rfc FROM merchants WHERE user_id IS ? AND key = ?", (user_id, key)
+    ).fetchone()
+    if row is None:
+        return conn.execute(
+            "INSERT INTO merchants (user_id, key, name, rfc) VALUES (?, ?, ?, ?)",
+            (user_id, key, merchant, rfc),
+        ).lastrowid
+    if rfc and not row["rfc"]:
+        conn.execute("UPDATE merchants SET rfc = ? WHERE id = ?", (rfc, row["id"]))
+    return row["id"]
+
+
+def _now() -> str:
+    return iso_timestamp(datetime.now(timezone.utc))
+
+
+def iso_timestamp(value) -> str:
+    """One sortable UTC format for local and Supabase timestamps."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def save_receipts(conn: sqlite3.Connection, receipts: list, user_id: str = None,
+                  pending: bool = False) -> list:
+    """Insert extracted receipts (``analyze_receipt`` dicts) and their items in one transaction.
+
+    Merchants are saved under their canonical names (``merchants.canonicalize``).
+    With ``pending`` the rows are queued for the next push to Supabase.
+    Returns the new receipts' ids.
+    """
+    now = _now()
+    ids = []
+    with conn:
+        receipts = canonicalize(receipts, get_merchants(conn, user_id))
+        for data in receipts:
+            receipt_id = str(uuid.uuid4())
+            cursor = conn.execute(
+                """
+                INSERT INTO receipts (uuid, user_id, merchant, merchant_id, merchant_raw, rfc,
+                                      date, total, currency, category, summary, items,
+                                      file_url, original_url, thumbnail_url, file_type,
+                                      content_hash, created_at, updated_at, dirty)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    receipt_id,
+                    user_id,
+                    data.get("merchant"),
+                    _merchant_id(conn, user_id, data.get("merchant"), data.get("rfc")),
+                    data.get("merchant_raw"),
+                    data.get("rfc"),
+                    data.get("date"),
+                    float(data.get("total") or 0),
+                    data.get("currency"),
+                    data.get("category"),
+                    data.get("narrative_summary"),
+                    json.dumps(data.get("items", []), ensure_ascii=False),
+                    data.get("file_url") or data.get("image_path"),
+                    data.get("original_url"),
+                    data.get("thumbnail_url"),
+                    data.get("document_type"),
+                    data.get("content_hash"),
+                    now,
+                    now,
+                    int(pending),
+                ),
+            )
+            _insert_items(conn, cursor.lastrowid, data.get("items"))
+            _index_search(
+                conn, cursor.lastrowid, data.get("merchant"), data.get("narrative_summary"),
+                data.get("items"),
+            )
+            ids.append(receipt_id)
+    return ids
+
+
+def delete_receipt(conn: sqlite3.Connection, receipt_id: str, user_id: str = None):
+    """Remove a receipt, leaving a tombstone until the delete is pushed.
+
+    Rows Supabase has not confirmed get one too: a push of the row may
+    already be under way, and the tombstone makes the next push delete it.
+    """
+    with conn:
+        row = conn.execute(
+            "SELECT id FROM receipts WHERE uuid = ? AND user_id IS ?",
+            (receipt_id, user_id),
+        ).fetchone()
+        if row is None:
+            return
+        conn.execute(
+            "UPDATE receipts SET deleted = 1, dirty = 1, updated_at = ? WHERE id = ?",
+            (_now(), row["id"]),
+        )
+        conn.execute("DELETE FROM receipt_items WHERE receipt_id = ?", (row["id"],))
+        conn.execute("DELETE FROM receipt_search WHERE rowid = ?", (row["id"],))
+
+
+def _rows(conn, sql: str, params=()):
+    return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+
+def _select(columns: str) -> str:
+    names = REMOTE_COLUMNS if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+    return ", ".join(
+        f"{COLUMN_MAP[name]} AS {name}" if name in COLUMN_MAP else name for name in names
+    )
+
+
+def _decode_items(rows: list) -> list:
+    for row in rows:
+        if isinstance(row.get("items"), str):
+            try:
+                row["items"] = json.loads(row["items"])
+            except ValueError:
+                row["items"] = []
+    return rows
+
+
+def _filters(user_id: str, merchants: list = None, start: str = None, end: str = None,
+             table: str = "") -> tuple:
+    """WHERE terms and parameters of the HISTORY filters, tombstones excluded."""
+    where = [f"{table}user_id IS ?", f"{table}deleted = 0"]
+    params = [user_id]
+    if merchants:
+        where.append(f"{table}merchant IN ({','.join('?' * len(merchants))})")
+        params.extend(merchants)
+    if start:
+        where.append(f"{table}created_at >= ?")
+        params.append(start)
+    if end:
+        where.append(f"{table}created_at < ?")
+        params.append(end)
+    return where, params
+
+
+def get_user_receipts(conn: sqlite3.Connection, user_id: str, columns: str = "*",
+                      limit: int = None, cursor: tuple = None, merchants: list = None,
+                      start: str = None, end: str = None) -> list:
+    """Same contract as ``supabase_client.get_user_receipts``: newest first, keyset ``cursor``."""
+    where, params = _filters(user_id, merchants, start, end)
+    if cursor:
+        created_at, receipt_id = cursor
+        where.append("(created_at < ? OR (created_at = ? AND uuid < ?))")
+        params.extend([created_at, created_at, receipt_id])
+
+    sql = (
+        f"SELECT {_select(columns)} FROM receipts WHERE {' AND '.join(where)} "
+        f"ORDER BY created_at DESC, uuid DESC"
+    )
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return _decode_items(_rows(conn, sql, params))
+
+
+def search_receipts(conn: sqlite3.Connection, user_id: str, query: str, columns: str = "*",
+                    limit: int = None, offset: int = 0, merchants: list = None,
+                    start: str = None, end: str = None) -> list:
+    """Receipts matching ``query`` best first, like the Supabase search_receipts RPC.
+
+    Merchant matches outrank item names, which outrank the summary. Only the
+    ``SEARCH_CANDIDATES`` most recently saved matches are ranked, so a word
+    found on most receipts costs about the same as a rare one.
+    """
+    match = match_query(query)
+    if not match:
+        return []
+    where, params = _filters(user_id, merchants, start, end, table="receipts.")
+    return _decode_items(_rows(conn, f"""
+        SELECT {_select(columns)} FROM (
+            SELECT receipts.*, bm25(receipt_search, 10.0, 1.0, 5.0) AS score
+            FROM receipt_search
+            JOIN receipts ON receipts.id = receipt_search.rowid
+            WHERE receipt_search MATCH ? AND {' AND '.join(where)}
+            ORDER BY receipt_search.rowid DESC
+            LIMIT ?
+        )
+        ORDER BY score, created_at DESC, uuid DESC
+        LIMIT ? OFFSET ?
+    """, (match, *params, SEARCH_CANDIDATES, limit or -1, offset)))
+
+
+def find_saved_hashes(conn: sqlite3.Connection, user_id: str, hashes: list) -> dict:
+    if not hashes:
+        return {}
+    hashes = list(hashes)
+    rows = _rows(conn, f"""
+        SELECT uuid AS id, merchant, created_at, content_hash FROM receipts
+        WHERE user_id IS ? AND deleted = 0
+          AND content_hash IN ({','.join('?' * len(hashes))})
+    """, (user_id, *hashes))
+    return {row["content_hash"]: row for row in rows}
+
+
+def get_merchants(conn: sqlite3.Connection, user_id: str = None) -> list:
+    """The user's canonical merchants that still have receipts, oldest first."""
+    return _rows(conn, """
+        SELECT id, name, rfc FROM merchants m
+        WHERE user_id IS ?
+          AND EXISTS (SELECT 1 FROM receipts r WHERE r.merchant_id = m.id AND r.deleted = 0)
+        ORDER BY id
+    """, (user_id,))
+
+
+def get_filter_options(conn: sqlite3.Connection, user_id: str = None) -> dict:
+    """Same shape as the Supabase receipt_filter_options RPC."""
+    merchants = conn.execute("""
+        SELECT DISTINCT merchant FROM receipts
+        WHERE user_id IS ? AND deleted = 0 AND merchant IS NOT NULL
+        ORDER BY merchant
+    """, (user_id,)).fetchall()
+    years = conn.execute("""
+        SELECT DISTINCT CAST(strftime('%Y', created_at) AS INTEGER) AS year FROM receipts
+        WHERE user_id IS ? AND deleted = 0 AND created_at IS NOT NULL
+        ORDER BY year DESC
+    """, (user_id,)).fetchall()
+    return {
+        "merchants": [row[0] for row in merchants],
+        "years": [row[0] for row in years],
+    }
+
+
+STATS_ROWS = """
+    SELECT merchant_id,
+           COALESCE(category, 'Other') AS category,
+           COALESCE(currency, 'N/A') AS currency,
+           COALESCE(total, 0) AS total,
+           created_at
+    FROM receipts
+    WHERE user_id IS :user_id AND deleted = 0
+"""
+
+# Units of {currency} per one FX_BASE on day d.day: the last rate on or before it.
+FX_RATE = """
+    CASE WHEN {currency} = :fx_base THEN 1.0 ELSE (
+        SELECT rate FROM fx_rates
+        WHERE fx_rates.user_id = :user_id
+          AND fx_rates.currency = {currency} AND fx_rates.date <= d.day
+        ORDER BY fx_rates.date DESC
+        LIMIT 1
+    ) END
+"""
+
+# STATS_ROWS with totals converted to :currency by the factors in temp.stats_fx
+# (see _fill_stats_fx); a receipt without one keeps its own currency.
+CONVERTED_STATS_ROWS = """
+    SELECT r.merchant_id,
+           COALESCE(r.category, 'Other') AS category,
+           CASE WHEN fx.factor IS NULL THEN COALESCE(r.currency, 'N/A')
+                ELSE :currency END AS currency,
+           COALESCE(r.total, 0) * COALESCE(fx.factor, 1.0) AS total,
+           r.created_at
+    FROM receipts r
+    LEFT JOIN temp.stats_fx fx
+      ON fx.currency = COALESCE(r.currency, 'N/A')
+     AND fx.day = COALESCE(r.date, substr(r.created_at, 1, 10))
+    WHERE r.user_id IS :user_id AND r.deleted = 0
+"""
+
+
+def _fill_stats_fx(conn: sqlite3.Connection, params: dict):
+    """Multipliers to :currency for each distinct (currency, day) of the user's receipts.
+
+    Rates are looked up once per pair instead of once per receipt, and the
+    STATS queries then join each receipt to its factor by primary key.
+    """
+    with conn:
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS stats_fx (
+                currency TEXT NOT NULL,
+                day TEXT NOT NULL,
+                factor REAL,
+                PRIMARY KEY (currency, day)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("DELETE FROM temp.stats_fx")
+        conn.execute(f"""
+            INSERT INTO temp.stats_fx (currency, day, factor)
+            SELECT d.currency, d.day,
+                   CASE WHEN d.currency = :currency THEN 1.0
+                        ELSE {FX_RATE.format(currency=":currency")}
+                             / {FX_RATE.format(currency="d.currency")}
+                   END
+            FROM (
+                SELECT DISTINCT COALESCE(currency, 'N/A') AS currency,
+                       COALESCE(date, substr(created_at, 1, 10)) AS day
+                FROM receipts
+                WHERE user_id IS :user_id AND deleted = 0
+            ) d
+        """, params)
+
+
+def save_fx_rates(conn: sqlite3.Connection, rows, user_id: str, pending: bool = False) -> int:
+    """Insert or replace the user's ``(currency, date, rate)`` rows; returns how many.
+
+    With ``pending`` the rates are queued for the next push to Supabase.
+    """
+    with conn:
+        return conn.executemany(
+            """
+            INSERT INTO fx_rates (user_id, currency, date, rate, dirty) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, currency, date) DO UPDATE SET
+                rate = excluded.rate, dirty = excluded.dirty
+            """,
+            [(user_id, currency, day, rate, int(pending)) for currency, day, rate in rows],
+        ).rowcount
+
+
+def get_fx_rates(conn: sqlite3.Connection, user_id: str) -> list:
+    return _rows(conn, """
+        SELECT currency, date, rate FROM fx_rates WHERE user_id = ? ORDER BY currency, date
+    """, (user_id,))
+
+
+def pending_fx_rates(conn: sqlite3.Connection, user_id: str) -> list:
+    """Imported rates Supabase has not seen yet, as ``(currency, date, rate)``."""
+    return [
+        tuple(row) for row in conn.execute(
+            "SELECT currency, date, rate FROM fx_rates WHERE user_id = ? AND dirty = 1",
+            (user_id,),
+        )
+    ]
+
+
+def mark_fx_pushed(conn: sqlite3.Connection, user_id: str, rows: list):
+    # A rate re-imported while the push was in flight stays pending.
+    with conn:
+        conn.executemany(
+            """
+            UPDATE fx_rates SET dirty = 0
+            WHERE user_id = ? AND currency = ? AND date = ? AND rate = ?
+            """,
+            [(user_id, currency, day, rate) for currency, day, rate in rows],
+        )
+
+
+def apply_remote_fx_rates(conn: sqlite3.Connection, user_id: str, rows: list) -> int:
+    """Merge rates pulled from Supabase; pending local ones win. Returns how many changed."""
+    before = conn.total_changes
+    with conn:
+        conn.executemany(
+            """
+            INSERT INTO fx_rates (user_id, currency, date, rate) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, currency, date) DO UPDATE SET rate = excluded.rate
+            WHERE fx_rates.dirty = 0 AND fx_rates.rate != excluded.rate
+            """,
+            [(user_id, row["currency"], row["date"], float(row["rate"])) for row in rows],
+        )
+    return conn.total_changes - before
+
+
+def get_receipt_stats(conn: sqlite3.Connection, top_merchants: int = 10,
+                      user_id: str = None, currency: str = None) -> dict:
+    """Same shape as the Supabase receipt_stats RPC, computed in SQLite.
+
+    With ``currency``, amounts are converted to it at the rate of each
+    receipt's date.
+    """
+    base = CONVERTED_STATS_ROWS if currency else STATS_ROWS
+    params = {"user_id": user_id, "currency": currency, "fx_base": FX_BASE}
+    if currency:
+        _fill_stats_fx(conn, params)
+
+    counts = conn.execute(
+        f"SELECT COUNT(*), COUNT(DISTINCT merchant_id) FROM ({base})", params
+    ).fetchone()
+
+    return {
+        "receipt_count": counts[0],
+        "merchant_count": counts[1],
+        "totals": _rows(conn, f"""
+            SELECT currency, SUM(total) AS total, COUNT(*) AS receipts
+            FROM ({base})
+            GROUP BY currency
+            ORDER BY total DESC
+        """, params),
+        "by_category": _rows(conn, f"""
+            SELECT category, currency, SUM(total) AS total
+            FROM ({base})
+            GROUP BY category, currency
+            ORDER BY total DESC
+        """, params),
+        "by_merchant": _rows(conn, f"""
+            SELECT m.name AS merchant, t.currency, t.total FROM (
+                SELECT merchant_id, currency, SUM(total) AS total,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY currency ORDER BY SUM(total) DESC
+                       ) AS rank
+                FROM ({base})
+                WHERE merchant_id IS NOT NULL
+                GROUP BY merchant_id, currency
+            ) t
+            JOIN merchants m ON m.id = t.merchant_id
+            WHERE t.rank <= :top_merchants
+            ORDER BY t.total DESC
+        """, {**params, "top_merchants": top_merchants}),
+        "by_month": _rows(conn, f"""
+            SELECT strftime('%Y-%m', created_at) AS month, currency, SUM(total) AS total
+            FROM ({base})
+            WHERE created_at IS NOT NULL
+            GROUP BY month, currency
+            ORDER BY month
+        """, params),
+    }
+
+
+def get_item_stats(conn: sqlite3.Connection, top_items: int = 10, user_id: str = None) -> dict:
+    """Same shape as the Supabase receipt_item_stats RPC."""
+    base = """
+        SELECT i.name, i.name_normalized, i.price, i.quantity, i.receipt_id,
+               COALESCE(r.currency, 'N/A') AS currency
+        FROM receipt_items i
+        JOIN receipts r ON r.id = i.receipt_id
+        WHERE r.user_id IS ? AND r.deleted = 0
+    """
+    return {
+        "item_count": conn.execute(
+            f"SELECT COUNT(DISTINCT name_normalized) FROM ({base})", (user_id,)
+        ).fetchone()[0],
+        "top_items": _rows(conn, f"""
+            SELECT name, currency, total, quantity, receipts FROM (
+                SELECT MIN(name) AS name, currency, SUM(price) AS total,
+                       SUM(quantity) AS quantity,
+                       COUNT(DISTINCT receipt_id) AS receipts,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY currency ORDER BY SUM(price) DESC
+                       ) AS rank
+                FROM ({base})
+                GROUP BY name_normalized, currency
+            )
+            WHERE rank <= ?
+            ORDER BY total DESC
+        """, (user_id, top_items)),
+    }
+
+
+def get_item_price_history(conn: sqlite3.Connection, query: str, limit: int = 500,
+                           user_id: str = None) -> list:
+    """Same shape as the Supabase item_price_history RPC."""
+    needle = normalize_item(query)
+    if not needle:
+        return []
+    rows = _rows(conn, """
+        SELECT date(r.created_at) AS date,
+               COALESCE(r.merchant, 'Unknown') AS merchant,
+               i.name,
+               COALESCE(r.currency, 'N/A') AS currency,
+               ROUND(i.price / NULLIF(i.quantity, 0), 2) AS unit_price,
+               i.quantity
+        FROM receipt_items i
+        JOIN receipts r ON r.id = i.receipt_id
+        WHERE r.user_id IS ? AND r.deleted = 0
+          AND i.name_normalized LIKE '%' || ? || '%'
+        ORDER BY r.created_at DESC
+        LIMIT ?
+    """, (user_id, needle, limit))
+    return rows[::-1]
+
+
+def pending_pushes(conn: sqlite3.Connection, user_id: str, limit: int) -> list:
+    """Local inserts Supabase has not seen yet, as Supabase rows."""
+    columns = ", ".join(c for c in REMOTE_COLUMNS if c != "updated_at")
+    return _decode_items(_rows(conn, f"""
+        SELECT {_select(columns)} FROM receipts
+        WHERE user_id = ? AND dirty = 1 AND deleted = 0
+        ORDER BY created_at
+        LIMIT ?
+    """, (user_id, limit)))
+
+
+def pending_deletes(conn: sqlite3.Connection, user_id: str) -> list:
+    return [
+        row[0] for row in conn.execute(
+            "SELECT uuid FROM receipts WHERE user_id = ? AND dirty = 1 AND deleted = 1",
+            (user_id,),
+        )
+    ]
+
+
+def count_pending(conn: sqlite3.Connection, user_id: str) -> int:
+    return conn.execute(
+        "SELECT COUNT(*) FROM receipts WHERE user_id = ? AND dirty = 1", (user_id,)
+    ).fetchone()[0]
+
+
+def mark_pushed(conn: sqlite3.Connection, receipt_ids: list):
+    with conn:
+        conn.executemany(
+            "UPDATE receipts SET dirty = 0, remote = 1 WHERE uuid = ? AND deleted = 0",
+            [(receipt_id,) for receipt_id in receipt_ids],
+        )
+
+
+def purge(conn: sqlite3.Connection, receipt_ids: list):
+    """Forget tombstones once Supabase has applied the delete."""
+    with conn:
+        conn.executemany(
+            "DELETE FROM receipts WHERE uuid = ?", [(receipt_id,) for receipt_id in receipt_ids]
+        )
+
+
+def apply_remote(conn: sqlite3.Connection, user_id: str, rows: list) -> int:
+    """Merge rows pulled from Supabase; returns how many changed locally.
+
+    A pending local delete always wins. Otherwise the copy with the newer
+    ``updated_at`` wins, and Supabase wins ties.
+    """
+    changed = 0
+    with conn:
+        for row in rows:
+            updated_at = iso_timestamp(row.get("updated_at"))
+            local = conn.execute(
+                "SELECT id, dirty, deleted, updated_at FROM receipts WHERE uuid = ?",
+                (row["id"],),
+            ).fetchone()
+            if local is not None and local["dirty"]:
+                if local["deleted"] or (local["updated_at"] or "") > (updated_at or ""):
+                    continue
+            # Already applied: pulls overlap the previous one, and every remote
+            # update moves updated_at.
+            elif local is not None and local["updated_at"] == updated_at:
+                continue
+
+            values = (
+                user_id,
+                row.get("date"),
+                row.get("merchant"),
+                _merchant_id(conn, user_id, row.get("merchant"), row.get("rfc")),
+                row.get("merchant_raw"),
+                row.get("rfc"),
+                float(row.get("total") or 0),
+                row.get("currency"),
+                row.get("category"),
+                row.get("summary"),
+                json.dumps(row.get("items") or [], ensure_ascii=False),
+                row.get("file_url"),
+                row.get("original_url"),
+                row.get("thumbnail_url"),
+                row.get("file_type"),
+                row.get("content_hash"),
+                iso_timestamp(row.get("created_at")),
+                updated_at,
+            )
+            if local is None:
+                cursor = conn.execute(
+                    """
+                    INSERT INTO receipts (user_id, date, merchant, merchant_id, merchant_raw,
+                                          rfc, total, currency, category, summary, items,
+                                          file_url, original_url, thumbnail_url, file_type,
+                                          content_hash, created_at, updated_at, uuid, remote,
+                                          dirty, deleted)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, 0, 0)
+                    """,
+                    (*values, row["id"]),
+                )
+                local_id = cursor.lastrowid
+            else:
+                conn.execute(
+                    """
+                    UPDATE receipts SET user_id = ?, date = ?, merchant = ?, merchant_id = ?,
+                        merchant_raw = ?, rfc = ?, total = ?, currency = ?, category = ?,
+                        summary = ?, items = ?, file_url = ?,
+                        original_url = ?, thumbnail_url = ?, file_type = ?, content_hash = ?,
+                        created_at = ?, updated_at = ?, remote = 1, dirty = 0, deleted = 0
+                    WHERE id = ?
+                    """,
+                    (*values, local["id"]),
+                )
+                local_id = local["id"]
+                conn.execute("DELETE FROM receipt_items WHERE receipt_id = ?", (local_id,))
+            _insert_items(conn, local_id, row.get("items"))
+            _index_search(conn, local_id, row.get("merchant"), row.get("summary"), row.get("items"))
+            changed += 1
+    return changed
+
+
+def apply_tombstones(conn: sqlite3.Connection, user_id: str, receipt_ids: list) -> int:
+    """Drop receipts deleted in Supabase, pending local changes included."""
+    with conn:
+        cursor = conn.executemany(
+            "DELETE FROM receipts WHERE uuid = ? AND user_id = ?",
+            [(receipt_id, user_id) for receipt_id in receipt_ids],
+        )
+    return cursor.rowcount
+
+
+def get_sync_state(conn: sqlite3.Connection, user_id: str) -> dict:
+    row = conn.execute(
+        "SELECT pulled_until, fx_pulled_until, synced_at FROM sync_state WHERE user_id = ?",
+        (user_id,),
+    ).fetchone()
+    return dict(row) if row else {"pulled_until": None, "fx_pulled_until": None, "synced_at": None}
+
+
+def set_sync_state(conn: sqlite3.Connection, user_id: str, pulled_until: str):
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO sync_state (user_id, pulled_until, synced_at) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                pulled_until = COALESCE(excluded.pulled_until, pulled_until),
+                synced_at = excluded.synced_at
+            """,
+            (user_id, pulled_until, _now()),
+        )
+
+
+def set_fx_sync_state(conn: sqlite3.Connection, user_id: str, fx_pulled_until: str):
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO sync_state (user_id, fx_pulled_until) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                fx_pulled_until = COALESCE(excluded.fx_pulled_until, fx_pulled_until)
+            """,
+            (user_id, fx_pulled_until),
+        )
@@ -0,0 +1,432 @@
+from datetime import datetime, timezone
+from dataclasses import dataclass
+from PIL import Image, ImageOps
+import unicodedata
+import functools
+import threading
+import logging
+import sqlite3
+import time
+import re
+import io
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+from modules.ai_service import analyze_receipt, analyze_receipt_text, analyze_receipts
+from modules.cfdi import extract_cfdi, is_xml, pdf_text, PDF_MIME_TYPE
+from modules.config import get_secret
+
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_PATH = "merchant_templates.db"
+OCR_MAX_DIMENSION = 2000
+OCR_TIMEOUT = 20
+
+# A receipt is answered locally only when a merchant template seen at least
+# MIN_TEMPLATE_SEEN times matches, a TOTAL line parses and OCR is this sure.
+MIN_TEMPLATE_SEEN = 2
+# Shorter merchant names are too easy to find in unrelated headers.
+MIN_TEMPLATE_KEY = 5
+LOCAL_MIN_CONFIDENCE = 80
+# Below this, or with too little text, the image is sent instead of the OCR text.
+TEXT_MIN_CONFIDENCE = 60
+MIN_TEXT_CHARS = 80
+HEADER_LINES = 6
+
+TIERS = ("cfdi", "local", "text", "image")
+
+AMOUNT = r"\$?\s*(\d{1,3}(?:,\d{3})+(?:\.\d{2})?|\d+[.,]\d{2})"
+TOTAL_RE = re.compile(
+    r"^\s*(?:GRAN\s+)?TOTAL(?!\s*(?:DE\s+)?(?:ART|PZ|PIEZAS|ITEMS|PRODUCTOS))\b[^\d$]*" + AMOUNT,
+    re.IGNORECASE | re.MULTILINE,
+)
+ITEM_RE = re.compile(r"^(?P<item>[A-Za-zÁÉÍÓÚÑáéíóúñ].*?)\s+" + AMOUNT + r"\s*$", re.MULTILINE)
+NOT_ITEM_RE = re.compile(
+    r"TOTAL|IVA|I\.V\.A|IEPS|CAMBIO|EFECTIVO|TARJETA|PAGO|SU PAGO|DESCUENTO|AHORRO",
+    re.IGNORECASE,
+)
+DATE_RE = re.compile(r"\b(\d{1,2})[/-](\d{1,2})[/-](\d{4}|\d{2})\b")
+ISO_DATE_RE = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+RFC_RE = re.compile(r"\b([A-ZÑ&]{3,4})-?(\d{6})-?([A-Z\d]{3})\b")
+UUID_RE = re.compile(
+    r"\b[0-9A-F]{8}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{12}\b", re.IGNORECASE
+)
+FACTURA_RE = re.compile(
+    r"\bCFDI\b|\bFACTURA\b|R[EÉ]GIMEN FISCAL|FOLIO FISCAL|\bSERIE\b", re.IGNORECASE
+)
+USD_RE = re.compile(r"\bUSD\b|\bDLLS?\b|D[OÓ]LAR", re.IGNORECASE)
+
+_templates = None
+_templates_lock = threading.Lock()
+
+_tier_lock = threading.Lock()
+_tiers = {tier: {"count": 0, "latency_sum": 0.0} for tier in TIERS}
+
+
+@dataclass
+class OcrText:
+    text: str
+    lines: list
+    confidence: float
+
+
+@functools.lru_cache(maxsize=1)
+def _tesseract_installed() -> bool:
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception:
+        logger.info("Tesseract not found; local OCR tier disabled")
+        return False
+    return True
+
+
+def ocr_enabled() -> bool:
+    if pytesseract is None:
+        return False
+    if str(get_secret("ocr", "enabled", default=True)).lower() in ("0", "false", "no"):
+        return False
+    return _tesseract_installed()
+
+
+def run_ocr(data: bytes, mime_type: str):
+    """OCR an image with Tesseract; returns OcrText or None when unavailable or failing."""
+    if not mime_type.startswith("image/") or not ocr_enabled():
+        return None
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.draft("L", (OCR_MAX_DIMENSION, OCR_MAX_DIMENSION))
+        image = ImageOps.exif_transpose(image).convert("L")
+        words = pytesseract.image_to_data(
+            image,
+            lang=get_secret("ocr", "lang", default="spa"),
+            output_type=pytesseract.Output.DICT,
+            timeout=OCR_TIMEOUT,
+        )
+    except Exception as e:
+        logger.warning(f"OCR failed: {e}")
+        return None
+
+    lines = {}
+    confidences = []
+    for i, word in enumerate(words["text"]):
+        word = word.strip()
+        confidence = float(words["conf"][i])
+        if not word or confidence < 0:
+            continue
+        key = (words["block_num"][i], words["par_num"][i], words["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        confidences.append(confidence)
+
+    lines = [" ".join(line) for line in lines.values()]
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return OcrText("\n".join(lines), lines, confidence)
+
+
+def _amount(value: str) -> float:
+    if "," in value and "." not in value:
+        value = value.replace(",", ".")
+    return float(value.replace(",", ""))
+
+
+def _date(text: str):
+    match = ISO_DATE_RE.search(text)
+    if match:
+        year, month, day = map(int, match.groups())
+    else:
+        match = DATE_RE.search(text)
+        if not match:
+            return None
+        day, month, year = map(int, match.groups())
+        if year < 100:
+            year += 2000
+    try:
+        return datetime(year, month, day).date().isoformat()
+    except ValueError:
+        return None
+
+
+def parse_fields(text: str) -> dict:
+    """Rule-based fields from OCR text; missing fields are None."""
+    totals = TOTAL_RE.findall(text)
+    rfc = RFC_RE.search(text)
+    uuid = UUID_RE.search(text)
+    items = [
+        {"item": match.group("item").strip(), "price": _amount(match.group(2))}
+        for match in ITEM_RE.finditer(text)
+        if not NOT_ITEM_RE.search(match.group("item"))
+    ]
+    return {
+        # The last TOTAL line is the grand total on receipts that print several.
+        "total": _amount(totals[-1]) if totals else None,
+        "date": _date(text),
+        "rfc": "".join(rfc.groups()) if rfc else None,
+        "uuid": uuid.group(0).upper() if uuid else None,
+        "currency": "USD" if USD_RE.search(text) else None,
+        "document_type": "Factura" if uuid or FACTURA_RE.search(text) else "Ticket",
+        "items": items,
+    }
+
+
+def normalize_merchant(name: str) -> str:
+    name = unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode()
+    return " ".join(re.sub(r"[^A-Z0-9]+", " ", name.upper()).split())
+
+
+class MerchantTemplates:
+    """Merchants learned from model-verified extractions, per user and normalized name.
+
+    Each template remembers the category and currency the model assigned
+    and the issuer RFC when one was printed, so later receipts from the same
+    merchant can be recognised from their OCR header alone. A user's scans
+    only ever match the templates their own receipts taught.
+    """
+
+    def __init__(self, path: str = TEMPLATES_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            columns = {row["name"] for row in self._conn.execute(
+                "PRAGMA table_info(merchant_templates)"
+            )}
+            if columns and "user_id" not in columns:
+                # Templates from before they were per user have no owner; they are relearned.
+                self._conn.execute("DROP TABLE merchant_templates")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS merchant_templates (
+                    user_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    merchant TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    currency TEXT NOT NULL,
+                    rfc TEXT,
+                    seen INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (user_id, key)
+                )
+            """)
+        self._by_user = {}
+        for row in self._conn.execute("SELECT * FROM merchant_templates"):
+            self._by_user.setdefault(row["user_id"], {})[row["key"]] = dict(row)
+
+    def match(self, user_id: str, lines: list, rfc: str = None):
+        """The user's template for a receipt header, by issuer RFC or merchant name.
+
+        A name matches as whole words within one of the first HEADER_LINES
+        lines; the longest matching name wins.
+        """
+        with self._lock:
+            templates = self._by_user.get(user_id, {})
+            if rfc:
+                for template in templates.values():
+                    if template["rfc"] == rfc:
+                        return template
+            header = [f" {normalize_merchant(line)} " for line in lines[:HEADER_LINES]]
+            matches = [
+                t for key, t in templates.items()
+                if any(f" {key} " in line for line in header)
+            ]
+        return max(matches, key=lambda t: len(t["key"]), default=None)
+
+    def learn(self, user_id: str, result: dict, fields: dict):
+        key = normalize_merchant(result.get("merchant"))
+        if not user_id or len(key) < MIN_TEMPLATE_KEY:
+            return
+        with self._lock, self._conn:
+            templates = self._by_user.setdefault(user_id, {})
+            previous = templates.get(key)
+            template = {
+                "user_id": user_id,
+                "key": key,
+                "merchant": result["merchant"],
+                "category": result.get("category") or "Other",
+                "currency": result.get("currency") or "MXN",
+                # Facturas also print the customer's RFC, so only tickets teach one.
+                "rfc": (fields.get("document_type") == "Ticket" and fields.get("rfc"))
+                or (previous and previous["rfc"]) or None,
+                "seen": (previous["seen"] if previous else 0) + 1,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }
+            self._conn.execute(
+                "INSERT OR REPLACE INTO merchant_templates "
+                "(user_id, key, merchant, category, currency, rfc, seen, updated_at) "
+                "VALUES (:user_id, :key, :merchant, :category, :currency, :rfc, :seen, "
+                ":updated_at)",
+                template,
+            )
+            templates[key] = template
+
+
+def get_templates() -> MerchantTemplates:
+    global _templates
+    with _templates_lock:
+        if _templates is None:
+            _templates = MerchantTemplates()
+        return _templates
+
+
+def _record_tier(tier: str, latency: float):
+    with _tier_lock:
+        _tiers[tier]["count"] += 1
+        _tiers[tier]["latency_sum"] += latency
+
+
+def get_tier_stats() -> dict:
+    """Scans served per tier in this process, with share and average latency."""
+    with _tier_lock:
+        total = sum(t["count"] for t in _tiers.values())
+        return {
+            "total": total,
+            "tiers": {
+                tier: {
+                    "count": t["count"],
+                    "share": t["count"] / total if total else 0.0,
+                    "avg_latency": t["latency_sum"] / t["count"] if t["count"] else None,
+                }
+                for tier, t in _tiers.items()
+            },
+        }
+
+
+def _local_result(template: dict, fields: dict) -> dict:
+    currency = fields["currency"] or template["currency"]
+    document_type = fields["document_type"]
+    return {
+        "merchant": template["merchant"],
+        "total": fields["total"],
+        "currency": currency,
+        "category": template["category"],
+        "narrative_summary": (
+            f"{document_type} de {template['merchant']} por ${fields['total']:,.2f} {currency}."
+        ),
+        "document_type": document_type,
+        "items": fields["items"],
+        "date": fields["date"],
+    }
+
+
+def read_text(data: bytes, mime_type: str):
+    """OCR for images; the text layer for PDFs and the raw text of XML files."""
+    if mime_type == PDF_MIME_TYPE:
+        text = pdf_text(data)
+    elif is_xml(mime_type):
+        text = data.decode("utf-8", errors="ignore")
+    else:
+        return run_ocr(data, mime_type)
+    if text is None:
+        return None
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return OcrText("\n".join(lines), lines, 100.0)
+
+
+def extract_locally(data: bytes, mime_type: str, companion: bytes = None, user_id: str = None):
+    """Try the tiers that need no model; returns ``(result or None, tier, text, fields)``.
+
+    Merchant templates are only consulted for a known ``user_id``.
+    """
+    result = extract_cfdi(data, mime_type, companion)
+    if result is not None:
+        return result, "cfdi", None, None
+
+    text = read_text(data, mime_type)
+    if text is None:
+        return None, None, None, None
+
+    fields = parse_fields(text.text)
+    template = get_templates().match(user_id, text.lines, fields["rfc"]) if user_id else None
+    if (
+        template is not None
+        and template["seen"] >= MIN_TEMPLATE_SEEN
+        and fields["total"] is not None
+        and text.confidence >= LOCAL_MIN_CONFIDENCE
+    ):
+        return _local_result(template, fields), "local", text, fields
+    return None, None, text, fields
+
+
+def extract_receipt(data: bytes, mime_type: str, companion: bytes = None,
+                    user_id: str = None, name: str = None):
+    """Cheapest tier that can answer: CFDI XML, local rules, text to the model, then the file.
+
+    ``companion`` is a CFDI XML uploaded next to a PDF. The text tier is
+    only trusted when the model's total agrees with the TOTAL line found in
+    the text; otherwise the file is sent as before. Every model answer
+    teaches ``user_id``'s merchant templates.
+    """
+    started = time.perf_counter()
+    result, tier, text, fields = extract_locally(data, mime_type, companion, user_id)
+    if result is not None:
+        _record_tier(tier, time.perf_counter() - started)
+        return result
+
+    # Non-CFDI XML has no file form the model accepts, so its text is all we can send.
+    if is_xml(mime_type):
+        result = analyze_receipt_text(text.text, name=name)
+        if result:
+            _record_tier("text", time.perf_counter() - started)
+        return result
+
+    if (
+        text is not None
+        and text.confidence >= TEXT_MIN_CONFIDENCE
+        and len(text.text) >= MIN_TEXT_CHARS
+        and fields["total"] is not None
+    ):
+        result = analyze_receipt_text(text.text, name=name)
+        if result and abs(result["total"] - fields["total"]) < 0.01:
+            _record_tier("text", time.perf_counter() - started)
+            get_templates().learn(user_id, result, fields)
+            return result
+
+    result = analyze_receipt(data, mime_type=mime_type, name=name)
+    if result:
+        _record_tier("image", time.perf_counter() - started)
+        if fields is not None:
+            get_templates().learn(user_id, result, fields)
+    return result
+
+
+def extract_receipts(documents: list, companions: dict = None, user_id: str = None,
+                     names: list = None) -> list:
+    """Batched counterpart of ``extract_receipt`` for ``(bytes, mime_type)`` documents.
+
+    ``companions`` maps a document's position to its CFDI XML. Documents
+    no local tier can answer go to ``analyze_receipts`` as files; the
+    per-document text tier is skipped since batching already amortises the
+    prompt. ``names`` are the documents' file names, for the log.
+    """
+    companions = companions or {}
+    results = [None] * len(documents)
+    pending = []
+    for i, (data, mime_type) in enumerate(documents):
+        started = time.perf_counter()
+        result, tier, _, fields = extract_locally(data, mime_type, companions.get(i), user_id)
+        if result is not None:
+            _record_tier(tier, time.perf_counter() - started)
+            results[i] = result
+        elif is_xml(mime_type):
+            results[i] = extract_receipt(
+                data, mime_type, user_id=user_id, name=names[i] if names else None
+            )
+        else:
+            pending.append((i, fields))
+
+    if pending:
+        started = time.perf_counter()
+        extracted = analyze_receipts(
+            [documents[i] for i, _ in pending],
+            names=[names[i] for i, _ in pending] if names else None,
+        )
+        latency = time.perf_counter() - started
+        for (i, fields), result in zip(pending, extracted):
+            results[i] = result
+            if result:
+                _record_tier("image", latency)
+                if fields is not None:
+                    get_templates().learn(user_id, result, fields)
+    return results
@@ -0,0 +1,138 @@
+from collections import Counter
+import re
+
+from modules.line_items import normalize_item
+
+
+# Legal entity forms and everything printed after them:
+# "oxxo s a de c v" -> "oxxo", "cadena comercial sa de cv sucursal 5" -> "cadena comercial".
+LEGAL_FORM_RE = re.compile(
+    r" (?:s ?a ?p ?i|s ?a ?b|s ?a|s ?c|s ?de ?r ?l(?: ?mi)?|s ?en ?c|a ?c)"
+    r"(?: ?de ?c ?v)?(?: .*)?$"
+)
+# Branch markers after the name: "oxxo tienda 123", "farmacia guadalajara suc centro".
+BRANCH_RE = re.compile(r" (?:suc|sucursal|tienda|unidad|store|no|num|numero)(?: .*)?$")
+# Trailing store codes: "walmart 2345", "7 eleven t104".
+STORE_CODE_RE = re.compile(r"(?: [a-z]*\d[a-z\d]*)+$")
+RFC_RE = re.compile(r"^[A-ZÑ&]{3,4}\d{6}[A-Z\d]{3}$")
+
+# Dice coefficient over character trigrams above which two keys are one merchant.
+MATCH_THRESHOLD = 0.8
+MIN_KEY_LENGTH = 3
+
+
+def merchant_key(name: str) -> str:
+    """Accent-free lowercase name without legal form, branch or store code."""
+    key = normalize_item(name)
+    stripped = STORE_CODE_RE.sub("", BRANCH_RE.sub("", LEGAL_FORM_RE.sub("", key)))
+    return stripped if len(stripped) >= MIN_KEY_LENGTH else key
+
+
+def display_name(name: str, key: str) -> str:
+    """The leading words of ``name`` that make up ``key``, keeping their accents and case."""
+    words = (name or "").split()
+    for n in range(1, len(words) + 1):
+        if normalize_item(" ".join(words[:n])) == key:
+            return " ".join(words[:n]).rstrip(",.;:-")
+    return key.title()
+
+
+def factura_rfc(data: dict):
+    """Issuer RFC of a Factura, the merchant's fiscal identity; None otherwise."""
+    if data.get("document_type") != "Factura":
+        return None
+    rfc = re.sub(r"[\s-]", "", str(data.get("rfc") or "")).upper()
+    return rfc if RFC_RE.match(rfc) else None
+
+
+def _trigrams(key: str) -> set:
+    # Spaces dropped so "wal mart" and "walmart" agree; "$" marks both ends.
+    padded = f"${key.replace(' ', '')}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MerchantIndex:
+    """A user's canonical merchants, looked up by RFC, exact key or trigram similarity.
+
+    ``merchants`` are ``{"name", "rfc"}`` rows of the merchants table. An
+    inverted index from trigram to merchant keeps fuzzy lookups to the
+    merchants that share trigrams with the name instead of every merchant.
+    """
+
+    def __init__(self, merchants=(), threshold: float = MATCH_THRESHOLD):
+        self._threshold = threshold
+        self._entries = []
+        self._by_key = {}
+        self._by_rfc = {}
+        self._postings = {}
+        for merchant in merchants:
+            key = merchant_key(merchant["name"])
+            previous = self._by_key.get(key)
+            # A stale spelling (saved before canonicalization) gives way to
+            # the clean name with the same key.
+            if previous is not None and normalize_item(previous["name"]) == key:
+                continue
+            self._add(merchant["name"], key, merchant.get("rfc"), replace=previous)
+
+    def _add(self, name: str, key: str, rfc: str = None, replace: dict = None) -> dict:
+        if replace is not None:
+            replace.update(name=name, rfc=replace["rfc"] or rfc)
+            entry = replace
+        else:
+            entry = {"name": name, "key": key, "rfc": rfc, "trigrams": _trigrams(key)}
+            for trigram in entry["trigrams"]:
+                self._postings.setdefault(trigram, []).append(len(self._entries))
+            self._entries.append(entry)
+            self._by_key[key] = entry
+        if entry["rfc"]:
+            self._by_rfc.setdefault(entry["rfc"], entry)
+        return entry
+
+    def similar(self, key: str):
+        """The merchant whose key is most similar to ``key``, if above the threshold."""
+        trigrams = _trigrams(key)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self._postings.get(trigram, ()))
+        best, score = None, 0.0
+        for position, count in shared.items():
+            entry = self._entries[position]
+            dice = 2 * count / (len(trigrams) + len(entry["trigrams"]))
+            if dice > score:
+                best, score = entry, dice
+        return best if score >= self._threshold else None
+
+    def resolve(self, name: str, rfc: str = None) -> str:
+        """Canonical name for ``name``; unknown merchants are added under a cleaned name."""
+        key = merchant_key(name)
+        if not key:
+            return name
+        entry = self._by_rfc.get(rfc) if rfc else None
+        entry = entry or self._by_key.get(key) or self.similar(key)
+        if entry is None:
+            entry = self._add(display_name(name, key), key, rfc)
+        elif rfc and not entry["rfc"]:
+            entry["rfc"] = rfc
+            self._by_rfc[rfc] = entry
+        return entry["name"]
+
+
+def canonicalize(receipts: list, merchants) -> list:
+    """Copies of ``receipts`` under their canonical merchant names.
+
+    ``merchants`` is the user's dictionary (``{"name", "rfc"}`` rows); the
+    extracted name is kept in ``merchant_raw`` and a Factura's issuer RFC in
+    ``rfc``. Receipts of one batch also match each other.
+    """
+    index = MerchantIndex(merchants)
+    canonical = []
+    for data in receipts:
+        raw = data.get("merchant_raw") or data.get("merchant")
+        rfc = factura_rfc(data)
+        canonical.append({
+            **data,
+            "merchant": index.resolve(raw, rfc) if raw else raw,
+            "merchant_raw": raw,
+            "rfc": rfc,
+        })
+    return canonical
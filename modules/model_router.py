@@ -0,0 +1,199 @@
+from google.genai import errors
+import threading
+import logging
+import random
+import bisect
+import time
+
+import httpx
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 60)
+
+
+class AllModelsFailed(Exception):
+    pass
+
+
+def _classify(exc: Exception) -> str:
+    """'throttled' or 'retry' (back off), 'missing' or 'skip' (next model), or 'fatal'."""
+    if isinstance(exc, errors.APIError):
+        if exc.code == 429:
+            return "throttled"
+        if exc.code == 404:
+            return "missing"
+        if exc.code >= 500:
+            return "retry"
+        return "fatal"
+    if isinstance(exc, (httpx.TimeoutException, httpx.TransportError, TimeoutError)):
+        return "retry"
+    return "skip"
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures; allows one trial after ``cooldown``.
+
+    While the trial is in flight other callers are refused as if the circuit
+    were still open. A trial that never reports back (its caller ran out of
+    deadline) is given up after another ``cooldown``.
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: float = 60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state != "half_open":
+            return state == "closed"
+        now = time.monotonic()
+        if self.trial_started is not None and now - self.trial_started < self.cooldown:
+            return False
+        self.trial_started = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+
+    def record_failure(self, trip: bool = False):
+        self.failures += 1
+        if trip or self.failures >= self.threshold or self.state == "half_open":
+            self.opened_at = time.monotonic()
+            self.trial_started = None
+
+    def release(self):
+        """End a trial whose outcome said nothing about the model's health."""
+        self.trial_started = None
+
+
+class ModelRouter:
+    """Calls an ordered list of models with backoff, deadlines and circuit breakers.
+
+    ``call(fn)`` invokes ``fn(model, timeout)`` on the first model whose
+    breaker is closed, retrying throttles and transient errors with
+    exponential backoff plus full jitter, and moving on to the next model
+    when one keeps failing. Latency histograms and outcome counters are kept
+    per model.
+    """
+
+    def __init__(self, models: list, attempts_per_model: int = 3, base_delay: float = 1.0,
+                 max_delay: float = 16.0, deadline: float = 90.0, attempt_timeout: float = 30.0,
+                 breaker_threshold: int = 3, breaker_cooldown: float = 60.0):
+        self.models = list(models)
+        self.attempts_per_model = attempts_per_model
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self._lock = threading.Lock()
+        self._breakers = {
+            m: CircuitBreaker(breaker_threshold, breaker_cooldown) for m in self.models
+        }
+        self._stats = {
+            m: {
+                "calls": 0,
+                "successes": 0,
+                "failures": 0,
+                "throttled": 0,
+                "latency_sum": 0.0,
+                "latency_buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+            }
+            for m in self.models
+        }
+
+    def call(self, fn, deadline: float = None, attempt_timeout: float = None):
+        """Return ``(model, fn(model, timeout))`` from the first model that succeeds."""
+        expires = time.monotonic() + (deadline or self.deadline)
+        attempt_timeout = attempt_timeout or self.attempt_timeout
+        last_error = None
+
+        for model in self.models:
+            with self._lock:
+                allowed = self._breakers[model].allow()
+            if not allowed:
+                logger.info(f"Skipping {model}: circuit open")
+                continue
+
+            for attempt in range(self.attempts_per_model):
+                remaining = expires - time.monotonic()
+                if remaining <= 0:
+                    raise AllModelsFailed(f"Deadline exceeded: {last_error}")
+
+                started = time.monotonic()
+                try:
+                    result = fn(model, min(remaining, attempt_timeout))
+                except Exception as e:
+                    kind = _classify(e)
+                    self._record(model, time.monotonic() - started, kind)
+                    last_error = e
+                    if kind == "fatal":
+                        raise
+                    if kind in ("missing", "skip"):
+                        break
+                    with self._lock:
+                        if self._breakers[model].state != "closed":
+                            break
+
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                    if attempt + 1 < self.attempts_per_model:
+                        if time.monotonic() + delay >= expires:
+                            break
+                        logger.warning(f"{model} {kind} ({e}); retrying in {delay:.1f}s")
+                        time.sleep(delay)
+                    continue
+
+                self._record(model, time.monotonic() - started, "success")
+                return model, result
+
+        raise AllModelsFailed(f"All models failed: {last_error}")
+
+    def _record(self, model: str, latency: float, outcome: str):
+        with self._lock:
+            stats = self._stats[model]
+            stats["calls"] += 1
+            stats["latency_sum"] += latency
+            stats["latency_buckets"][bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+            breaker = self._breakers[model]
+            if outcome == "success":
+                stats["successes"] += 1
+                breaker.record_success()
+            else:
+                stats["failures"] += 1
+                if outcome == "throttled":
+                    stats["throttled"] += 1
+                # Bad output or a rejected request says nothing about model health.
+                if outcome in ("throttled", "retry", "missing"):
+                    breaker.record_failure(trip=outcome == "missing")
+                else:
+                    breaker.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                model: {
+                    **{k: v for k, v in s.items() if k != "latency_buckets"},
+                    "latency_buckets": dict(
+                        zip([f"<={b}s" for b in LATENCY_BUCKETS] + ["inf"], s["latency_buckets"])
+                    ),
+                    "success_rate": s["successes"] / s["calls"] if s["calls"] else None,
+                    "avg_latency": s["latency_sum"] / s["calls"] if s["calls"] else None,
+                    "circuit": self._breakers[model].state,
+                }
+                for model, s in self._stats.items()
+            }
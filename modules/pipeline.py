@@ -0,0 +1,196 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from dataclasses import dataclass, field
+import logging
+
+from modules.cfdi import pair_companions
+from modules.local_extraction import extract_receipt, extract_receipts
+from modules.extraction_cache import content_hash
+from modules.image_processing import (
+    preprocess_image, extension_for, make_thumbnail, MAX_DIMENSION,
+)
+from modules.supabase_client import upload_file, upload_thumbnail
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+
+
+@dataclass
+class ScanResult:
+    name: str
+    data: dict = field(default=None)
+    error: str = None
+    index: int = None
+    # Set on a CFDI XML consumed by the PDF at this index; it has no row of its own.
+    attached_to: int = None
+
+
+def prepare_file(name: str, file_bytes: bytes, mime_type: str,
+                 max_dimension: int = MAX_DIMENSION):
+    """Preprocess an upload; returns ``(name, bytes, mime_type)`` to upload and analyze."""
+    data, new_mime = preprocess_image(file_bytes, mime_type, max_dimension=max_dimension)
+    if new_mime != mime_type:
+        name = f"{name.rsplit('.', 1)[0]}.{extension_for(new_mime)}"
+    return name, data, new_mime
+
+
+class _ScanFailed(Exception):
+    pass
+
+
+def _prepare_one(client, user_id: str, name: str, file_bytes: bytes, mime_type: str,
+                 max_dimension: int, keep_original: bool):
+    """Preprocess and upload; returns ``(bytes, mime_type, fields)`` ready for analysis."""
+    try:
+        upload_name, data, upload_mime = prepare_file(
+            name, file_bytes, mime_type, max_dimension
+        )
+    except Exception as e:
+        raise _ScanFailed(f"Preprocessing failed: {e}") from e
+
+    file_url = None
+    original_url = None
+    if client is not None:
+        try:
+            file_url = upload_file(data, upload_name, upload_mime, user_id, client=client)
+            if keep_original and data is not file_bytes:
+                original_url = upload_file(file_bytes, name, mime_type, user_id, client=client)
+        except Exception as e:
+            raise _ScanFailed(f"Upload failed: {e}") from e
+
+    thumbnail_url = None
+    if file_url is not None:
+        thumbnail = make_thumbnail(data, upload_mime)
+        if thumbnail is not None:
+            try:
+                thumbnail_url = upload_thumbnail(thumbnail, file_url, user_id, client=client)
+            except Exception as e:
+                # History falls back to the text-only card without a preview.
+                logger.warning(f"Thumbnail upload failed for {name}: {e}")
+
+    fields = {
+        "file_url": file_url,
+        "original_url": original_url,
+        "thumbnail_url": thumbnail_url,
+        "content_hash": content_hash(file_bytes),
+    }
+    return data, upload_mime, fields
+
+
+def _scan_one(client, user_id: str, name: str, file_bytes: bytes, mime_type: str,
+              max_dimension: int, keep_original: bool, companion: bytes = None) -> ScanResult:
+    try:
+        data, upload_mime, fields = _prepare_one(
+            client, user_id, name, file_bytes, mime_type, max_dimension, keep_original
+        )
+    except _ScanFailed as e:
+        return ScanResult(name, error=str(e))
+
+    try:
+        result = extract_receipt(data, upload_mime, companion, user_id, name)
+    except Exception as e:
+        return ScanResult(name, error=f"Analysis failed: {e}")
+    if not result:
+        return ScanResult(name, error="Analysis failed")
+
+    result.update(fields)
+    return ScanResult(name, data=result)
+
+
+def _scan_batch(user_id: str, prepared: list) -> list:
+    """Analyze ``(index, name, bytes, mime_type, fields, companion)`` items together."""
+    try:
+        extracted = extract_receipts(
+            [(data, mime) for _, _, data, mime, _, _ in prepared],
+            {n: item[5] for n, item in enumerate(prepared) if item[5] is not None},
+            user_id,
+            [name for _, name, *_ in prepared],
+        )
+    except Exception as e:
+        return [
+            ScanResult(name, error=f"Analysis failed: {e}", index=index)
+            for index, name, *_ in prepared
+        ]
+
+    results = []
+    for (index, name, _, _, fields, _), result in zip(prepared, extracted):
+        if not result:
+            results.append(ScanResult(name, error="Analysis failed", index=index))
+            continue
+        result.update(fields)
+        results.append(ScanResult(name, data=result, index=index))
+    return results
+
+
+def scan_files(files, client, user_id: str = None, max_workers: int = DEFAULT_CONCURRENCY,
+               max_dimension: int = MAX_DIMENSION, keep_original: bool = False,
+               inference_batch: int = 1):
+    """Preprocess, upload and analyze ``(name, bytes, mime_type)`` files concurrently.
+
+    Yields a ScanResult per file as soon as it finishes (``index`` is the
+    file's position in ``files``); a failing file never aborts the rest of
+    the batch. ``client`` is resolved by the caller because worker threads
+    have no Streamlit session; with ``client=None`` nothing is uploaded.
+    ``user_id`` owns the files: they are uploaded to their folder and only
+    their merchant templates are used.
+    With ``inference_batch > 1`` prepared files are grouped and sent to the
+    model several per request (see ``extract_receipts``). A CFDI XML named
+    like a PDF in the same batch is read together with it and yielded with
+    ``attached_to`` set instead of becoming a receipt of its own.
+    """
+    files = list(files)
+    companions = pair_companions(files)
+    attached = {xml: pdf for pdf, xml in companions.items()}
+    todo = [
+        (index, name, file_bytes, mime_type,
+         files[companions[index]][1] if index in companions else None)
+        for index, (name, file_bytes, mime_type) in enumerate(files)
+        if index not in attached
+    ]
+    for xml, pdf in attached.items():
+        yield ScanResult(files[xml][0], index=xml, attached_to=pdf)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        if inference_batch <= 1:
+            futures = {
+                pool.submit(
+                    _scan_one, client, user_id, name, file_bytes, mime_type, max_dimension,
+                    keep_original, companion,
+                ): index
+                for index, name, file_bytes, mime_type, companion in todo
+            }
+            for future in as_completed(futures):
+                result = future.result()
+                result.index = futures[future]
+                yield result
+            return
+
+        preparing = {
+            pool.submit(
+                _prepare_one, client, user_id, name, file_bytes, mime_type, max_dimension,
+                keep_original,
+            ): (index, name, companion)
+            for index, name, file_bytes, mime_type, companion in todo
+        }
+        analyzing = set()
+        ready = []
+        while preparing or analyzing:
+            done, _ = wait([*preparing, *analyzing], return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in analyzing:
+                    analyzing.discard(future)
+                    yield from future.result()
+                    continue
+
+                index, name, companion = preparing.pop(future)
+                try:
+                    data, mime_type, fields = future.result()
+                except _ScanFailed as e:
+                    yield ScanResult(name, error=str(e), index=index)
+                    continue
+                ready.append((index, name, data, mime_type, fields, companion))
+
+            while len(ready) >= inference_batch or (ready and not preparing):
+                analyzing.add(pool.submit(_scan_batch, user_id, ready[:inference_batch]))
+                ready = ready[inference_batch:]
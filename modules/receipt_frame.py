@@ -0,0 +1,136 @@
+import pandas as pd
+import json
+
+from modules.supabase_client import results, MISS
+from modules.storage import get_user_receipts, get_fx_rates
+from modules.fx import RateTable
+
+
+FRAME_PAGE_SIZE = 1000
+FRAME_COLUMNS = (
+    "id, created_at, date, merchant, total, currency, category, summary, file_url, file_type"
+)
+CATEGORICAL_COLUMNS = ("merchant", "category", "currency", "file_type")
+
+
+def build_receipt_frame(rows: list) -> pd.DataFrame:
+    """Receipt rows as a compact frame indexed by ``created_at`` (UTC, ascending).
+
+    Repeated labels become categoricals and ``total`` a float, once, so
+    consumers filter and group without coercing their own copies.
+    """
+    df = pd.DataFrame.from_records(rows)
+    if df.empty:
+        return pd.DataFrame(index=pd.DatetimeIndex([], tz="UTC", name="created_at"))
+
+    for column in CATEGORICAL_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("category")
+    if "total" in df:
+        df["total"] = pd.to_numeric(df["total"], errors="coerce").fillna(0.0).astype("float64")
+
+    df.index = pd.DatetimeIndex(
+        pd.to_datetime(df.pop("created_at"), utc=True, format="ISO8601"), name="created_at"
+    )
+    return df.sort_index(kind="stable")
+
+
+def frame_size(frame: pd.DataFrame) -> int:
+    return int(frame.memory_usage(deep=True, index=True).sum())
+
+
+def get_receipt_frame(user_id: str, columns: str = FRAME_COLUMNS, client=None) -> pd.DataFrame:
+    """All of a user's receipts as one memoized frame of ``columns``.
+
+    ``items`` is only fetched when listed in ``columns``. The frame is
+    cached with the other per-user results and dropped on save or delete;
+    callers must treat it as read-only.
+    """
+    key = results.key("frame", columns=columns)
+    cached = results.get(user_id, key)
+    if cached is not MISS:
+        return cached
+
+    # Keyset pagination needs both sort keys in every page.
+    wanted = [c.strip() for c in columns.split(",")]
+    select = ", ".join(dict.fromkeys(["id", "created_at", *wanted]))
+
+    rows = []
+    cursor = None
+    while True:
+        page = get_user_receipts(
+            user_id, columns=select, limit=FRAME_PAGE_SIZE, cursor=cursor, client=client
+        )
+        rows.extend(page)
+        if len(page) < FRAME_PAGE_SIZE:
+            break
+        cursor = (page[-1]["created_at"], page[-1]["id"])
+
+    frame = build_receipt_frame(rows)
+    results.put(user_id, key, frame, size=frame_size(frame))
+    return frame
+
+
+def filter_frame(frame: pd.DataFrame, merchants: list = None, start: str = None,
+                 end: str = None) -> pd.DataFrame:
+    """Apply the HISTORY filters: ``start`` inclusive, ``end`` exclusive."""
+    if start or end:
+        lo = frame.index.searchsorted(pd.Timestamp(start, tz="UTC")) if start else 0
+        hi = frame.index.searchsorted(pd.Timestamp(end, tz="UTC")) if end else len(frame)
+        frame = frame.iloc[lo:hi]
+    if merchants:
+        frame = frame[frame["merchant"].isin(merchants)]
+    return frame
+
+
+def get_rate_table(user_id: str, client=None) -> RateTable:
+    """The FX rates of the user's store, cached with their other results."""
+    key = results.key("fx")
+    cached = results.get(user_id, key)
+    if cached is not MISS:
+        return cached
+
+    rows = get_fx_rates(user_id, client=client)
+    table = RateTable((row["currency"], row["date"], row["rate"]) for row in rows)
+    results.put(user_id, key, table, size=64 * len(rows))
+    return table
+
+
+def convert_totals(frame: pd.DataFrame, currency: str, rates: RateTable) -> pd.Series:
+    """``total`` in ``currency`` at the rate of each receipt's date; NaN without one.
+
+    The receipt date falls back to the UTC day it was saved.
+    """
+    days = pd.Series(frame.index.strftime("%Y-%m-%d"), index=frame.index)
+    if "date" in frame:
+        days = frame["date"].astype(object).where(frame["date"].notna(), days)
+    converted = rates.convert(frame["total"], frame["currency"], days, currency)
+    return pd.Series(converted, index=frame.index, name=f"total_{currency.lower()}")
+
+
+def build_export(user_id: str, filters: dict, columns: str = FRAME_COLUMNS,
+                 currency: str = None, client=None) -> bytes:
+    """The HISTORY export: every receipt matching the merchant and date ``filters``.
+
+    A search ``query`` among the filters is not applied; the export covers
+    the filtered history, not one page of ranked search results.
+    """
+    filters = {name: value for name, value in filters.items() if name != "query"}
+    frame = get_receipt_frame(user_id, columns=columns, client=client)
+    rates = get_rate_table(user_id, client=client) if currency else None
+    return export_csv(filter_frame(frame, **filters), currency=currency, rates=rates)
+
+
+def export_csv(frame: pd.DataFrame, currency: str = None, rates: RateTable = None) -> bytes:
+    """CSV export, newest first, with ``items`` (when loaded) as JSON.
+
+    With ``currency`` and ``rates``, a ``total_<currency>`` column holds the
+    converted totals.
+    """
+    out = frame.iloc[::-1]
+    if currency and rates and "total" in out:
+        converted = convert_totals(out, currency, rates)
+        out = out.assign(**{converted.name: converted})
+    if "items" in out:
+        out = out.assign(items=out["items"].map(lambda items: json.dumps(items, ensure_ascii=False)))
+    return out.to_csv().encode("utf-8")
@@ -0,0 +1,39 @@
+from modules.line_items import normalize_item
+
+
+# Consonants before which a Spanish plural is "-es" (pañal -> pañales).
+PLURAL_ES = "lrndj"
+
+
+def stem(word: str) -> str:
+    """Fold plural and gender endings of an accent-free Spanish word.
+
+    A light stemmer: "farmacias", "farmacia" -> "farmaci"; "pañales" ->
+    "panal". Supabase stems with the Snowball Spanish stemmer instead; each
+    store only compares its index against queries stemmed the same way.
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("es") and len(word) > 4 and word[-3] in PLURAL_ES:
+        word = word[:-2]
+    elif word.endswith("s"):
+        word = word[:-1]
+    if len(word) > 4 and word[-1] in "aoe":
+        word = word[:-1]
+    return word
+
+
+def search_text(text) -> str:
+    """The words of ``text`` as the local full-text index stores them."""
+    return " ".join(stem(word) for word in normalize_item(text).split())
+
+
+def match_query(query: str) -> str:
+    """FTS5 MATCH expression: every word required, the last one also as a prefix.
+
+    Empty when ``query`` has nothing to search for.
+    """
+    words = search_text(query).split()
+    if not words:
+        return ""
+    return " ".join(f'"{word}"' for word in words) + "*"
@@ -0,0 +1,187 @@
+import threading
+import logging
+
+from modules import local_db
+from modules import supabase_client as remote
+from modules.config import get_secret
+from modules.supabase_client import results, HISTORY_PAGE_SIZE, HISTORY_COLUMNS
+from modules.sync import SyncEngine
+
+
+logger = logging.getLogger(__name__)
+
+_store = None
+_sync = None
+_init_lock = threading.Lock()
+
+
+class LocalStore:
+    """The local receipts replica (receipts.db) shared by every session of the process."""
+
+    def __init__(self, path: str = local_db.DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = local_db.connect(path)
+
+    def call(self, fn, *args, **kwargs):
+        """Run a ``local_db`` function on the shared connection."""
+        with self._lock:
+            return fn(self._conn, *args, **kwargs)
+
+    def changed(self, user_id: str):
+        # Results derived from the rows (the export frame) are cached per user.
+        results.invalidate(user_id)
+
+
+def local_first() -> bool:
+    """Read from and write to receipts.db, syncing with Supabase in the background.
+
+    On unless the ``storage.local_first`` secret turns it off, in which case
+    every call goes straight to Supabase as before.
+    """
+    value = get_secret("storage", "local_first", default=True)
+    return str(value).lower() not in ("0", "false", "no")
+
+
+def get_store() -> LocalStore:
+    global _store
+    with _init_lock:
+        if _store is None:
+            _store = LocalStore()
+        return _store
+
+
+def get_sync_engine() -> SyncEngine:
+    global _sync
+    store = get_store()
+    with _init_lock:
+        if _sync is None:
+            _sync = SyncEngine(store)
+        return _sync
+
+
+def start_sync(user: dict) -> bool:
+    """Keep ``user`` in sync in the background.
+
+    Returns True when this machine has none of their receipts yet: the
+    first full pull is then running in the background too.
+    """
+    if not local_first():
+        return False
+    first = get_store().call(local_db.get_sync_state, user["id"])["pulled_until"] is None
+    get_sync_engine().register(user)
+    return first
+
+
+def stop_sync(user_id: str):
+    if _sync is not None:
+        _sync.unregister(user_id)
+
+
+def get_sync_status(user_id: str):
+    """``{synced_at, error, pending, pulled_until}`` for the user, or None without a replica."""
+    if not local_first():
+        return None
+    return get_sync_engine().status(user_id)
+
+
+def save_receipts(receipts: list, user_id: str, client=None):
+    if not local_first():
+        return remote.save_receipts(receipts, user_id, client=client)
+    get_store().call(local_db.save_receipts, receipts, user_id, pending=True)
+    get_store().changed(user_id)
+    get_sync_engine().wake()
+
+
+def delete_receipt(receipt_id: str, user_id: str):
+    if not local_first():
+        return remote.delete_receipt(receipt_id, user_id)
+    get_store().call(local_db.delete_receipt, receipt_id, user_id)
+    get_store().changed(user_id)
+    get_sync_engine().wake()
+
+
+def get_user_receipts(user_id: str, columns: str = "*", limit: int = None, cursor: tuple = None,
+                      merchants: list = None, start: str = None, end: str = None, client=None):
+    if not local_first():
+        return remote.get_user_receipts(
+            user_id, columns=columns, limit=limit, cursor=cursor, merchants=merchants,
+            start=start, end=end, client=client,
+        )
+    return get_store().call(
+        local_db.get_user_receipts, user_id, columns=columns, limit=limit, cursor=cursor,
+        merchants=merchants, start=start, end=end,
+    )
+
+
+def get_receipts_page(user_id: str, cursor: tuple = None, page_size: int = HISTORY_PAGE_SIZE,
+                      merchants: list = None, start: str = None, end: str = None):
+    """One HISTORY page and the cursor of the next one (None on the last page)."""
+    if not local_first():
+        return remote.get_receipts_page(
+            user_id, cursor=cursor, page_size=page_size, merchants=merchants, start=start, end=end
+        )
+    rows = get_user_receipts(
+        user_id, columns=HISTORY_COLUMNS, limit=page_size + 1, cursor=cursor,
+        merchants=merchants, start=start, end=end,
+    )
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, (rows[-1]["created_at"], rows[-1]["id"])
+
+
+def search_receipts(user_id: str, query: str, offset: int = 0,
+                    page_size: int = HISTORY_PAGE_SIZE, merchants: list = None,
+                    start: str = None, end: str = None):
+    """One page of search results and the offset of the next one (None on the last page)."""
+    if not local_first():
+        return remote.search_receipts(
+            user_id, query, offset=offset, page_size=page_size, merchants=merchants,
+            start=start, end=end,
+        )
+    rows = get_store().call(
+        local_db.search_receipts, user_id, query, columns=HISTORY_COLUMNS,
+        limit=page_size + 1, offset=offset, merchants=merchants, start=start, end=end,
+    )
+    if len(rows) <= page_size:
+        return rows, None
+    return rows[:page_size], offset + page_size
+
+
+def find_saved_hashes(user_id: str, hashes: list, client=None) -> dict:
+    if not local_first():
+        return remote.find_saved_hashes(user_id, hashes, client=client)
+    return get_store().call(local_db.find_saved_hashes, user_id, hashes)
+
+
+def get_filter_options(user_id: str) -> dict:
+    if not local_first():
+        return remote.get_filter_options(user_id)
+    return get_store().call(local_db.get_filter_options, user_id)
+
+
+def get_receipt_stats(user_id: str, top_merchants: int = 10, currency: str = None) -> dict:
+    if not local_first():
+        return remote.get_receipt_stats(user_id, top_merchants, currency=currency)
+    return get_store().call(
+        local_db.get_receipt_stats, top_merchants, user_id=user_id, currency=currency
+    )
+
+
+def get_fx_rates(user_id: str, client=None) -> list:
+    """The user's FX rates, from receipts.db or straight from Supabase."""
+    if not local_first():
+        return remote.get_fx_rates(user_id, client=client)
+    return get_store().call(local_db.get_fx_rates, user_id)
+
+
+def get_item_stats(user_id: str, top_items: int = 10) -> dict:
+    if not local_first():
+        return remote.get_item_stats(user_id, top_items)
+    return get_store().call(local_db.get_item_stats, top_items, user_id=user_id)
+
+
+def get_item_price_history(user_id: str, query: str) -> list:
+    if not local_first():
+        return remote.get_item_price_history(user_id, query)
+    return get_store().call(local_db.get_item_price_history, query, user_id=user_id)
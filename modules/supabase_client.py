@@ -1,83 +1,693 @@
-import streamlit as st
-from supabase import create_client, Client
-import uuid
-
-
-def get_client() -> Client:
-    url = st.secrets["supabase"]["url"]
-    key = st.secrets["supabase"]["key"]
-    client = create_client(url, key)
-
-    user = st.session_state.get("user")
-    if user and user.get("access_token") and user.get("refresh_token"):
-        client.auth.set_session(user["access_token"], user["refresh_token"])
-        client.postgrest.auth(user["access_token"])
-        client.storage._client.headers.update(
-            {"Authorization": f"Bearer {user['access_token']}"}
-        )
+from supabase import create_client, Client, ClientOptions
+from collections import OrderedDict
+import threading
+import sys
+import weakref
+import base64
+import json
+import time
+
+import httpx
+
+from modules.cache import ResultCache, MISS
+from modules.config import get_secret
+from modules.extraction_cache import content_hash
+from modules.merchants import canonicalize
+
+
+MAX_CACHED_SESSIONS = 256
+TOKEN_REFRESH_MARGIN = 60
+
+HISTORY_PAGE_SIZE = 20
+HISTORY_COLUMNS = (
+    "id, created_at, merchant, total, currency, category, summary, file_url, thumbnail_url, "
+    "file_type"
+)
+INSERT_BATCH_SIZE = 50
+
+BUCKET = "tickets"
+# Supabase recommends TUS above 6 MB and requires exactly 6 MB chunks.
+RESUMABLE_THRESHOLD = 6 * 1024 * 1024
+RESUMABLE_CHUNK_SIZE = 6 * 1024 * 1024
+RESUMABLE_RETRIES = 3
+STREAM_PIECE_SIZE = 256 * 1024
+
+_lock = threading.Lock()
+_transport = None
+_anon_client = None
+_sessions: "OrderedDict[str, Client]" = OrderedDict()
+_refresh_locks = weakref.WeakValueDictionary()
+results = ResultCache()
+_stats = {
+    "clients_created": 0,
+    "connections_created": 0,
+    "session_hits": 0,
+    "token_refreshes": 0,
+}
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    """Shared HTTP transport that counts the connections its pool opens."""
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._seen = weakref.WeakSet()
+
+    def handle_request(self, request):
+        response = super().handle_request(request)
+        with _lock:
+            for conn in self._pool.connections:
+                if conn not in self._seen:
+                    self._seen.add(conn)
+                    _stats["connections_created"] += 1
+        return response
+
+
+def _get_transport() -> httpx.HTTPTransport:
+    global _transport
+    with _lock:
+        if _transport is None:
+            _transport = _CountingTransport(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            )
+        return _transport
+
+
+def _new_client() -> Client:
+    url = get_secret("supabase", "url")
+    key = get_secret("supabase", "key")
+    # Every client shares the process-wide transport (and its connection pool);
+    # only headers and auth state are per client.
+    http_client = httpx.Client(
+        transport=_get_transport(),
+        timeout=httpx.Timeout(30.0),
+        follow_redirects=True,
+    )
+    options = ClientOptions(
+        httpx_client=http_client,
+        auto_refresh_token=False,
+        persist_session=False,
+    )
+    client = create_client(url, key, options=options)
+    with _lock:
+        _stats["clients_created"] += 1
     return client
 
 
+def _get_anon_client() -> Client:
+    global _anon_client
+    if _anon_client is None:
+        client = _new_client()
+        with _lock:
+            if _anon_client is None:
+                _anon_client = client
+    return _anon_client
+
+
+def _token_expiry(access_token: str):
+    """The ``exp`` claim of a JWT access token, or None when it cannot be read."""
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _authorize(client: Client, access_token: str):
+    client.postgrest.auth(access_token)
+    client.storage._client.headers.update(
+        {"Authorization": f"Bearer {access_token}"}
+    )
+
+
+def _expiring(user: dict) -> bool:
+    # Without a readable expiry the token is left alone; a rejected one surfaces as an error.
+    expiry = _token_expiry(user["access_token"]) or user.get("expires_at")
+    return expiry is not None and expiry - time.time() <= TOKEN_REFRESH_MARGIN
+
+
+def _refresh_lock(user: dict) -> threading.Lock:
+    key = user.get("id") or user["refresh_token"]
+    with _lock:
+        lock = _refresh_locks.get(key)
+        if lock is None:
+            lock = _refresh_locks[key] = threading.Lock()
+        return lock
+
+
+def _refresh_if_expiring(user: dict):
+    if not _expiring(user):
+        return
+    # Refresh tokens are single use: concurrent reruns must not both spend it.
+    with _refresh_lock(user):
+        if _expiring(user):
+            _refresh(user)
+
+
+def _refresh(user: dict):
+    old_token = user["access_token"]
+    with _lock:
+        client = _sessions.pop(old_token, None)
+    if client is None:
+        client = _new_client()
+
+    response = client.auth.refresh_session(user["refresh_token"])
+    user["access_token"] = response.session.access_token
+    user["refresh_token"] = response.session.refresh_token
+    user["expires_at"] = response.session.expires_at
+    _authorize(client, user["access_token"])
+
+    with _lock:
+        _stats["token_refreshes"] += 1
+        _sessions[user["access_token"]] = client
+
+
+def _session_user():
+    # Only the Streamlit app has a session; headless callers pass ``user``.
+    st = sys.modules.get("streamlit")
+    if st is None:
+        return None
+    try:
+        return st.session_state.get("user")
+    except Exception:
+        return None
+
+
+def get_client(user: dict = None) -> Client:
+    user = user or _session_user()
+    if not (user and user.get("access_token") and user.get("refresh_token")):
+        return _get_anon_client()
+
+    _refresh_if_expiring(user)
+    access_token = user["access_token"]
+
+    with _lock:
+        client = _sessions.get(access_token)
+        if client is not None:
+            _sessions.move_to_end(access_token)
+            _stats["session_hits"] += 1
+            return client
+
+    client = _new_client()
+    client.auth.set_session(access_token, user["refresh_token"])
+    _authorize(client, access_token)
+
+    with _lock:
+        _sessions[access_token] = client
+        while len(_sessions) > MAX_CACHED_SESSIONS:
+            _sessions.popitem(last=False)
+    return client
+
+
+def forget_session(access_token: str):
+    """Drop the cached client for a session (e.g. on logout)."""
+    with _lock:
+        _sessions.pop(access_token, None)
+
+
+def get_pool_stats() -> dict:
+    """Counters for clients, connections and cached sessions in this process."""
+    with _lock:
+        return {**_stats, "cached_sessions": len(_sessions)}
+
+
+def get_cache_stats() -> dict:
+    """Hit/miss/eviction counters and size of the query result cache."""
+    return results.stats()
+
+
 def sign_in(email: str, password: str):
-    url = st.secrets["supabase"]["url"]
-    key = st.secrets["supabase"]["key"]
-    client = create_client(url, key)
+    client = _get_anon_client()
     response = client.auth.sign_in_with_password({"email": email, "password": password})
     return response
 
 
 def sign_up(email: str, password: str):
-    url = st.secrets["supabase"]["url"]
-    key = st.secrets["supabase"]["key"]
-    client = create_client(url, key)
+    client = _get_anon_client()
     response = client.auth.sign_up({"email": email, "password": password})
     return response
 
 
-def upload_file(file_bytes: bytes, file_name: str, mime_type: str) -> str:
-    client = get_client()
-    ext = file_name.rsplit(".", 1)[-1] if "." in file_name else "bin"
-    storage_path = f"{uuid.uuid4()}.{ext}"
+def _pieces(view: memoryview):
+    # The HTTP stack copies each piece it is given once, so keep them small.
+    for start in range(0, len(view), STREAM_PIECE_SIZE):
+        yield view[start:start + STREAM_PIECE_SIZE]
+
 
-    client.storage.from_("tickets").upload(
-        path=storage_path,
-        file=file_bytes,
-        file_options={"content-type": mime_type},
+def _upload_resumable(client: Client, storage_path: str, data: memoryview, mime_type: str):
+    """TUS upload in fixed-size chunks, resuming from the server's offset after a failure."""
+    storage = client.storage
+    http = storage._client
+    # Same apikey/Authorization headers storage3 sends with its own requests.
+    tus = {**storage._headers, "Tus-Resumable": "1.0.0"}
+    metadata = {
+        "bucketName": BUCKET,
+        "objectName": storage_path,
+        "contentType": mime_type,
+        "cacheControl": "3600",
+    }
+    response = http.post(
+        str(storage._base_url.joinpath("upload", "resumable")),
+        headers={
+            **tus,
+            "Upload-Length": str(len(data)),
+            "Upload-Metadata": ",".join(
+                f"{k} {base64.b64encode(v.encode()).decode()}" for k, v in metadata.items()
+            ),
+            "x-upsert": "true",
+        },
     )
+    response.raise_for_status()
+    location = response.headers["Location"]
+
+    offset = 0
+    failures = 0
+    while offset < len(data):
+        chunk = data[offset:offset + RESUMABLE_CHUNK_SIZE]
+        try:
+            response = http.patch(
+                location,
+                content=_pieces(chunk),
+                headers={
+                    **tus,
+                    "Upload-Offset": str(offset),
+                    "Content-Length": str(len(chunk)),
+                    "Content-Type": "application/offset+octet-stream",
+                },
+            )
+            response.raise_for_status()
+            offset = int(response.headers["Upload-Offset"])
+        except httpx.HTTPError:
+            failures += 1
+            if failures > RESUMABLE_RETRIES:
+                raise
+            response = http.head(location, headers=tus)
+            response.raise_for_status()
+            offset = int(response.headers["Upload-Offset"])
+
+
+def upload_file(file_bytes, file_name: str, mime_type: str, user_id: str, client: Client = None,
+                resumable_threshold: int = RESUMABLE_THRESHOLD, storage_path: str = None) -> str:
+    """Store ``file_bytes`` (any bytes-like object) in the user's folder of the tickets bucket.
+
+    Returns the object's URL. Files larger than ``resumable_threshold`` are
+    streamed through the resumable (TUS) endpoint straight from a view of
+    the caller's buffer.
+    """
+    client = client or get_client()
+    ext = file_name.rsplit(".", 1)[-1].lower() if "." in file_name else "bin"
+    data = memoryview(file_bytes)
+    # Content-addressed per user: the same bytes always map to the same object,
+    # and the existence check never depends on seeing another user's files.
+    storage_path = storage_path or f"{user_id}/{content_hash(data)}.{ext}"
+
+    bucket = client.storage.from_(BUCKET)
+    if not bucket.exists(storage_path):
+        if len(data) > resumable_threshold:
+            _upload_resumable(client, storage_path, data, mime_type)
+        else:
+            bucket.upload(
+                path=storage_path,
+                file=file_bytes if isinstance(file_bytes, bytes) else data.tobytes(),
+                file_options={"content-type": mime_type},
+            )
 
-    public_url = client.storage.from_("tickets").get_public_url(storage_path)
+    public_url = bucket.get_public_url(storage_path)
     return public_url
 
 
-def save_receipt(data: dict, user_id: str):
-    client = get_client()
-    row = {
+def _object_path(file_url: str) -> str:
+    # Object names before the per-user folders had no "/" of their own.
+    return file_url.split(f"/object/public/{BUCKET}/", 1)[-1]
+
+
+def upload_thumbnail(thumbnail: bytes, file_url: str, user_id: str, client: Client = None) -> str:
+    """Store a preview of the object at ``file_url`` in the user's folder; returns its URL."""
+    stem = _object_path(file_url).rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    return upload_file(thumbnail, "thumb.jpg", "image/jpeg", user_id, client=client,
+                       storage_path=f"{user_id}/{stem}.thumb.jpg")
+
+
+def download_file(file_url: str, client: Client = None) -> bytes:
+    client = client or get_client()
+    return client.storage.from_(BUCKET).download(_object_path(file_url))
+
+
+def _receipt_row(data: dict, user_id: str) -> dict:
+    return {
         "user_id": user_id,
+        "date": data.get("date"),
         "merchant": data.get("merchant"),
+        "merchant_raw": data.get("merchant_raw"),
+        "rfc": data.get("rfc"),
         "total": float(data.get("total", 0)),
         "currency": data.get("currency"),
         "category": data.get("category"),
         "summary": data.get("narrative_summary"),
         "items": data.get("items", []),
         "file_url": data.get("file_url"),
+        "original_url": data.get("original_url"),
+        "thumbnail_url": data.get("thumbnail_url"),
         "file_type": data.get("document_type"),
+        "content_hash": data.get("content_hash"),
     }
-    client.table("receipts").insert(row).execute()
 
 
-def get_user_receipts(user_id: str):
+def save_receipts(receipts: list, user_id: str, client: Client = None,
+                  batch_size: int = INSERT_BATCH_SIZE):
+    """Insert many receipts with one multi-row insert per batch.
+
+    Merchants are saved under their canonical names (``merchants.canonicalize``).
+    """
+    client = client or get_client()
+    receipts = canonicalize(receipts, get_merchants(user_id, client=client))
+    rows = [_receipt_row(data, user_id) for data in receipts]
+    for i in range(0, len(rows), batch_size):
+        client.table("receipts").insert(rows[i:i + batch_size]).execute()
+    results.invalidate(user_id)
+
+
+def get_user_receipts(user_id: str, columns: str = "*", limit: int = None, cursor: tuple = None,
+                      merchants: list = None, start: str = None, end: str = None,
+                      client: Client = None):
+    client = client or get_client()
+    query = client.table("receipts").select(columns).eq("user_id", user_id)
+
+    if merchants:
+        query = query.in_("merchant", merchants)
+    if start:
+        query = query.gte("created_at", start)
+    if end:
+        query = query.lt("created_at", end)
+
+    if cursor:
+        # Keyset pagination: rows strictly after (created_at, id) in DESC order.
+        created_at, receipt_id = cursor
+        query = query.or_(
+            f'created_at.lt."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.lt.{receipt_id})'
+        )
+
+    query = query.order("created_at", desc=True).order("id", desc=True)
+    if limit:
+        query = query.limit(limit)
+
+    response = query.execute()
+    return response.data
+
+
+def push_receipts(rows: list, client: Client = None):
+    """Insert rows created offline, keeping their ids; rows already present are skipped."""
+    client = client or get_client()
+    client.table("receipts").upsert(rows, on_conflict="id", ignore_duplicates=True).execute()
+
+
+def delete_receipts(receipt_ids: list, user_id: str, client: Client = None):
+    client = client or get_client()
+    client.table("receipts").delete().eq("user_id", user_id).in_("id", receipt_ids).execute()
+    results.invalidate(user_id)
+
+
+def get_receipt_changes(user_id: str, since: str = None, cursor: tuple = None,
+                        limit: int = 500, columns: str = "*", client: Client = None) -> list:
+    """Rows updated at or after ``since`` in (updated_at, id) order, after ``cursor``."""
+    client = client or get_client()
+    query = client.table("receipts").select(columns).eq("user_id", user_id)
+    if cursor:
+        updated_at, receipt_id = cursor
+        query = query.or_(
+            f'updated_at.gt."{updated_at}",'
+            f'and(updated_at.eq."{updated_at}",id.gt.{receipt_id})'
+        )
+    elif since:
+        query = query.gte("updated_at", since)
+    return query.order("updated_at").order("id").limit(limit).execute().data
+
+
+def get_tombstones(user_id: str, since: str = None, client: Client = None) -> list:
+    client = client or get_client()
+    query = client.table("receipt_tombstones").select("id, deleted_at").eq("user_id", user_id)
+    if since:
+        query = query.gte("deleted_at", since)
+    return query.order("deleted_at").execute().data
+
+
+def get_merchants(user_id: str, client: Client = None) -> list:
+    """The user's canonical merchants (id, name, rfc), oldest first."""
+    key = results.key("merchants")
+    cached = results.get(user_id, key)
+    if cached is not MISS:
+        return cached
+
+    client = client or get_client()
+    response = (
+        client.table("merchants").select("id, name, rfc").eq("user_id", user_id).order("id")
+        .execute()
+    )
+    results.put(user_id, key, response.data)
+    return response.data
+
+
+def rename_merchant(receipt_ids: list, user_id: str, merchant: str, merchant_raw: str,
+                    client: Client = None):
+    """Move receipts to the canonical ``merchant``; the trigger re-points merchant_id."""
+    client = client or get_client()
+    (
+        client.table("receipts")
+        .update({"merchant": merchant, "merchant_raw": merchant_raw})
+        .eq("user_id", user_id)
+        .in_("id", receipt_ids)
+        .execute()
+    )
+    results.invalidate(user_id)
+
+
+def delete_merchants(merchant_ids: list, user_id: str, client: Client = None):
+    client = client or get_client()
+    client.table("merchants").delete().eq("user_id", user_id).in_("id", merchant_ids).execute()
+    results.invalidate(user_id)
+
+
+def get_receipts_page(user_id: str, cursor: tuple = None, page_size: int = HISTORY_PAGE_SIZE,
+                      columns: str = HISTORY_COLUMNS, **filters):
+    """Fetch one page of receipts; returns (rows, next_cursor or None)."""
+    key = results.key(
+        "page", cursor=cursor, page_size=page_size, columns=columns, **filters
+    )
+    cached = results.get(user_id, key)
+    if cached is not MISS:
+        return cached
+
+    rows = get_user_receipts(
+        user_id, columns=columns, limit=page_size + 1, cursor=cursor, **filters
+    )
+    if len(rows) <= page_size:
+        page = (rows, None)
+    else:
+        rows = rows[:page_size]
+        page = (rows, (rows[-1]["created_at"], rows[-1]["id"]))
+
+    results.put(user_id, key, page)
+    return page
+
+
+def search_receipts(user_id: str, query: str, offset: int = 0,
+                    page_size: int = HISTORY_PAGE_SIZE, merchants: list = None,
+                    start: str = None, end: str = None):
+    """One page of receipts matching ``query``, best match first.
+
+    Returns (rows, next_offset or None); ranked results page by offset.
+    """
+    key = results.key(
+        "search", query=query, offset=offset, page_size=page_size, merchants=merchants,
+        start=start, end=end,
+    )
+    cached = results.get(user_id, key)
+    if cached is not MISS:
+        return cached
+
     client = get_client()
+    response = client.rpc("search_receipts", {
+        "p_user_id": user_id,
+        "p_query": query,
+        "p_limit": page_size + 1,
+        "p_offset": offset,
+        "p_merchants": merchants,
+        "p_start": start,
+        "p_end": end,
+    }).execute()
+    rows = response.data or []
+    if len(rows) <= page_size:
+        page = (rows, None)
+    else:
+        page = (rows[:page_size], offset + page_size)
+
+    results.put(user_id, key, page)
+    return page
+
+
+def find_saved_hashes(user_id: str, hashes: list, client: Client = None) -> dict:
+    """Map each already-saved content hash to its receipt row (id, merchant, created_at)."""
+    if not hashes:
+        return {}
+    client = client or get_client()
     response = (
         client.table("receipts")
-        .select("*")
+        .select("id, merchant, created_at, content_hash")
         .eq("user_id", user_id)
-        .order("created_at", desc=True)
+        .in_("content_hash", list(hashes))
         .execute()
     )
+    return {row["content_hash"]: row for row in response.data}
+
+
+def get_receipts_without_thumbnail(user_id: str, after: str = None, limit: int = 100,
+                                   client: Client = None) -> list:
+    """Rows with a stored file but no preview yet, in ``id`` order after ``after``."""
+    client = client or get_client()
+    query = (
+        client.table("receipts")
+        .select("id, file_url")
+        .eq("user_id", user_id)
+        .is_("thumbnail_url", "null")
+        .not_.is_("file_url", "null")
+    )
+    if after:
+        query = query.gt("id", after)
+    return query.order("id").limit(limit).execute().data
+
+
+def set_thumbnail_url(receipt_id: str, user_id: str, thumbnail_url: str, client: Client = None):
+    client = client or get_client()
+    (
+        client.table("receipts")
+        .update({"thumbnail_url": thumbnail_url})
+        .eq("id", receipt_id)
+        .eq("user_id", user_id)
+        .execute()
+    )
+    results.invalidate(user_id, "page")
+
+
+def get_filter_options(user_id: str) -> dict:
+    """Distinct merchants and years for the history filters."""
+    key = results.key("filter_options")
+    cached = results.get(user_id, key)
+    if cached is not MISS:
+        return cached
+
+    client = get_client()
+    response = client.rpc("receipt_filter_options", {"p_user_id": user_id}).execute()
+    data = response.data or {}
+    options = {
+        "merchants": data.get("merchants") or [],
+        "years": data.get("years") or [],
+    }
+    results.put(user_id, key, options)
+    return options
+
+
+def get_receipt_stats(user_id: str, top_merchants: int = 10, currency: str = None) -> dict:
+    """Aggregated spend for the STATS page, computed by the receipt_stats RPC.
+
+    With ``currency``, amounts are converted to it with the user's fx_rates.
+    """
+    key = results.key("stats", top_merchants=top_merchants, currency=currency)
+    cached = results.get(user_id, key)
+    if cached is not MISS:
+        return cached
+
+    client = get_client()
+    response = client.rpc(
+        "receipt_stats",
+        {"p_user_id": user_id, "p_top_merchants": top_merchants, "p_currency": currency},
+    ).execute()
+    results.put(user_id, key, response.data)
     return response.data
 
 
+def save_fx_rates(rows: list, user_id: str, client: Client = None, batch_size: int = 1000):
+    """Upsert ``(currency, date, rate)`` rows into the user's fx_rates."""
+    client = client or get_client()
+    records = [
+        {"user_id": user_id, "currency": currency, "date": day, "rate": rate}
+        for currency, day, rate in rows
+    ]
+    for i in range(0, len(records), batch_size):
+        (
+            client.table("fx_rates")
+            .upsert(records[i:i + batch_size], on_conflict="user_id,currency,date")
+            .execute()
+        )
+    results.invalidate(user_id)
+
+
+def get_fx_rates(user_id: str, since: str = None, client: Client = None,
+                 page_size: int = 1000) -> list:
+    """The user's fx_rates, or those updated at or after ``since``, paged past the row limit."""
+    client = client or get_client()
+    rows = []
+    while True:
+        query = (
+            client.table("fx_rates").select("currency, date, rate, updated_at")
+            .eq("user_id", user_id)
+        )
+        if since:
+            query = query.gte("updated_at", since)
+        response = (
+            query.order("updated_at").order("currency").order("date")
+            .range(len(rows), len(rows) + page_size - 1)
+            .execute()
+        )
+        rows.extend(response.data)
+        if len(response.data) < page_size:
+            return rows
+
+
+def get_item_stats(user_id: str, top_items: int = 10) -> dict:
+    """Top line items by spend, computed by the receipt_item_stats RPC."""
+    key = results.key("item_stats", top_items=top_items)
+    cached = results.get(user_id, key)
+    if cached is not MISS:
+        return cached
+
+    client = get_client()
+    response = client.rpc(
+        "receipt_item_stats", {"p_user_id": user_id, "p_top_items": top_items}
+    ).execute()
+    results.put(user_id, key, response.data)
+    return response.data
+
+
+def get_item_price_history(user_id: str, query: str) -> list:
+    """Unit price over time of items whose name contains ``query``, per merchant."""
+    key = results.key("item_history", query=query)
+    cached = results.get(user_id, key)
+    if cached is not MISS:
+        return cached
+
+    client = get_client()
+    response = client.rpc(
+        "item_price_history", {"p_user_id": user_id, "p_query": query}
+    ).execute()
+    results.put(user_id, key, response.data or [])
+    return response.data or []
+
+
 def delete_receipt(receipt_id: str, user_id: str):
     client = get_client()
     client.table("receipts").delete().eq("id", receipt_id).eq("user_id", user_id).execute()
+
+    # Cached pages stay valid under keyset pagination once the row is removed.
+    results.patch(
+        user_id,
+        "page",
+        lambda page: ([r for r in page[0] if r["id"] != receipt_id], page[1]),
+    )
+    results.invalidate(user_id, "stats")
+    results.invalidate(user_id, "filter_options")
+    results.invalidate(user_id, "frame")
+    results.invalidate(user_id, "item_stats")
+    results.invalidate(user_id, "item_history")
+    results.invalidate(user_id, "search")
@@ -0,0 +1,193 @@
+from datetime import datetime, timedelta
+import threading
+import logging
+import time
+
+from modules import local_db
+from modules.supabase_client import (
+    get_client,
+    push_receipts,
+    delete_receipts,
+    get_receipt_changes,
+    get_tombstones,
+    save_fx_rates,
+    get_fx_rates,
+    INSERT_BATCH_SIZE,
+)
+
+
+logger = logging.getLogger(__name__)
+
+SYNC_INTERVAL = 30
+SYNC_PAGE_SIZE = 500
+# Pulls re-read this much before the watermark: transactions that started
+# earlier can commit (with an older updated_at) after a pull has run.
+SYNC_OVERLAP = timedelta(seconds=60)
+MAX_BACKOFF = 600
+# The columns the replica keeps; the generated search vector stays in Supabase.
+SYNC_COLUMNS = ", ".join(local_db.REMOTE_COLUMNS)
+
+
+class SyncEngine:
+    """Background push/pull between the local replica and Supabase.
+
+    Each registered user is synced every ``interval`` seconds, or sooner
+    after ``wake``: pending local inserts, deletes and imported FX rates are
+    pushed first, then rows, tombstones and rates changed since the user's
+    watermarks are pulled. A failing user backs off exponentially without
+    holding up the others.
+    """
+
+    def __init__(self, store, interval: float = SYNC_INTERVAL):
+        self._store = store
+        self._interval = interval
+        self._lock = threading.Lock()
+        # One sync at a time, whether from the loop or a caller of sync_user.
+        self._sync_lock = threading.Lock()
+        self._users = {}
+        self._status = {}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def register(self, user: dict):
+        """Sync ``user`` in the background; the dict is shared so token refreshes carry over."""
+        with self._lock:
+            self._users[user["id"]] = user
+            self._status.setdefault(user["id"], {"synced_at": None, "error": None, "retry_at": 0})
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="receipt-sync", daemon=True)
+                self._thread.start()
+        self.wake()
+
+    def unregister(self, user_id: str):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def wake(self):
+        self._wake.set()
+
+    def status(self, user_id: str) -> dict:
+        with self._lock:
+            status = self._status.get(user_id) or {}
+        return {
+            "synced_at": status.get("synced_at"),
+            "error": status.get("error"),
+            "pending": self._store.call(local_db.count_pending, user_id),
+            # The newest remote change pulled, kept across restarts.
+            "pulled_until": self._store.call(local_db.get_sync_state, user_id)["pulled_until"],
+        }
+
+    def sync_user(self, user: dict) -> dict:
+        """Push then pull one user now; returns counts of what moved."""
+        with self._sync_lock:
+            client = get_client(user)
+            pushed, deleted = self._push(user["id"], client)
+            self._push_rates(user["id"], client)
+            pulled, removed = self._pull(user["id"], client)
+            rates = self._pull_rates(user["id"], client)
+        with self._lock:
+            self._status[user["id"]] = {"synced_at": time.time(), "error": None, "retry_at": 0}
+        return {
+            "pushed": pushed, "deleted": deleted, "pulled": pulled, "removed": removed,
+            "rates": rates,
+        }
+
+    def _push(self, user_id: str, client) -> tuple:
+        pushed = 0
+        while True:
+            rows = self._store.call(local_db.pending_pushes, user_id, INSERT_BATCH_SIZE)
+            if not rows:
+                break
+            push_receipts(rows, client=client)
+            self._store.call(local_db.mark_pushed, [row["id"] for row in rows])
+            pushed += len(rows)
+
+        receipt_ids = self._store.call(local_db.pending_deletes, user_id)
+        for i in range(0, len(receipt_ids), INSERT_BATCH_SIZE):
+            batch = receipt_ids[i:i + INSERT_BATCH_SIZE]
+            delete_receipts(batch, user_id, client=client)
+            self._store.call(local_db.purge, batch)
+        return pushed, len(receipt_ids)
+
+    def _pull(self, user_id: str, client) -> tuple:
+        watermark = self._store.call(local_db.get_sync_state, user_id)["pulled_until"]
+        since = None
+        if watermark:
+            since = (datetime.fromisoformat(watermark) - SYNC_OVERLAP).isoformat()
+
+        pulled = 0
+        newest = watermark
+        cursor = None
+        while True:
+            rows = get_receipt_changes(
+                user_id, since=since, cursor=cursor, limit=SYNC_PAGE_SIZE,
+                columns=SYNC_COLUMNS, client=client,
+            )
+            if rows:
+                pulled += self._store.call(local_db.apply_remote, user_id, rows)
+                newest = max(newest or "", local_db.iso_timestamp(rows[-1]["updated_at"]))
+                cursor = (rows[-1]["updated_at"], rows[-1]["id"])
+            if len(rows) < SYNC_PAGE_SIZE:
+                break
+
+        removed = 0
+        if since:
+            tombstones = get_tombstones(user_id, since=since, client=client)
+            if tombstones:
+                removed = self._store.call(
+                    local_db.apply_tombstones, user_id, [t["id"] for t in tombstones]
+                )
+                newest = max(newest or "", local_db.iso_timestamp(tombstones[-1]["deleted_at"]))
+
+        self._store.call(local_db.set_sync_state, user_id, newest)
+        if pulled or removed:
+            self._store.changed(user_id)
+        return pulled, removed
+
+    def _push_rates(self, user_id: str, client):
+        rows = self._store.call(local_db.pending_fx_rates, user_id)
+        if rows:
+            save_fx_rates(rows, user_id, client=client)
+            self._store.call(local_db.mark_fx_pushed, user_id, rows)
+
+    def _pull_rates(self, user_id: str, client) -> int:
+        """Pull FX rates changed since the rates watermark; returns how many changed here."""
+        watermark = self._store.call(local_db.get_sync_state, user_id)["fx_pulled_until"]
+        since = None
+        if watermark:
+            since = (datetime.fromisoformat(watermark) - SYNC_OVERLAP).isoformat()
+
+        rows = get_fx_rates(user_id, since=since, client=client)
+        if not rows:
+            return 0
+        changed = self._store.call(local_db.apply_remote_fx_rates, user_id, rows)
+        newest = max(local_db.iso_timestamp(row["updated_at"]) for row in rows)
+        self._store.call(local_db.set_fx_sync_state, user_id, max(watermark or "", newest))
+        if changed:
+            self._store.changed(user_id)
+        return changed
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            with self._lock:
+                users = list(self._users.values())
+            for user in users:
+                with self._lock:
+                    status = self._status.get(user["id"], {})
+                if status.get("retry_at", 0) > time.time():
+                    continue
+                try:
+                    self.sync_user(user)
+                except Exception as e:
+                    logger.warning(f"Sync failed for user {user['id']}: {e}")
+                    with self._lock:
+                        failures = status.get("failures", 0) + 1
+                        self._status[user["id"]] = {
+                            **status,
+                            "error": str(e),
+                            "failures": failures,
+                            "retry_at": time.time()
+                            + min(MAX_BACKOFF, self._interval * 2 ** (failures - 1)),
+                        }
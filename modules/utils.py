@@ -1,5 +1,16 @@
+from datetime import datetime
 import streamlit as st
 import pandas as pd
+import numpy as np
+import html
+import time
+
+
+HISTORY_WINDOW = 50
+CARD_COLUMNS = [
+    "id", "merchant", "created_at", "total", "currency", "category", "summary",
+    "file_url", "thumbnail_url",
+]
 
 
 def load_css():
@@ -65,6 +76,50 @@ def load_css():
         .card-content {
             /* Inner content style */
         }
+        .card-content.with-thumb {
+            display: flex;
+            gap: 12px;
+        }
+        .card-content.with-thumb .card-body {
+            flex: 1;
+            min-width: 0;
+        }
+        /* Batched list: one HTML block, off-screen cards skip layout and paint */
+        .receipt-card {
+            background: white;
+            border: 1px solid #DCE1E5;
+            border-radius: 4px;
+            padding: 16px;
+            margin-bottom: 12px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.03);
+            content-visibility: auto;
+            contain-intrinsic-size: auto 110px;
+        }
+        .card-view {
+            text-decoration: none;
+            color: white !important;
+            background-color: #5C8BB5;
+            font-size: 11px;
+            font-weight: 700;
+            border: 1px solid white;
+            padding: 4px 8px;
+            border-radius: 4px;
+            text-transform: uppercase;
+        }
+        .card-footer {
+            display: flex;
+            justify-content: space-between;
+            align-items: flex-end;
+        }
+        .card-thumb {
+            width: 64px;
+            height: 64px;
+            object-fit: cover;
+            border: 1px solid #DCE1E5;
+            border-radius: 2px;
+            background: #E9ECEF;
+            flex-shrink: 0;
+        }
 
         .card-row {
             display: flex;
@@ -99,6 +154,17 @@ def load_css():
             margin-top: 8px;
         }
 
+        /* ===== SCAN JOB ROWS ===== */
+        .job-card {
+            background: white;
+            border: 1px dashed #DCE1E5;
+            border-radius: 4px;
+            padding: 10px 16px;
+            margin-bottom: 8px;
+        }
+        .job-card.failed { border-color: #C0392B; }
+        .job-card .card-category.failed { color: #C0392B; }
+
         /* ===== METRIC CARDS (Industrial) ===== */
         .metric-grid {
             display: grid;
@@ -304,7 +370,8 @@ def render_app_header():
     """, unsafe_allow_html=True)
 
 
-def render_receipt_card(merchant, date, total, currency, category, summary, file_url=None, key=None):
+def render_receipt_card(merchant, date, total, currency, category, summary, file_url=None, key=None,
+                        thumbnail_url=None):
     view_btn = ""
     if file_url:
         view_btn = (
@@ -316,6 +383,11 @@ def render_receipt_card(merchant, date, total, currency, category, summary, file
             f'View Ticket</a></div>'
         )
 
+    # The preview loads lazily; the full-size file is only fetched from "View Ticket".
+    thumb = ""
+    if thumbnail_url:
+        thumb = f'<img class="card-thumb" src="{thumbnail_url}" loading="lazy" alt="">'
+
     with st.container():
         st.markdown('<div class="receipt-card-marker" style="display:none;"></div>', unsafe_allow_html=True)
 
@@ -323,15 +395,17 @@ def render_receipt_card(merchant, date, total, currency, category, summary, file
 
         with c1:
             st.markdown(f"""
-                <div class="card-content">
-                    <div class="card-row">
-                        <span class="card-merchant">{merchant}</span>
-                        <span class="card-amount">{total:.2f} {currency}</span>
-                    </div>
-                    <div class="card-meta">{date} // {summary}</div>
-                    <div style="display: flex; justify-content: space-between; align-items: flex-end;">
-                        <span class="card-category">{category}</span>
-                        {view_btn}
+                <div class="card-content{' with-thumb' if thumb else ''}">{thumb}
+                    <div class="card-body">
+                        <div class="card-row">
+                            <span class="card-merchant">{merchant}</span>
+                            <span class="card-amount">{total:.2f} {currency}</span>
+                        </div>
+                        <div class="card-meta">{date} // {summary}</div>
+                        <div style="display: flex; justify-content: space-between; align-items: flex-end;">
+                            <span class="card-category">{category}</span>
+                            {view_btn}
+                        </div>
                     </div>
                 </div>
             """, unsafe_allow_html=True)
@@ -344,9 +418,118 @@ def render_receipt_card(merchant, date, total, currency, category, summary, file
     return False
 
 
-def render_metrics_dashboard(df):
-    """Render dashboard metric cards."""
+def _escape(values: pd.Series) -> pd.Series:
+    return (
+        values.str.replace("&", "&amp;", regex=False)
+        .str.replace("<", "&lt;", regex=False)
+        .str.replace(">", "&gt;", regex=False)
+        .str.replace('"', "&quot;", regex=False)
+        .str.replace("\n", " ", regex=False)
+    )
+
+
+def receipt_cards_html(rows) -> str:
+    """All receipt cards as one HTML string, built column-wise instead of per row."""
+    df = pd.DataFrame(list(rows), columns=CARD_COLUMNS)
     if df.empty:
+        return ""
+
+    merchant = _escape(df["merchant"].fillna("Unknown").astype(str))
+    date = df["created_at"].fillna("--").astype(str).str[:10]
+    total = pd.Series(np.char.mod("%.2f", pd.to_numeric(df["total"]).fillna(0).to_numpy()))
+    currency = _escape(df["currency"].fillna("USD").astype(str))
+    category = _escape(df["category"].fillna("OTHER").astype(str))
+    summary = _escape(df["summary"].fillna("").astype(str))
+
+    file_url = _escape(df["file_url"].fillna("").astype(str))
+    view = ('<a class="card-view" href="' + file_url + '" target="_blank">View Ticket</a>').where(
+        file_url != "", ""
+    )
+    thumb_url = _escape(df["thumbnail_url"].fillna("").astype(str))
+    has_thumb = thumb_url != ""
+    thumb = ('<img class="card-thumb" src="' + thumb_url + '" loading="lazy" alt="">').where(
+        has_thumb, ""
+    )
+    layout = pd.Series(np.where(has_thumb, "card-content with-thumb", "card-content"))
+
+    cards = (
+        '<div class="receipt-card"><div class="' + layout + '">' + thumb
+        + '<div class="card-body"><div class="card-row">'
+        + '<span class="card-merchant">' + merchant + '</span>'
+        + '<span class="card-amount">' + total + " " + currency + '</span></div>'
+        + '<div class="card-meta">' + date + " // " + summary + '</div>'
+        + '<div class="card-footer"><span class="card-category">' + category + '</span>'
+        + view + '</div></div></div></div>'
+    )
+    return cards.str.cat()
+
+
+def render_receipt_list(rows, key, window=HISTORY_WINDOW):
+    """Render receipts ``window`` cards at a time as a single HTML block.
+
+    Deleting goes through one selection control instead of a button per
+    card. Returns the ids the user chose to delete (empty otherwise).
+    """
+    start = 0
+    if len(rows) > window:
+        windows = list(range(0, len(rows), window))
+        start = st.radio(
+            "Showing",
+            windows,
+            format_func=lambda i: f"{i + 1}-{min(i + window, len(rows))}",
+            horizontal=True,
+            key=f"{key}_window",
+        )
+    visible = rows[start:start + window]
+
+    st.markdown(
+        f'<div class="receipt-list">{receipt_cards_html(visible)}</div>',
+        unsafe_allow_html=True,
+    )
+
+    labels = {
+        row["id"]: f"{row.get('merchant') or 'Unknown'} · {float(row.get('total') or 0):.2f} "
+                   f"{row.get('currency') or ''} · {str(row.get('created_at') or '--')[:10]}"
+        for row in visible
+    }
+    c1, c2 = st.columns([0.75, 0.25], vertical_alignment="bottom")
+    selected = c1.multiselect(
+        "Delete receipts",
+        list(labels),
+        format_func=labels.get,
+        placeholder="Select receipts to delete...",
+        key=f"{key}_delete",
+    )
+    if c2.button("Delete", key=f"{key}_delete_btn", type="secondary",
+                 disabled=not selected, use_container_width=True):
+        return selected
+    return []
+
+
+def render_job_card(name, status, error=None, key=None):
+    """Render a queued/processing/failed scan job. Returns True when dismissed."""
+    failed = status == "failed"
+    css = " failed" if failed else ""
+    detail = error if failed else "Analyzing..." if status == "processing" else "Waiting in queue"
+
+    st.markdown(f"""
+        <div class="job-card{css}">
+            <div class="card-row">
+                <span class="card-merchant">{html.escape(name or "")}</span>
+                <span class="card-category{css}">{status}</span>
+            </div>
+            <div class="card-meta">{html.escape(detail or "")}</div>
+        </div>
+    """, unsafe_allow_html=True)
+
+    if failed:
+        return st.button("Dismiss", key=key, type="secondary", use_container_width=True)
+    return False
+
+
+def render_metrics_dashboard(stats):
+    """Render dashboard metric cards from pre-aggregated stats."""
+    if not stats or not stats.get("receipt_count"):
         st.markdown("""
             <div class="empty-state">
                 <div class="icon">--</div>
@@ -355,29 +538,176 @@ def render_metrics_dashboard(df):
         """, unsafe_allow_html=True)
         return
 
-    df['total'] = pd.to_numeric(df['total'], errors='coerce').fillna(0)
-    total_spent = df['total'].sum()
-    receipt_count = len(df)
-    unique_merchants = df['merchant'].nunique()
+    # One featured card per currency; amounts in different currencies are never added
+    # (with a reporting currency, only those without an FX rate stay apart).
+    featured = "".join(
+        f"""
+            <div class="metric-card featured">
+                <div class="metric-value">
+                    {float(t['total']):,.2f} {html.escape(str(t['currency']))}
+                </div>
+                <div class="metric-label">Total Spend</div>
+            </div>"""
+        for t in stats["totals"]
+    )
 
     st.markdown(f"""
         <div class="metric-grid">
-            <div class="metric-card featured">
-                <div class="metric-value">${total_spent:,.2f}</div>
-                <div class="metric-label">Total Spend</div>
-            </div>
+            {featured}
             <div class="metric-card">
-                <div class="metric-value">{receipt_count}</div>
+                <div class="metric-value">{stats['receipt_count']}</div>
                 <div class="metric-label">Tickets</div>
             </div>
             <div class="metric-card">
-                <div class="metric-value">{unique_merchants}</div>
+                <div class="metric-value">{stats['merchant_count']}</div>
                 <div class="metric-label">Merchants</div>
             </div>
         </div>
     """, unsafe_allow_html=True)
 
 
+def render_tier_stats(stats):
+    """Render how scans were served: CFDI XML, local rules, text to the model, or the file."""
+    if not stats or not stats.get("total"):
+        return
+
+    labels = {
+        "cfdi": "CFDI XML",
+        "local": "Served Locally",
+        "text": "OCR Text",
+        "image": "Full Image",
+    }
+    cards = ""
+    for tier, t in stats["tiers"].items():
+        css = " featured" if tier in ("cfdi", "local") else ""
+        latency = f"{t['avg_latency']:.1f}s" if t["avg_latency"] is not None else "--"
+        cards += f"""
+            <div class="metric-card{css}">
+                <div class="metric-value">{100 * t['share']:.0f}%</div>
+                <div class="metric-label">{labels[tier]} &middot; {latency}</div>
+            </div>"""
+
+    st.markdown('<div class="section-title">Extraction Tiers</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="metric-grid">{cards}</div>', unsafe_allow_html=True)
+
+
+def render_usage_stats(usage):
+    """Render the model calls and tokens this process has spent, as from get_usage_totals."""
+    if not usage or not usage.get("calls"):
+        return
+
+    calls = usage["calls"]
+    values = [
+        (f"{calls:,}", "Model Calls"),
+        (f"{usage['input_tokens']:,}", f"Input Tokens &middot; {usage['cached_tokens']:,} cached"),
+        (f"{usage['output_tokens']:,}", "Output Tokens"),
+        (f"{(usage['input_tokens'] + usage['output_tokens']) / calls:,.0f}", "Tokens per Call"),
+    ]
+    cards = "".join(f"""
+            <div class="metric-card">
+                <div class="metric-value">{value}</div>
+                <div class="metric-label">{label}</div>
+            </div>""" for value, label in values)
+
+    st.markdown('<div class="section-title">Token Usage</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="metric-grid">{cards}</div>', unsafe_allow_html=True)
+
+
+def render_backend_stats(pool, cache):
+    """Render this process's Supabase client reuse and query result cache counters."""
+    lookups = cache["hits"] + cache["misses"]
+    if not lookups and not pool["clients_created"]:
+        return
+
+    hit_rate = f"{100 * cache['hits'] / lookups:.0f}%" if lookups else "--"
+    values = [
+        (pool["cached_sessions"], "Cached Sessions"),
+        (pool["connections_created"], "Connections Opened"),
+        (pool["token_refreshes"], "Token Refreshes"),
+        (hit_rate, f"Cache Hits &middot; {cache['entries']} entries"),
+    ]
+    cards = "".join(f"""
+            <div class="metric-card">
+                <div class="metric-value">{value}</div>
+                <div class="metric-label">{label}</div>
+            </div>""" for value, label in values)
+
+    st.markdown('<div class="section-title">Backend</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="metric-grid">{cards}</div>', unsafe_allow_html=True)
+
+
+def render_spend_chart(rows, index, title, color):
+    """Render a bar chart of pre-aggregated spend rows, one series per currency."""
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return
+
+    df = df[df["total"] > 0]
+    if df.empty:
+        return
+
+    chart = df.pivot_table(
+        index=index, columns="currency", values="total", aggfunc="sum", fill_value=0
+    )
+
+    st.markdown(f'<div class="section-title">{title}</div>', unsafe_allow_html=True)
+    st.bar_chart(chart, color=color if chart.shape[1] == 1 else None)
+
+
+def render_price_history(rows, query):
+    """Line chart of an item's unit price over time, one series per merchant and currency."""
+    df = pd.DataFrame(rows)
+    if df.empty:
+        render_empty_state(f'No items match "{html.escape(query)}"')
+        return
+
+    df["date"] = pd.to_datetime(df["date"])
+    df["series"] = df["merchant"] + " (" + df["currency"] + ")"
+    chart = df.pivot_table(index="date", columns="series", values="unit_price", aggfunc="mean")
+
+    st.markdown('<div class="section-title">Price History</div>', unsafe_allow_html=True)
+    st.line_chart(chart)
+
+
+def _synced_ago(status) -> str:
+    if status["synced_at"]:
+        synced = status["synced_at"]
+    elif status["pulled_until"]:
+        synced = datetime.fromisoformat(status["pulled_until"]).timestamp()
+    else:
+        return ""
+    minutes = int(max(0, time.time() - synced) // 60)
+    if minutes < 1:
+        return "just now"
+    if minutes < 60:
+        return f"{minutes} min ago"
+    if minutes < 24 * 60:
+        return f"{minutes // 60} h ago"
+    return datetime.fromtimestamp(synced).strftime("%Y-%m-%d %H:%M")
+
+
+def render_sync_status(status):
+    """One line with the last sync and any changes not yet in Supabase."""
+    if not status:
+        return
+    pending = status["pending"]
+    changes = f"{pending} change{'s' if pending != 1 else ''}"
+    ago = _synced_ago(status)
+    if status["error"]:
+        message = "Offline"
+        if pending:
+            message += f" &middot; {changes} waiting to sync"
+        if ago:
+            message += f" &middot; last synced {ago}"
+    elif not ago:
+        message = "Loading your receipts..."
+    elif pending:
+        message = f"Syncing {changes}..."
+    else:
+        message = f"Synced {ago}"
+    st.markdown(f'<div class="card-meta">{message}</div>', unsafe_allow_html=True)
+
+
 def render_empty_state(message="No receipts found."):
     """Render a clean empty state."""
     st.markdown(f"""
@@ -0,0 +1,28 @@
+-- Distinct merchants and years used to fill the HISTORY filter widgets.
+create or replace function public.receipt_filter_options(p_user_id uuid)
+returns json
+language sql
+stable
+security invoker
+as $$
+  select json_build_object(
+    'merchants', coalesce((
+      select json_agg(merchant order by merchant)
+      from (
+        select distinct merchant
+        from public.receipts
+        where user_id = p_user_id and merchant is not null
+      ) m
+    ), '[]'::json),
+    'years', coalesce((
+      select json_agg(year order by year desc)
+      from (
+        select distinct extract(year from created_at)::int as year
+        from public.receipts
+        where user_id = p_user_id and created_at is not null
+      ) y
+    ), '[]'::json)
+  );
+$$;
+
+grant execute on function public.receipt_filter_options(uuid) to authenticated;
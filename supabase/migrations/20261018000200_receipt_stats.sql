@@ -0,0 +1,67 @@
+-- Pre-aggregated numbers for the STATS page. Amounts are never summed
+-- across currencies: every total is grouped by currency.
+create or replace function public.receipt_stats(p_user_id uuid, p_top_merchants int default 10)
+returns json
+language sql
+stable
+security invoker
+as $$
+  with r as (
+    select
+      merchant,
+      coalesce(category, 'Other') as category,
+      coalesce(currency, 'N/A') as currency,
+      coalesce(total, 0) as total,
+      created_at
+    from public.receipts
+    where user_id = p_user_id
+  )
+  select json_build_object(
+    'receipt_count', (select count(*) from r),
+    'merchant_count', (select count(distinct merchant) from r),
+    'totals', coalesce((
+      select json_agg(t order by t.total desc)
+      from (
+        select currency, sum(total) as total, count(*) as receipts
+        from r
+        group by currency
+      ) t
+    ), '[]'::json),
+    'by_category', coalesce((
+      select json_agg(t order by t.total desc)
+      from (
+        select category, currency, sum(total) as total
+        from r
+        group by category, currency
+      ) t
+    ), '[]'::json),
+    'by_merchant', coalesce((
+      select json_agg(t order by t.total desc)
+      from (
+        select merchant, currency, total
+        from (
+          select
+            merchant,
+            currency,
+            sum(total) as total,
+            row_number() over (partition by currency order by sum(total) desc) as rank
+          from r
+          where merchant is not null
+          group by merchant, currency
+        ) ranked
+        where rank <= p_top_merchants
+      ) t
+    ), '[]'::json),
+    'by_month', coalesce((
+      select json_agg(t order by t.month)
+      from (
+        select to_char(date_trunc('month', created_at), 'YYYY-MM') as month, currency, sum(total) as total
+        from r
+        where created_at is not null
+        group by 1, currency
+      ) t
+    ), '[]'::json)
+  );
+$$;
+
+grant execute on function public.receipt_stats(uuid, int) to authenticated;
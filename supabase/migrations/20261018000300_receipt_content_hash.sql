@@ -0,0 +1,6 @@
+-- SHA-256 of the uploaded file, used to detect receipts that are already saved.
+alter table public.receipts add column if not exists content_hash text;
+
+create index if not exists receipts_user_content_hash_idx
+  on public.receipts (user_id, content_hash)
+  where content_hash is not null;
@@ -0,0 +1,2 @@
+-- Unprocessed upload, kept only when preprocessing is asked to preserve it.
+alter table public.receipts add column if not exists original_url text;
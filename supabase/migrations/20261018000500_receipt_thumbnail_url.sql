@@ -0,0 +1,2 @@
+-- Small JPEG preview stored next to file_url; HISTORY shows it inline.
+alter table public.receipts add column if not exists thumbnail_url text;
@@ -0,0 +1,180 @@
+-- Line items normalized out of receipts.items so item questions run in SQL.
+-- Rows are derived: the trigger below writes them when receipts are inserted
+-- and they go away with their receipt.
+create extension if not exists pg_trgm with schema extensions;
+
+-- Lowercase ASCII words; keep in step with modules/line_items.normalize_item.
+create or replace function public.normalize_item_name(p_name text)
+returns text
+language sql
+immutable
+as $$
+  select btrim(regexp_replace(
+    translate(lower(coalesce(p_name, '')), 'áàäâãéèëêíìïîóòöôõúùüûñç', 'aaaaaeeeeiiiiooooouuuunc'),
+    '[^a-z0-9]+', ' ', 'g'
+  ));
+$$;
+
+create or replace function public.try_numeric(p_value text)
+returns numeric
+language plpgsql
+immutable
+as $$
+begin
+  return nullif(regexp_replace(p_value, '[^0-9.\-]', '', 'g'), '')::numeric;
+exception when others then
+  return null;
+end;
+$$;
+
+create table if not exists public.receipt_items (
+  receipt_id uuid not null references public.receipts (id) on delete cascade,
+  position int not null,
+  user_id uuid not null,
+  name text not null,
+  name_normalized text not null,
+  -- Line amount as printed; unit price is price / quantity.
+  price numeric(12, 2) not null default 0,
+  quantity numeric(12, 3) not null default 1,
+  primary key (receipt_id, position)
+);
+
+create index if not exists receipt_items_user_name_idx
+  on public.receipt_items (user_id, name_normalized);
+
+create index if not exists receipt_items_name_trgm_idx
+  on public.receipt_items using gin (name_normalized extensions.gin_trgm_ops);
+
+alter table public.receipt_items enable row level security;
+
+drop policy if exists "receipt_items_owner" on public.receipt_items;
+create policy "receipt_items_owner" on public.receipt_items
+  for all to authenticated
+  using (user_id = auth.uid())
+  with check (user_id = auth.uid());
+
+-- The items of one receipt's JSON array, in the shape of receipt_items.
+create or replace function public.receipt_item_rows(p_items jsonb)
+returns table (
+  position int, name text, name_normalized text, price numeric, quantity numeric
+)
+language sql
+immutable
+as $$
+  select
+    e.position::int,
+    btrim(e.item ->> 'item'),
+    public.normalize_item_name(e.item ->> 'item'),
+    coalesce(public.try_numeric(e.item ->> 'price'), 0),
+    coalesce(nullif(greatest(public.try_numeric(e.item ->> 'quantity'), 0), 0), 1)
+  from jsonb_array_elements(
+    case when jsonb_typeof(p_items) = 'array' then p_items else '[]'::jsonb end
+  ) with ordinality as e(item, position)
+  where jsonb_typeof(e.item) = 'object'
+    and public.normalize_item_name(e.item ->> 'item') <> '';
+$$;
+
+-- One insert per statement, so a multi-row save writes all its items at once.
+create or replace function public.receipt_items_on_insert()
+returns trigger
+language plpgsql
+security invoker
+as $$
+begin
+  insert into public.receipt_items
+    (receipt_id, position, user_id, name, name_normalized, price, quantity)
+  select r.id, i.position, r.user_id, i.name, i.name_normalized, i.price, i.quantity
+  from new_rows r
+  cross join lateral public.receipt_item_rows(r.items::jsonb) i
+  where r.user_id is not null;
+  return null;
+end;
+$$;
+
+drop trigger if exists receipts_items_insert on public.receipts;
+create trigger receipts_items_insert
+  after insert on public.receipts
+  referencing new table as new_rows
+  for each statement
+  execute function public.receipt_items_on_insert();
+
+-- Backfill receipts saved before this migration.
+insert into public.receipt_items
+  (receipt_id, position, user_id, name, name_normalized, price, quantity)
+select r.id, i.position, r.user_id, i.name, i.name_normalized, i.price, i.quantity
+from public.receipts r
+cross join lateral public.receipt_item_rows(r.items::jsonb) i
+where r.user_id is not null
+on conflict (receipt_id, position) do nothing;
+
+-- Top items by spend, ranked per currency like receipt_stats.by_merchant.
+create or replace function public.receipt_item_stats(p_user_id uuid, p_top_items int default 10)
+returns json
+language sql
+stable
+security invoker
+as $$
+  with i as (
+    select
+      i.name,
+      i.name_normalized,
+      i.price,
+      i.quantity,
+      i.receipt_id,
+      coalesce(r.currency, 'N/A') as currency
+    from public.receipt_items i
+    join public.receipts r on r.id = i.receipt_id
+    where i.user_id = p_user_id
+  )
+  select json_build_object(
+    'item_count', (select count(distinct name_normalized) from i),
+    'top_items', coalesce((
+      select json_agg(t order by t.total desc)
+      from (
+        select name, currency, total, quantity, receipts
+        from (
+          select
+            mode() within group (order by name) as name,
+            currency,
+            sum(price) as total,
+            sum(quantity) as quantity,
+            count(distinct receipt_id) as receipts,
+            row_number() over (partition by currency order by sum(price) desc) as rank
+          from i
+          group by name_normalized, currency
+        ) ranked
+        where rank <= p_top_items
+      ) t
+    ), '[]'::json)
+  );
+$$;
+
+-- Unit price of every purchase of items matching p_query, oldest first.
+create or replace function public.item_price_history(p_user_id uuid, p_query text,
+                                                     p_limit int default 500)
+returns json
+language sql
+stable
+security invoker
+as $$
+  select coalesce(json_agg(t order by t.date), '[]'::json)
+  from (
+    select
+      r.created_at::date as date,
+      coalesce(r.merchant, 'Unknown') as merchant,
+      i.name,
+      coalesce(r.currency, 'N/A') as currency,
+      round(i.price / nullif(i.quantity, 0), 2) as unit_price,
+      i.quantity
+    from public.receipt_items i
+    join public.receipts r on r.id = i.receipt_id
+    where i.user_id = p_user_id
+      and public.normalize_item_name(p_query) <> ''
+      and i.name_normalized like '%' || public.normalize_item_name(p_query) || '%'
+    order by r.created_at desc
+    limit p_limit
+  ) t;
+$$;
+
+grant execute on function public.receipt_item_stats(uuid, int) to authenticated;
+grant execute on function public.item_price_history(uuid, text, int) to authenticated;
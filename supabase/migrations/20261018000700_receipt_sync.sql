@@ -0,0 +1,62 @@
+-- Change tracking for the app's local SQLite replica: every write bumps
+-- updated_at and every delete leaves a tombstone, so clients pull only the
+-- rows changed since their last watermark.
+alter table public.receipts
+  add column if not exists updated_at timestamptz not null default now();
+
+create or replace function public.touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.updated_at := clock_timestamp();
+  return new;
+end;
+$$;
+
+drop trigger if exists receipts_touch_updated_at on public.receipts;
+create trigger receipts_touch_updated_at
+  before update on public.receipts
+  for each row
+  execute function public.touch_updated_at();
+
+create index if not exists receipts_user_updated_idx
+  on public.receipts (user_id, updated_at, id);
+
+create table if not exists public.receipt_tombstones (
+  id uuid primary key,
+  user_id uuid not null,
+  deleted_at timestamptz not null default clock_timestamp()
+);
+
+create index if not exists receipt_tombstones_user_deleted_idx
+  on public.receipt_tombstones (user_id, deleted_at);
+
+alter table public.receipt_tombstones enable row level security;
+
+drop policy if exists "receipt_tombstones_owner" on public.receipt_tombstones;
+create policy "receipt_tombstones_owner" on public.receipt_tombstones
+  for select to authenticated
+  using (user_id = auth.uid());
+
+-- Definer rights: users only ever read tombstones, the trigger writes them.
+create or replace function public.receipts_tombstone_on_delete()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+  insert into public.receipt_tombstones (id, user_id)
+  select id, user_id from old_rows where user_id is not null
+  on conflict (id) do update set deleted_at = excluded.deleted_at;
+  return null;
+end;
+$$;
+
+drop trigger if exists receipts_tombstone_delete on public.receipts;
+create trigger receipts_tombstone_delete
+  after delete on public.receipts
+  referencing old table as old_rows
+  for each statement
+  execute function public.receipts_tombstone_on_delete();
@@ -0,0 +1,19 @@
+-- One schema for both stores: receipts.db (modules/local_db.MIGRATIONS) now
+-- uses these column names, and the receipt date it keeps is stored here too.
+alter table public.receipts add column if not exists date date;
+
+-- HISTORY: newest first per user with the (created_at, id) keyset cursor.
+-- The included columns are the ones receipt_stats aggregates, so STATS and
+-- the year list of receipt_filter_options are index-only scans.
+create index if not exists receipts_user_created_idx
+  on public.receipts (user_id, created_at desc, id desc)
+  include (merchant, category, currency, total);
+
+-- HISTORY with a merchant filter, and the merchant list of receipt_filter_options.
+create index if not exists receipts_user_merchant_idx
+  on public.receipts (user_id, merchant, created_at desc, id desc);
+
+-- receipt_item_stats and item_price_history join items to receipts by id
+-- (the primary key) after filtering on receipt_items.user_id.
+
+analyze public.receipts;
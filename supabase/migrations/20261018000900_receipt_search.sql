@@ -0,0 +1,118 @@
+-- Full-text search for HISTORY over merchant, item names and summary.
+-- Words are accent-folded and Spanish-stemmed, and a trigram index on the
+-- merchant also finds misspelt names ("farmasia"). The local replica keeps
+-- the same index in SQLite FTS5 (modules/search).
+create extension if not exists unaccent with schema extensions;
+
+do $$
+begin
+  if not exists (
+    select 1 from pg_ts_config
+    where cfgname = 'spanish_unaccent' and cfgnamespace = 'public'::regnamespace
+  ) then
+    create text search configuration public.spanish_unaccent (copy = pg_catalog.spanish);
+    alter text search configuration public.spanish_unaccent
+      alter mapping for hword, hword_part, word with extensions.unaccent, spanish_stem;
+  end if;
+end
+$$;
+
+create or replace function public.receipt_item_names(p_items jsonb)
+returns text
+language sql
+immutable
+as $$
+  select coalesce(string_agg(name, ' ' order by position), '')
+  from public.receipt_item_rows(p_items);
+$$;
+
+-- Weights rank merchant matches above item names above the summary.
+alter table public.receipts add column if not exists search tsvector
+  generated always as (
+    setweight(to_tsvector('public.spanish_unaccent'::regconfig, coalesce(merchant, '')), 'A')
+    || setweight(
+      to_tsvector('public.spanish_unaccent'::regconfig, public.receipt_item_names(items::jsonb)),
+      'B'
+    )
+    || setweight(to_tsvector('public.spanish_unaccent'::regconfig, coalesce(summary, '')), 'C')
+  ) stored;
+
+create index if not exists receipts_search_idx
+  on public.receipts using gin (search);
+
+create index if not exists receipts_merchant_trgm_idx
+  on public.receipts using gin (public.normalize_item_name(merchant) extensions.gin_trgm_ops);
+
+-- Every word required; the last one also matches as a prefix while typing.
+create or replace function public.receipt_search_query(p_query text)
+returns tsquery
+language sql
+immutable
+as $$
+  select to_tsquery(
+    'public.spanish_unaccent'::regconfig,
+    string_agg(w.word, ' & ' order by w.n) || ':*'
+  )
+  from regexp_split_to_table(public.normalize_item_name(p_query), ' ')
+    with ordinality as w(word, n)
+  where w.word <> '';
+$$;
+
+-- One page of HISTORY rows matching p_query, best match first, with the
+-- same optional merchant and date filters as the plain HISTORY query.
+-- Only the 2000 newest matches are ranked, as in receipts.db
+-- (local_db.SEARCH_CANDIDATES), so a broad query stays cheap.
+create or replace function public.search_receipts(
+  p_user_id uuid,
+  p_query text,
+  p_limit int default 20,
+  p_offset int default 0,
+  p_merchants text[] default null,
+  p_start timestamptz default null,
+  p_end timestamptz default null
+)
+returns json
+language sql
+stable
+security invoker
+as $$
+  with q as (
+    select
+      public.receipt_search_query(p_query) as query,
+      public.normalize_item_name(p_query) as words
+  ),
+  candidates as (
+    select r.*
+    from public.receipts r, q
+    where r.user_id = p_user_id
+      and q.words <> ''
+      and (
+        r.search @@ q.query
+        or q.words operator(extensions.<%) public.normalize_item_name(r.merchant)
+      )
+      and (p_merchants is null or r.merchant = any(p_merchants))
+      and (p_start is null or r.created_at >= p_start)
+      and (p_end is null or r.created_at < p_end)
+    order by r.created_at desc, r.id desc
+    limit 2000
+  )
+  select coalesce(
+    jsonb_agg(to_jsonb(t) - 'rank' order by t.rank desc, t.created_at desc, t.id desc),
+    '[]'::jsonb
+  )::json
+  from (
+    select
+      c.id, c.created_at, c.merchant, c.total, c.currency, c.category, c.summary,
+      c.file_url, c.thumbnail_url, c.file_type,
+      ts_rank(c.search, q.query)
+        + extensions.word_similarity(q.words, public.normalize_item_name(c.merchant)) as rank
+    from candidates c, q
+    order by rank desc, c.created_at desc, c.id desc
+    limit p_limit
+    offset p_offset
+  ) t;
+$$;
+
+grant execute on function
+  public.search_receipts(uuid, text, int, int, text[], timestamptz, timestamptz)
+  to authenticated;
@@ -0,0 +1,148 @@
+-- Canonical merchants per user. The app picks the canonical name when it
+-- saves a receipt (modules/merchants); each distinct canonical name is one
+-- merchants row, and receipts point at it through merchant_id so STATS
+-- groups on a small integer instead of free text.
+create table if not exists public.merchants (
+  id bigint generated always as identity primary key,
+  user_id uuid not null,
+  -- normalize_item_name(name), same as receipts.db
+  key text not null,
+  name text not null,
+  -- Issuer RFC of the merchant's Facturas, when one has been seen.
+  rfc text,
+  unique (user_id, key)
+);
+
+alter table public.merchants enable row level security;
+
+drop policy if exists "merchants_owner" on public.merchants;
+create policy "merchants_owner" on public.merchants
+  for all to authenticated
+  using (user_id = auth.uid())
+  with check (user_id = auth.uid());
+
+alter table public.receipts
+  add column if not exists merchant_id bigint references public.merchants (id) on delete set null,
+  -- The name as extracted, before canonicalization.
+  add column if not exists merchant_raw text,
+  add column if not exists rfc text;
+
+create index if not exists receipts_merchant_id_idx on public.receipts (merchant_id);
+
+-- STATS now reads merchant_id; keep it an index-only scan.
+drop index if exists public.receipts_user_created_idx;
+create index receipts_user_created_idx
+  on public.receipts (user_id, created_at desc, id desc)
+  include (merchant_id, merchant, category, currency, total);
+
+create or replace function public.receipts_assign_merchant()
+returns trigger
+language plpgsql
+security invoker
+as $$
+declare
+  v_key text := public.normalize_item_name(new.merchant);
+begin
+  if new.user_id is null or v_key = '' then
+    new.merchant_id := null;
+    return new;
+  end if;
+
+  select id into new.merchant_id
+  from public.merchants
+  where user_id = new.user_id and key = v_key;
+
+  if new.merchant_id is null then
+    insert into public.merchants (user_id, key, name, rfc)
+    values (new.user_id, v_key, new.merchant, new.rfc)
+    on conflict (user_id, key) do nothing
+    returning id into new.merchant_id;
+    -- A concurrent insert created it first.
+    if new.merchant_id is null then
+      select id into new.merchant_id
+      from public.merchants
+      where user_id = new.user_id and key = v_key;
+    end if;
+  elsif new.rfc is not null then
+    update public.merchants set rfc = new.rfc
+    where id = new.merchant_id and rfc is null;
+  end if;
+  return new;
+end;
+$$;
+
+drop trigger if exists receipts_assign_merchant on public.receipts;
+create trigger receipts_assign_merchant
+  before insert or update of merchant, rfc on public.receipts
+  for each row
+  execute function public.receipts_assign_merchant();
+
+-- Existing rows get the merchant of their exact name; backfill_merchants.py
+-- then merges the spellings of one merchant.
+update public.receipts set merchant = merchant where merchant_id is null;
+
+-- Same result as before, with merchants counted and ranked by merchant_id.
+create or replace function public.receipt_stats(p_user_id uuid, p_top_merchants int default 10)
+returns json
+language sql
+stable
+security invoker
+as $$
+  with r as (
+    select
+      merchant_id,
+      coalesce(category, 'Other') as category,
+      coalesce(currency, 'N/A') as currency,
+      coalesce(total, 0) as total,
+      created_at
+    from public.receipts
+    where user_id = p_user_id
+  )
+  select json_build_object(
+    'receipt_count', (select count(*) from r),
+    'merchant_count', (select count(distinct merchant_id) from r),
+    'totals', coalesce((
+      select json_agg(t order by t.total desc)
+      from (
+        select currency, sum(total) as total, count(*) as receipts
+        from r
+        group by currency
+      ) t
+    ), '[]'::json),
+    'by_category', coalesce((
+      select json_agg(t order by t.total desc)
+      from (
+        select category, currency, sum(total) as total
+        from r
+        group by category, currency
+      ) t
+    ), '[]'::json),
+    'by_merchant', coalesce((
+      select json_agg(t order by t.total desc)
+      from (
+        select m.name as merchant, ranked.currency, ranked.total
+        from (
+          select
+            merchant_id,
+            currency,
+            sum(total) as total,
+            row_number() over (partition by currency order by sum(total) desc) as rank
+          from r
+          where merchant_id is not null
+          group by merchant_id, currency
+        ) ranked
+        join public.merchants m on m.id = ranked.merchant_id
+        where ranked.rank <= p_top_merchants
+      ) t
+    ), '[]'::json),
+    'by_month', coalesce((
+      select json_agg(t order by t.month)
+      from (
+        select to_char(date_trunc('month', created_at), 'YYYY-MM') as month, currency, sum(total) as total
+        from r
+        where created_at is not null
+        group by 1, currency
+      ) t
+    ), '[]'::json)
+  );
+$$;
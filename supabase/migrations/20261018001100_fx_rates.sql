@@ -0,0 +1,149 @@
+-- Daily FX rates for converting STATS to a reporting currency. Each user
+-- imports their own from a file (import_fx_rates.py); receipts.db keeps a
+-- synced copy per user. rate is in units of the currency per one USD, so
+-- USD itself needs no rows.
+create table if not exists public.fx_rates (
+  user_id uuid not null,
+  currency text not null,
+  date date not null,
+  rate numeric not null check (rate > 0),
+  -- Bumped on every write; receipts.db pulls the rates changed since its
+  -- last watermark, as for receipts. Rates are never deleted.
+  updated_at timestamptz not null default clock_timestamp(),
+  primary key (user_id, currency, date)
+);
+
+drop trigger if exists fx_rates_touch_updated_at on public.fx_rates;
+create trigger fx_rates_touch_updated_at
+  before update on public.fx_rates
+  for each row
+  execute function public.touch_updated_at();
+
+create index if not exists fx_rates_user_updated_idx
+  on public.fx_rates (user_id, updated_at);
+
+alter table public.fx_rates enable row level security;
+
+drop policy if exists "fx_rates_owner" on public.fx_rates;
+create policy "fx_rates_owner" on public.fx_rates
+  for all to authenticated
+  using (user_id = auth.uid())
+  with check (user_id = auth.uid());
+
+-- The last rate on or before p_day (weekends and holidays have none);
+-- null before the first one. One primary-key probe.
+create or replace function public.fx_rate(p_user_id uuid, p_currency text, p_day date)
+returns numeric
+language sql
+stable
+security invoker
+as $$
+  select case when p_currency = 'USD' then 1::numeric else (
+    select rate
+    from public.fx_rates
+    where user_id = p_user_id and currency = p_currency and date <= p_day
+    order by date desc
+    limit 1
+  ) end;
+$$;
+
+-- receipt_stats with an optional reporting currency. Rates are looked up
+-- once per distinct (currency, day), not per receipt; receipts without
+-- both rates keep their own currency. The receipt date falls back to the
+-- UTC day it was saved.
+drop function if exists public.receipt_stats(uuid, int);
+
+create or replace function public.receipt_stats(
+  p_user_id uuid,
+  p_top_merchants int default 10,
+  p_currency text default null
+)
+returns json
+language sql
+stable
+security invoker
+as $$
+  with b as (
+    select
+      merchant_id,
+      coalesce(category, 'Other') as category,
+      coalesce(currency, 'N/A') as currency,
+      coalesce(total, 0) as total,
+      created_at,
+      coalesce(date, (created_at at time zone 'UTC')::date) as day
+    from public.receipts
+    where user_id = p_user_id
+  ),
+  -- materialized: not inlined into the join, so once per pair.
+  f as materialized (
+    select
+      d.currency,
+      d.day,
+      case
+        when p_currency is null then null
+        when d.currency = p_currency then 1
+        else public.fx_rate(p_user_id, p_currency, d.day)
+          / public.fx_rate(p_user_id, d.currency, d.day)
+      end as factor
+    from (select distinct currency, day from b) d
+  ),
+  r as (
+    select
+      b.merchant_id,
+      b.category,
+      case when f.factor is null then b.currency else p_currency end as currency,
+      b.total * coalesce(f.factor, 1) as total,
+      b.created_at
+    from b
+    join f on f.currency = b.currency and f.day = b.day
+  )
+  select json_build_object(
+    'receipt_count', (select count(*) from r),
+    'merchant_count', (select count(distinct merchant_id) from r),
+    'totals', coalesce((
+      select json_agg(t order by t.total desc)
+      from (
+        select currency, sum(total) as total, count(*) as receipts
+        from r
+        group by currency
+      ) t
+    ), '[]'::json),
+    'by_category', coalesce((
+      select json_agg(t order by t.total desc)
+      from (
+        select category, currency, sum(total) as total
+        from r
+        group by category, currency
+      ) t
+    ), '[]'::json),
+    'by_merchant', coalesce((
+      select json_agg(t order by t.total desc)
+      from (
+        select m.name as merchant, ranked.currency, ranked.total
+        from (
+          select
+            merchant_id,
+            currency,
+            sum(total) as total,
+            row_number() over (partition by currency order by sum(total) desc) as rank
+          from r
+          where merchant_id is not null
+          group by merchant_id, currency
+        ) ranked
+        join public.merchants m on m.id = ranked.merchant_id
+        where ranked.rank <= p_top_merchants
+      ) t
+    ), '[]'::json),
+    'by_month', coalesce((
+      select json_agg(t order by t.month)
+      from (
+        select to_char(date_trunc('month', created_at), 'YYYY-MM') as month, currency, sum(total) as total
+        from r
+        where created_at is not null
+        group by 1, currency
+      ) t
+    ), '[]'::json)
+  );
+$$;
+
+grant execute on function public.receipt_stats(uuid, int, text) to authenticated;
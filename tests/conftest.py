@@ -0,0 +1,20 @@
+import uuid
+
+import pytest
+
+from modules import storage
+
+
+@pytest.fixture
+def local_store(tmp_path, monkeypatch):
+    """A local-first store on a throwaway receipts.db."""
+    monkeypatch.setenv("STORAGE_LOCAL_FIRST", "true")
+    store = storage.LocalStore(str(tmp_path / "receipts.db"))
+    monkeypatch.setattr(storage, "_store", store)
+    return store
+
+
+@pytest.fixture
+def user_id():
+    # Fresh per test: cached results are keyed by user.
+    return str(uuid.uuid4())
@@ -0,0 +1,15 @@
+import io
+
+from PIL import Image
+
+from modules.ai_service import estimate_tokens, TOKENS_PER_TILE
+
+
+def test_estimate_tokens_accepts_any_buffer():
+    pdf = b"%PDF-1.7 /Type /Pages /Type /Page /Type /Page"
+    image = io.BytesIO()
+    Image.new("L", (1600, 700)).save(image, format="PNG")
+
+    for wrap in (bytes, bytearray, memoryview):
+        assert estimate_tokens(wrap(pdf), "application/pdf") == 2 * TOKENS_PER_TILE
+        assert estimate_tokens(wrap(image.getvalue()), "image/png") == 3 * TOKENS_PER_TILE
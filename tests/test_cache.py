@@ -0,0 +1,16 @@
+from modules.cache import ResultCache, MISS
+
+
+def test_patch_that_grows_an_entry_evicts():
+    cache = ResultCache(max_bytes=100)
+    old, new = ResultCache.key("receipts", page=1), ResultCache.key("receipts", page=2)
+    cache.put("user-1", old, ["a" * 20])
+    cache.put("user-1", new, ["b" * 20])
+
+    cache.patch("user-1", "receipts", lambda rows: rows + ["c" * 40])
+
+    stats = cache.stats()
+    assert stats["bytes"] <= cache.max_bytes
+    assert stats["evictions"] == 1
+    assert cache.get("user-1", old) is MISS
+    assert cache.get("user-1", new) == ["b" * 20, "c" * 40]
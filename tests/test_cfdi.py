@@ -0,0 +1,45 @@
+import zlib
+
+from modules.cfdi import embedded_cfdi, parse_cfdi
+
+
+CFDI = (
+    b'<?xml version="1.0" encoding="UTF-8"?>'
+    b'<cfdi:Comprobante xmlns:cfdi="http://www.sat.gob.mx/cfd/4" Total="116.00" Moneda="MXN">'
+    b'<cfdi:Emisor Rfc="WAL9709244W4" Nombre="Walmart"/>'
+    b'<cfdi:Conceptos><cfdi:Concepto Descripcion="Leche" Importe="{importe}" Cantidad="1"/>'
+    b"</cfdi:Conceptos></cfdi:Comprobante>"
+)
+
+
+def _pdf(*streams: bytes) -> bytes:
+    return b"%PDF-1.7\n" + b"".join(
+        b"1 0 obj\n<< /Filter /FlateDecode >>\nstream\n" + s + b"\nendstream\nendobj\n"
+        for s in streams
+    )
+
+
+def test_embedded_cfdi_is_inflated():
+    xml = CFDI.replace(b"{importe}", b"100.00")
+    pdf = _pdf(zlib.compress(b"BT /F1 12 Tf ET"), zlib.compress(xml))
+
+    assert embedded_cfdi(pdf) == xml
+    assert parse_cfdi(embedded_cfdi(pdf))["total"] == 116.0
+
+
+def test_large_streams_are_only_probed():
+    bomb = zlib.compress(b"\0" * (64 * 1024 * 1024), 9)
+
+    assert embedded_cfdi(_pdf(bomb)) is None
+
+
+def test_malformed_amount_is_not_a_cfdi():
+    assert parse_cfdi(CFDI.replace(b"{importe}", b"1,000.00")) is None
+
+
+def test_unknown_currency_falls_back_to_mxn():
+    xml = CFDI.replace(b"{importe}", b"100.00").replace(
+        b'Moneda="MXN"', b'Moneda="&lt;b&gt;usd&lt;/b&gt;"'
+    )
+
+    assert parse_cfdi(xml)["currency"] == "MXN"
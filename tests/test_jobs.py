@@ -0,0 +1,73 @@
+import pytest
+
+from modules.pipeline import ScanResult
+from modules.jobs import JobQueue
+from modules import jobs
+
+
+USER = {"id": "user-1"}
+FILES = [("factura.pdf", b"%PDF", "application/pdf"), ("factura.xml", b"<x/>", "text/xml")]
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "get_client", lambda user=None: None)
+    # One worker, so a no-op submitted after a batch runs once it has finished.
+    queue = JobQueue(str(tmp_path / "jobs.db"), max_batches=1)
+    yield queue
+    queue._pool.shutdown(wait=True)
+
+
+def _scan(pdf_error=None):
+    def scan_files(files, client, user_id=None):
+        yield ScanResult("factura.xml", index=1, attached_to=0)
+        if pdf_error:
+            yield ScanResult("factura.pdf", error=pdf_error, index=0)
+        else:
+            yield ScanResult("factura.pdf", data={"merchant": "Walmart", "total": 10}, index=0)
+    return scan_files
+
+
+def _statuses(queue):
+    return {job["name"]: job["status"] for job in queue.list_jobs(USER["id"])}
+
+
+def _finish(queue):
+    queue._pool.submit(lambda: None).result()
+    return _statuses(queue)
+
+
+def test_companion_xml_is_done_once_its_pdf_is_saved(queue, monkeypatch):
+    seen = []
+
+    def save_receipts(receipts, user_id, client=None):
+        seen.append(_statuses(queue))
+
+    monkeypatch.setattr(jobs, "scan_files", _scan())
+    monkeypatch.setattr(jobs, "save_receipts", save_receipts)
+    queue.submit(USER, FILES)
+
+    assert _finish(queue) == {"factura.pdf": "done", "factura.xml": "done"}
+    assert seen == [{"factura.pdf": "processing", "factura.xml": "processing"}]
+
+
+def test_companion_xml_fails_with_its_pdf(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "scan_files", _scan(pdf_error="Analysis failed"))
+    queue.submit(USER, FILES)
+
+    assert _finish(queue) == {"factura.pdf": "failed", "factura.xml": "failed"}
+
+
+def test_failure_mid_batch_fails_every_unfinished_job(queue, monkeypatch):
+    files = [(f"ticket{n}.jpg", b"jpg", "image/jpeg") for n in range(3)]
+
+    def scan_files(files, client, user_id=None):
+        yield ScanResult("ticket0.jpg", error="Analysis failed", index=0)
+        raise RuntimeError("worker died")
+
+    monkeypatch.setattr(jobs, "scan_files", scan_files)
+    queue.submit(USER, files)
+
+    assert set(_finish(queue).values()) == {"failed"}
+    assert queue._running == set()
+    assert queue.resume(USER) == 0
@@ -0,0 +1,30 @@
+from modules.local_extraction import MerchantTemplates
+
+
+FIELDS = {"document_type": "Ticket", "rfc": None}
+
+
+def _templates(tmp_path):
+    return MerchantTemplates(str(tmp_path / "merchant_templates.db"))
+
+
+def test_templates_are_per_user(tmp_path):
+    templates = _templates(tmp_path)
+    templates.learn("alice", {"merchant": "Soriana", "category": "Groceries"}, FIELDS)
+
+    assert templates.match("alice", ["TIENDAS SORIANA SA DE CV"])["merchant"] == "Soriana"
+    assert templates.match("bob", ["TIENDAS SORIANA SA DE CV"]) is None
+    # Reloaded from disk, still only Alice's.
+    assert _templates(tmp_path).match("bob", ["TIENDAS SORIANA SA DE CV"]) is None
+
+
+def test_match_needs_whole_words_on_one_line(tmp_path):
+    templates = _templates(tmp_path)
+    templates.learn("alice", {"merchant": "Sears"}, FIELDS)
+    templates.learn("alice", {"merchant": "Gas"}, FIELDS)
+    templates.learn("alice", {"merchant": "Home Depot"}, FIELDS)
+
+    assert templates.match("alice", ["SEARSON MARKET"]) is None
+    assert templates.match("alice", ["GAS NATURAL", "SUC CENTRO"]) is None
+    assert templates.match("alice", ["HOME", "DEPOT"]) is None
+    assert templates.match("alice", ["THE HOME DEPOT MEXICO"])["merchant"] == "Home Depot"
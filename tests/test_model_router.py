@@ -0,0 +1,131 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import Counter
+import threading
+import json
+import time
+
+from google.genai import types
+from google import genai
+import pytest
+
+from modules.model_router import ModelRouter, AllModelsFailed
+
+
+class FakeGemini(ThreadingHTTPServer):
+    """generateContent on localhost; ``behaviour`` maps a model to ok, 429, 503 or slow."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.behaviour = {}
+        self.hits = Counter()
+        self.slow_seconds = 1.0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        model = self.path.rsplit("/", 1)[-1].split(":")[0]
+        self.server.hits[model] += 1
+        behaviour = self.server.behaviour.get(model, "ok")
+        if behaviour == "slow":
+            time.sleep(self.server.slow_seconds)
+            behaviour = "ok"
+        if behaviour == "ok":
+            status, body = 200, {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": model}]}}],
+            }
+        else:
+            status = int(behaviour)
+            body = {"error": {"code": status, "message": "fake", "status": "UNAVAILABLE"}}
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except OSError:
+            pass  # The client timed out.
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gemini():
+    server = FakeGemini()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def generate(gemini):
+    client = genai.Client(api_key="test", http_options=types.HttpOptions(
+        base_url=gemini.url, retry_options=types.HttpRetryOptions(attempts=1),
+    ))
+
+    def generate(model, timeout):
+        config = types.GenerateContentConfig(
+            http_options=types.HttpOptions(timeout=int(timeout * 1000))
+        )
+        return client.models.generate_content(model=model, contents="hi", config=config).text
+
+    return generate
+
+
+def _router(**kwargs):
+    return ModelRouter(["flash", "lite"], base_delay=0, **kwargs)
+
+
+def test_falls_back_to_the_next_model(gemini, generate):
+    gemini.behaviour["flash"] = "503"
+    router = _router(attempts_per_model=2)
+
+    assert router.call(generate) == ("lite", "lite")
+    assert gemini.hits == {"flash": 2, "lite": 1}
+    stats = router.stats()
+    assert stats["flash"]["failures"] == 2
+    assert stats["lite"]["success_rate"] == 1.0
+
+
+def test_deadline_stops_a_slow_model(gemini, generate):
+    gemini.behaviour.update(flash="slow", lite="slow")
+    router = _router(deadline=0.5, attempt_timeout=0.3)
+
+    started = time.monotonic()
+    with pytest.raises(AllModelsFailed):
+        router.call(generate)
+    assert time.monotonic() - started < gemini.slow_seconds
+
+
+def test_breaker_opens_then_lets_one_trial_through(gemini, generate):
+    gemini.behaviour["flash"] = "429"
+    router = _router(attempts_per_model=1, breaker_threshold=2, breaker_cooldown=0.3)
+
+    router.call(generate)
+    assert router.stats()["flash"]["circuit"] == "closed"
+    router.call(generate)
+    assert router.stats()["flash"]["circuit"] == "open"
+    assert router.call(generate) == ("lite", "lite")
+    assert gemini.hits["flash"] == 2
+
+    time.sleep(0.3)
+    assert router.stats()["flash"]["circuit"] == "half_open"
+    gemini.behaviour["flash"] = "slow"
+    gemini.slow_seconds = 0.5
+    trial = threading.Thread(target=router.call, args=(generate,))
+    trial.start()
+    time.sleep(0.1)
+    # Only the trial reaches flash; everyone else fails fast to the next model.
+    assert router.call(generate) == ("lite", "lite")
+    trial.join()
+
+    assert gemini.hits["flash"] == 3
+    assert router.stats()["flash"]["circuit"] == "closed"
+    assert router.call(generate) == ("flash", "flash")
@@ -0,0 +1,22 @@
+import pytest
+
+from benchmarks.query_plans import populate, run_checks, CHECKS
+from modules import local_db
+
+
+@pytest.fixture(scope="module")
+def plans(tmp_path_factory):
+    conn = local_db.connect(str(tmp_path_factory.mktemp("plans") / "receipts.db"))
+    user_ids = populate(conn, rows=500, users=3)
+    results = run_checks(conn, user_ids[0])
+    conn.close()
+    return results
+
+
+@pytest.mark.parametrize("name", CHECKS)
+def test_read_is_index_served(plans, name):
+    ran = [(plan, bad) for check, plan, bad in plans if check == name]
+
+    assert ran, f"{name} ran no SELECT"
+    for plan, bad in ran:
+        assert not bad, "\n".join(plan)
@@ -0,0 +1,47 @@
+import csv
+import io
+
+from modules import local_db
+from modules.receipt_frame import build_export
+
+
+def _receipt(merchant, total, currency="MXN"):
+    return {"merchant": merchant, "total": total, "currency": currency, "category": "Food",
+            "narrative_summary": f"Compra en {merchant}.", "items": []}
+
+
+def _rows(data: bytes) -> list:
+    return list(csv.DictReader(io.StringIO(data.decode("utf-8"))))
+
+
+def test_export_ignores_search_query(local_store, user_id):
+    local_store.call(
+        local_db.save_receipts, [_receipt("Oxxo", 50), _receipt("Soriana", 120)], user_id
+    )
+    filters = {"query": "oxxo", "merchants": [], "start": None, "end": None}
+
+    rows = _rows(build_export(user_id, filters))
+
+    assert sorted(row["merchant"] for row in rows) == ["Oxxo", "Soriana"]
+
+
+def test_export_applies_merchant_filter(local_store, user_id):
+    local_store.call(
+        local_db.save_receipts, [_receipt("Oxxo", 50), _receipt("Soriana", 120)], user_id
+    )
+    filters = {"query": "", "merchants": ["Soriana"], "start": None, "end": None}
+
+    rows = _rows(build_export(user_id, filters))
+
+    assert [row["merchant"] for row in rows] == ["Soriana"]
+    assert float(rows[0]["total"]) == 120.0
+
+
+def test_export_adds_converted_total(local_store, user_id):
+    local_store.call(local_db.save_receipts, [_receipt("Amazon", 10, "USD")], user_id)
+    local_store.call(local_db.save_fx_rates, [("MXN", "2020-01-01", 20.0)], user_id)
+    filters = {"query": "", "merchants": [], "start": None, "end": None}
+
+    rows = _rows(build_export(user_id, filters, currency="MXN"))
+
+    assert float(rows[0]["total_mxn"]) == 200.0
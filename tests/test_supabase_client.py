@@ -0,0 +1,172 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import OrderedDict, Counter
+import threading
+import base64
+import json
+import time
+
+import pytest
+
+from modules.extraction_cache import content_hash
+from modules import supabase_client
+
+
+def _jwt(subject: str, expires_in: float) -> str:
+    def part(value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).rstrip(b"=").decode()
+    claims = {"sub": subject, "exp": int(time.time() + expires_in), "role": "authenticated"}
+    return f"{part({'alg': 'HS256', 'typ': 'JWT'})}.{part(claims)}.sig"
+
+
+class StubSupabase(ThreadingHTTPServer):
+    """Just enough of GoTrue, PostgREST and Storage: token refresh, a table read, uploads."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.hits = Counter()
+        self.refreshed = []
+        self.authorizations = []
+        self.objects = {}
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, body, status: int = 200):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _user(self, subject: str) -> dict:
+        return {
+            "id": subject, "aud": "authenticated", "app_metadata": {}, "user_metadata": {},
+            "created_at": "2026-01-01T00:00:00Z",
+        }
+
+    def do_HEAD(self):
+        path = self.path.split("/object/tickets/", 1)[-1]
+        self.send_response(200 if path in self.server.objects else 404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        path = self.path.split("?")[0]
+        self.server.hits[path] += 1
+        if path.startswith("/storage/v1/object/tickets/"):
+            key = path.split("/object/tickets/", 1)[1]
+            self.server.objects[key] = data
+            self._reply({"Key": f"tickets/{key}"})
+            return
+
+        body = json.loads(data)
+        # Slow enough for concurrent callers to pile up behind the refresh.
+        time.sleep(0.05)
+        self.server.refreshed.append(body["refresh_token"])
+        count = len(self.server.refreshed)
+        self._reply({
+            "access_token": _jwt("user-1", 3600), "refresh_token": f"refresh-{count + 1}",
+            "token_type": "bearer", "expires_in": 3600, "expires_at": int(time.time() + 3600),
+            "user": self._user("user-1"),
+        })
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        self.server.hits[path] += 1
+        if path == "/auth/v1/user":
+            self._reply(self._user("user-1"))
+        else:
+            self.server.authorizations.append(self.headers["Authorization"])
+            self._reply([])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = StubSupabase()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("SUPABASE_URL", server.url)
+    monkeypatch.setenv("SUPABASE_KEY", _jwt("anon", 3600))
+    # A fresh pool and session cache, so the counters only see this test.
+    monkeypatch.setattr(supabase_client, "_transport", None)
+    monkeypatch.setattr(supabase_client, "_anon_client", None)
+    monkeypatch.setattr(supabase_client, "_sessions", OrderedDict())
+    monkeypatch.setattr(
+        supabase_client, "_stats", dict.fromkeys(supabase_client._stats, 0)
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _user(subject: str, expires_in: float = 3600) -> dict:
+    return {
+        "id": subject, "access_token": _jwt(subject, expires_in), "refresh_token": "refresh-1"
+    }
+
+
+def test_sessions_share_one_connection_pool(stub):
+    alice, bob = _user("alice"), _user("bob")
+    for _ in range(3):
+        for user in (alice, bob):
+            supabase_client.get_client(user).table("receipts").select("id").execute()
+
+    stats = supabase_client.get_pool_stats()
+    assert stats["clients_created"] == 2
+    assert stats["cached_sessions"] == 2
+    assert stats["session_hits"] == 4
+    assert stats["connections_created"] == 1
+    assert stub.authorizations == [f"Bearer {u['access_token']}" for u in (alice, bob)] * 3
+
+
+def test_concurrent_callers_refresh_once(stub):
+    user = _user("user-1", expires_in=10)
+    threads = [
+        threading.Thread(target=supabase_client.get_client, args=(user,)) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert stub.refreshed == ["refresh-1"]
+    assert user["refresh_token"] == "refresh-2"
+    assert supabase_client.get_pool_stats()["token_refreshes"] == 1
+    supabase_client.get_client(user).table("receipts").select("id").execute()
+    assert stub.authorizations == [f"Bearer {user['access_token']}"]
+
+
+def test_unreadable_token_falls_back_to_session_expiry(stub):
+    user = {"id": "user-1", "access_token": "opaque", "refresh_token": "refresh-1"}
+    supabase_client._refresh_if_expiring(user)
+    assert stub.refreshed == []
+
+    user["expires_at"] = time.time() - 1
+    supabase_client._refresh_if_expiring(user)
+    assert stub.refreshed == ["refresh-1"]
+    assert user["access_token"] != "opaque"
+
+
+def test_uploads_go_to_the_users_folder(stub):
+    alice = _user("alice")
+    client = supabase_client.get_client(alice)
+    digest = content_hash(b"receipt")
+
+    url = supabase_client.upload_file(b"receipt", "scan.JPG", "image/jpeg", "alice", client=client)
+    thumbnail_url = supabase_client.upload_thumbnail(b"preview", url, "alice", client=client)
+    # Already stored: the same bytes are not uploaded again.
+    supabase_client.upload_file(b"receipt", "again.jpg", "image/jpeg", "alice", client=client)
+
+    assert url.endswith(f"/tickets/alice/{digest}.jpg")
+    assert thumbnail_url.endswith(f"/tickets/alice/{digest}.thumb.jpg")
+    assert sorted(stub.objects) == [f"alice/{digest}.jpg", f"alice/{digest}.thumb.jpg"]
+    assert stub.hits[f"/storage/v1/object/tickets/alice/{digest}.jpg"] == 1
@@ -0,0 +1,133 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from modules import local_db, sync
+from modules.supabase_client import results
+from modules.sync import SyncEngine
+
+
+class FakeSupabase:
+    """The receipts, tombstones and FX rates of one Supabase project, in memory."""
+
+    def __init__(self):
+        self.rows = {}
+        self.tombstones = []
+        self.rates = {}
+        self.on_push = None
+
+    def _stamp(self):
+        return datetime.now(timezone.utc).isoformat()
+
+    def push_receipts(self, rows, client=None):
+        if self.on_push:
+            self.on_push(rows)
+        for row in rows:
+            self.rows.setdefault(row["id"], {**row, "updated_at": self._stamp()})
+
+    def delete_receipts(self, receipt_ids, user_id, client=None):
+        for receipt_id in receipt_ids:
+            if self.rows.pop(receipt_id, None) is not None:
+                self.tombstones.append({"id": receipt_id, "deleted_at": self._stamp()})
+
+    def get_receipt_changes(self, user_id, since=None, cursor=None, limit=None, columns=None,
+                            client=None):
+        rows = sorted(self.rows.values(), key=lambda r: (r["updated_at"], r["id"]))
+        if since:
+            rows = [r for r in rows if r["updated_at"] >= since]
+        if cursor:
+            rows = [r for r in rows if (r["updated_at"], r["id"]) > tuple(cursor)]
+        return [dict(r) for r in rows[:limit]]
+
+    def get_tombstones(self, user_id, since=None, client=None):
+        return [t for t in self.tombstones if not since or t["deleted_at"] >= since]
+
+    def save_fx_rates(self, rows, user_id, client=None):
+        for currency, day, rate in rows:
+            self.rates[(currency, day)] = {
+                "currency": currency, "date": day, "rate": rate, "updated_at": self._stamp()
+            }
+
+    def get_fx_rates(self, user_id, since=None, client=None):
+        rows = sorted(self.rates.values(), key=lambda r: r["updated_at"])
+        return [dict(r) for r in rows if not since or r["updated_at"] >= since]
+
+
+@pytest.fixture
+def remote(monkeypatch):
+    fake = FakeSupabase()
+    for name in ("push_receipts", "delete_receipts", "get_receipt_changes", "get_tombstones",
+                 "save_fx_rates", "get_fx_rates"):
+        monkeypatch.setattr(sync, name, getattr(fake, name))
+    monkeypatch.setattr(sync, "get_client", lambda user=None: None)
+    return fake
+
+
+def _save(store, user_id, merchant="Oxxo"):
+    store.call(
+        local_db.save_receipts,
+        [{"merchant": merchant, "total": 10, "currency": "MXN", "items": []}],
+        user_id, pending=True,
+    )
+    return store.call(local_db.get_user_receipts, user_id, columns="id")[0]["id"]
+
+
+def test_delete_during_push_is_not_pulled_back(local_store, remote, user_id):
+    receipt_id = _save(local_store, user_id)
+    # The user deletes the row while its push is on the wire.
+    remote.on_push = lambda rows: local_store.call(local_db.delete_receipt, receipt_id, user_id)
+
+    SyncEngine(local_store).sync_user({"id": user_id})
+    remote.on_push = None
+    SyncEngine(local_store).sync_user({"id": user_id})
+
+    assert receipt_id not in remote.rows
+    assert local_store.call(local_db.get_user_receipts, user_id) == []
+    assert local_store.call(local_db.count_pending, user_id) == 0
+
+
+def test_overlapping_pull_keeps_cached_results(local_store, remote, user_id):
+    _save(local_store, user_id)
+    engine = SyncEngine(local_store)
+    engine.sync_user({"id": user_id})
+    engine.sync_user({"id": user_id})
+
+    key = results.key("frame")
+    results.put(user_id, key, "cached", size=1)
+    counts = engine.sync_user({"id": user_id})
+
+    assert counts["pulled"] == 0
+    assert results.get(user_id, key) == "cached"
+
+
+def test_remote_update_is_pulled(local_store, remote, user_id):
+    receipt_id = _save(local_store, user_id)
+    engine = SyncEngine(local_store)
+    engine.sync_user({"id": user_id})
+
+    remote.rows[receipt_id].update(
+        merchant="Soriana", updated_at=datetime.now(timezone.utc).isoformat()
+    )
+    counts = engine.sync_user({"id": user_id})
+
+    assert counts["pulled"] == 1
+    rows = local_store.call(local_db.get_user_receipts, user_id, columns="merchant")
+    assert rows == [{"merchant": "Soriana"}]
+
+
+def test_fx_rates_are_pushed_and_pulled(local_store, remote, user_id):
+    local_store.call(local_db.save_fx_rates, [("MXN", "2026-10-16", 18.35)], user_id, pending=True)
+    engine = SyncEngine(local_store)
+    engine.sync_user({"id": user_id})
+
+    assert remote.rates[("MXN", "2026-10-16")]["rate"] == 18.35
+    assert local_store.call(local_db.pending_fx_rates, user_id) == []
+
+    remote.save_fx_rates([("MXN", "2026-10-16", 18.4)], user_id)
+    counts = engine.sync_user({"id": user_id})
+
+    assert counts["rates"] == 1
+    rates = local_store.call(local_db.get_fx_rates, user_id)
+    assert rates == [{"currency": "MXN", "date": "2026-10-16", "rate": 18.4}]
+    # Another user's copy of receipts.db stays empty.
+    assert local_store.call(local_db.get_fx_rates, "someone-else") == []